@@ -51,8 +51,9 @@ class MessageTemplateAdmin(admin.ModelAdmin):
 
 @admin.register(ConversationFlag)
 class ConversationFlagAdmin(admin.ModelAdmin):
-    list_display = ('conversation', 'flagged_by', 'reason', 'status', 'created_at')
+    list_display = ('conversation', 'flagged_by', 'reason', 'priority', 'status', 'assigned_to', 'created_at')
     list_filter = ('reason', 'status', 'created_at')
+    list_select_related = ('conversation__property', 'flagged_by', 'assigned_to')
     search_fields = ('conversation__id', 'flagged_by__username', 'description')
     readonly_fields = ('created_at',)
     
@@ -11,3 +11,5 @@ class MessagingConfig(AppConfig):
         # Configure logging for messaging app
         logger = logging.getLogger('messaging')
         logger.setLevel(logging.INFO)
+        
+        import messaging.signals  # Register signals
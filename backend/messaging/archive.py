@@ -0,0 +1,246 @@
+# backend/messaging/archive.py
+import gzip
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.core import serializers
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import transaction
+
+from .models import AttachmentUpload, ConversationFlag, Message, MessageArchiveSegment
+
+logger = logging.getLogger('messaging.archive')
+
+# (created_at, id), the order history is paginated in
+Position = Tuple[datetime, int]
+
+
+def message_position(message) -> Position:
+    return (message.created_at, message.id)
+
+
+class MessageArchiveService:
+    """
+    Move messages of archived conversations to cold storage.
+
+    Messages are written in (created_at, id) order to gzipped JSONL
+    segments of up to SEGMENT_SIZE rows on the message_archive storage,
+    indexed by MessageArchiveSegment, and deleted from the messages
+    table in the same transaction as the index entry. The newest message
+    stays hot so inbox previews keep working, and so do messages that
+    moderation flags point at. Archived messages remain readable through
+    ArchivedHistory but are no longer full-text searchable.
+    """
+
+    SEGMENT_SIZE = 1000
+    STORAGE_ALIAS = 'message_archive'
+    CACHE_TIMEOUT = 300  # 5 minutes
+
+    # Everything but the generated search vector
+    FIELDS = [
+        field.name for field in Message._meta.concrete_fields
+        if not field.primary_key and not field.generated
+    ]
+
+    @classmethod
+    def storage(cls):
+        return storages[cls.STORAGE_ALIAS]
+
+    @classmethod
+    def archivable(cls, conversation_id: int, before: Optional[datetime] = None):
+        """Messages of a conversation that may move to cold storage"""
+        newest = Message.objects.filter(
+            conversation_id=conversation_id
+        ).order_by('-created_at', '-id').values_list('id', flat=True).first()
+
+        queryset = Message.objects.filter(
+            conversation_id=conversation_id
+        ).exclude(
+            id=newest
+        ).exclude(
+            id__in=ConversationFlag.objects.filter(
+                conversation_id=conversation_id,
+                message__isnull=False
+            ).values('message_id')
+        )
+        if before is not None:
+            queryset = queryset.filter(created_at__lt=before)
+        return queryset
+
+    @classmethod
+    def archive_conversation(cls, conversation_id: int, before: Optional[datetime] = None) -> int:
+        """Archive a conversation's messages; returns how many were moved"""
+        archived = 0
+        while True:
+            batch = list(
+                cls.archivable(conversation_id, before).order_by('created_at', 'id')[:cls.SEGMENT_SIZE]
+            )
+            if not batch:
+                return archived
+            cls.write_segment(conversation_id, batch)
+            archived += len(batch)
+
+    @classmethod
+    def write_segment(cls, conversation_id: int, messages: List[Message]) -> MessageArchiveSegment:
+        """Store one segment, then swap the rows for its index entry"""
+        from .services.change_log import ChangeLogService
+        from .services.conversation_state import ConversationStateService
+
+        payload = gzip.compress(
+            serializers.serialize('jsonl', messages, fields=cls.FIELDS).encode()
+        )
+        first, last = messages[0], messages[-1]
+        storage = cls.storage()
+        path = storage.save(
+            f'conversations/{conversation_id}/{first.id}-{last.id}.jsonl.gz',
+            ContentFile(payload)
+        )
+
+        try:
+            with transaction.atomic():
+                segment = MessageArchiveSegment.objects.create(
+                    conversation_id=conversation_id,
+                    path=path,
+                    message_count=len(messages),
+                    size_bytes=len(payload),
+                    first_message_id=first.id,
+                    first_created_at=first.created_at,
+                    last_message_id=last.id,
+                    last_created_at=last.created_at,
+                    min_message_id=min(message.id for message in messages),
+                    max_message_id=max(message.id for message in messages)
+                )
+                # Archived rows stay readable through ArchivedHistory, so
+                # they are not reported to delta sync as deleted
+                with ChangeLogService.collect_deletions(record=False):
+                    Message.objects.filter(id__in=[message.id for message in messages]).delete()
+                ConversationStateService.invalidate_caches(conversation_id)
+        except Exception:
+            storage.delete(path)
+            raise
+
+        logger.info(
+            f"Archived {len(messages)} messages of conversation {conversation_id} to {path}"
+        )
+        return segment
+
+    @classmethod
+    def read_segment(cls, segment: MessageArchiveSegment) -> List[Message]:
+        """Unsaved Message instances of a segment, oldest first"""
+        key = f'archive_segment:{segment.id}'
+        payload = cache.get(key)
+        if payload is None:
+            with cls.storage().open(segment.path, 'rb') as segment_file:
+                payload = segment_file.read()
+            cache.set(key, payload, cls.CACHE_TIMEOUT)
+
+        return [
+            deserialized.object
+            for deserialized in serializers.deserialize('jsonl', gzip.decompress(payload).decode())
+        ]
+
+
+class ArchivedHistory:
+    """
+    Archived messages of one conversation, read through the segment index.
+
+    ``before`` and ``after`` mirror the hot-table pages of
+    MessageCursorPagination, so callers merge both by position. Only the
+    segments overlapping a page are read.
+    """
+
+    def __init__(self, conversation_id: int):
+        self.conversation_id = conversation_id
+        self._segments = None
+
+    @property
+    def segments(self) -> List[MessageArchiveSegment]:
+        if self._segments is None:
+            self._segments = list(MessageArchiveSegment.objects.filter(
+                conversation_id=self.conversation_id
+            ))
+        return self._segments
+
+    def before(self, position: Optional[Position], limit: int) -> List[Message]:
+        """Up to ``limit`` archived messages older than ``position``, newest first"""
+        candidates = sorted(
+            (
+                segment for segment in self.segments
+                if position is None or (segment.first_created_at, segment.first_message_id) < position
+            ),
+            key=lambda segment: (segment.last_created_at, segment.last_message_id),
+            reverse=True
+        )
+
+        rows = []
+        for segment in candidates:
+            if len(rows) >= limit and (
+                (segment.last_created_at, segment.last_message_id) < message_position(rows[limit - 1])
+            ):
+                break
+            rows.extend(
+                message for message in MessageArchiveService.read_segment(segment)
+                if position is None or message_position(message) < position
+            )
+            rows.sort(key=message_position, reverse=True)
+        return self._attach(rows[:limit])
+
+    def after(self, position: Position, limit: int) -> List[Message]:
+        """Up to ``limit`` archived messages newer than ``position``, oldest first"""
+        candidates = sorted(
+            (
+                segment for segment in self.segments
+                if (segment.last_created_at, segment.last_message_id) > position
+            ),
+            key=lambda segment: (segment.first_created_at, segment.first_message_id)
+        )
+
+        rows = []
+        for segment in candidates:
+            if len(rows) >= limit and (
+                (segment.first_created_at, segment.first_message_id) > message_position(rows[limit - 1])
+            ):
+                break
+            rows.extend(
+                message for message in MessageArchiveService.read_segment(segment)
+                if message_position(message) > position
+            )
+            rows.sort(key=message_position)
+        return self._attach(rows[:limit])
+
+    def get(self, message_id: int) -> Optional[Message]:
+        for segment in self.segments:
+            # Segments without id bounds could hold any id
+            if segment.min_message_id is None or (
+                segment.min_message_id <= message_id <= segment.max_message_id
+            ):
+                for message in MessageArchiveService.read_segment(segment):
+                    if message.id == message_id:
+                        return self._attach([message])[0]
+        return None
+
+    @staticmethod
+    def _attach(messages: List[Message]) -> List[Message]:
+        """Load senders and uploads the way the hot queryset selects them"""
+        if not messages:
+            return messages
+
+        senders = get_user_model().objects.select_related('university').in_bulk(
+            {message.sender_id for message in messages}
+        )
+        uploads = AttachmentUpload.objects.in_bulk(
+            {message.upload_id for message in messages if message.upload_id}
+        )
+        attached = []
+        for message in messages:
+            # Deleting a user does not reach into the archive
+            if message.sender_id not in senders:
+                continue
+            message.sender = senders[message.sender_id]
+            message.upload = uploads.get(message.upload_id)
+            attached.append(message)
+        return attached
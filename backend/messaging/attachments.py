@@ -0,0 +1,271 @@
+# backend/messaging/attachments.py
+import io
+import os
+import shutil
+import logging
+import tempfile
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.handlers.wsgi import LimitedStream
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AttachmentUpload
+
+logger = logging.getLogger('messaging.attachments')
+
+
+class AttachmentUploadError(Exception):
+    """Raised when an upload request cannot be accepted"""
+
+
+class AttachmentUploadService:
+    """
+    Chunked, resumable attachment uploads.
+
+    A client starts a session with the file name and size, PUTs each
+    chunk as a raw request body (re-sending any chunk is allowed, so an
+    interrupted upload resumes from the chunks still missing) and then
+    completes the session. Chunks are streamed to storage as separate
+    objects; assembling, verification and thumbnails happen in
+    AttachmentProcessor, off the request path.
+    """
+
+    CHUNK_SIZE = 1024 * 1024  # 1MB
+    MAX_SIZE = 25 * 1024 * 1024  # 25MB
+
+    # Content types are detected from magic bytes; the client header is ignored
+    SIGNATURES = [
+        (b'\xff\xd8\xff', 'image/jpeg'),
+        (b'\x89PNG\r\n\x1a\n', 'image/png'),
+        (b'GIF87a', 'image/gif'),
+        (b'GIF89a', 'image/gif'),
+        (b'%PDF-', 'application/pdf'),
+    ]
+
+    @classmethod
+    def initiate(cls, conversation, user, filename: str, size) -> AttachmentUpload:
+        """Start an upload session"""
+        filename = os.path.basename(str(filename or '')).strip()[:255]
+        if not filename:
+            raise AttachmentUploadError('filename is required')
+
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise AttachmentUploadError('size must be an integer')
+        if size <= 0 or size > cls.MAX_SIZE:
+            raise AttachmentUploadError(
+                f'File size must be between 1 byte and {cls.MAX_SIZE // (1024 * 1024)}MB'
+            )
+
+        return AttachmentUpload.objects.create(
+            conversation=conversation,
+            uploader=user,
+            filename=filename,
+            size=size,
+            chunk_size=cls.CHUNK_SIZE
+        )
+
+    @classmethod
+    def store_chunk(cls, upload: AttachmentUpload, index: int, stream, length: Optional[int]):
+        """Stream one chunk of the request body to storage"""
+        if upload.status != 'uploading':
+            raise AttachmentUploadError(f'Upload is {upload.status}')
+        if not 0 <= index < upload.chunk_count:
+            raise AttachmentUploadError(f'Chunk index must be between 0 and {upload.chunk_count - 1}')
+
+        expected = upload.expected_chunk_size(index)
+        if length != expected:
+            raise AttachmentUploadError(f'Chunk {index} must be exactly {expected} bytes')
+
+        # Re-sent chunks replace the previous attempt
+        name = upload.chunk_name(index)
+        default_storage.delete(name)
+        saved_name = default_storage.save(name, File(LimitedStream(stream, expected)))
+
+        if default_storage.size(saved_name) != expected:
+            default_storage.delete(saved_name)
+            raise AttachmentUploadError(f'Chunk {index} was incomplete')
+
+        with transaction.atomic():
+            upload = AttachmentUpload.objects.select_for_update().get(pk=upload.pk)
+            if index not in upload.received_chunks:
+                upload.received_chunks = sorted(upload.received_chunks + [index])
+                upload.save(update_fields=['received_chunks', 'updated_at'])
+        return upload
+
+    @classmethod
+    def complete(cls, upload: AttachmentUpload) -> AttachmentUpload:
+        """Check the received chunks and queue the upload for processing"""
+        if upload.status != 'uploading':
+            return upload
+
+        missing = sorted(set(range(upload.chunk_count)) - set(upload.received_chunks))
+        if missing:
+            raise AttachmentUploadError(f'Missing chunks: {missing[:20]}')
+
+        with default_storage.open(upload.chunk_name(0)) as first_chunk:
+            content_type = cls.detect_content_type(first_chunk.read(16))
+
+        if content_type is None:
+            AttachmentProcessor.fail(upload, 'Only JPEG, PNG, GIF, and PDF files are allowed')
+            raise AttachmentUploadError('Invalid file type. Only JPEG, PNG, GIF, and PDF allowed.')
+
+        upload.content_type = content_type
+        upload.status = 'processing'
+        upload.completed_at = timezone.now()
+        upload.save(update_fields=['content_type', 'status', 'completed_at', 'updated_at'])
+        return upload
+
+    @classmethod
+    def detect_content_type(cls, header: bytes) -> Optional[str]:
+        for signature, content_type in cls.SIGNATURES:
+            if header.startswith(signature):
+                return content_type
+        return None
+
+    @staticmethod
+    def get_ready_upload(upload_id, conversation, user) -> AttachmentUpload:
+        """A processed upload that the user may attach to a message"""
+        try:
+            upload = AttachmentUpload.objects.get(
+                pk=upload_id,
+                conversation=conversation,
+                uploader=user
+            )
+        except (AttachmentUpload.DoesNotExist, ValidationError):
+            raise AttachmentUploadError('Upload not found')
+
+        if upload.status != 'ready':
+            raise AttachmentUploadError(f'Upload is {upload.status}')
+        return upload
+
+    @staticmethod
+    def claim(upload: AttachmentUpload):
+        """
+        Reserve a ready upload for the message being created.
+
+        Run in the message's transaction; the conditional update lets only
+        one message take the upload.
+        """
+        claimed = AttachmentUpload.objects.filter(pk=upload.pk, status='ready').update(
+            status='attached', updated_at=timezone.now()
+        )
+        if not claimed:
+            raise AttachmentUploadError('Upload is already attached to a message')
+
+
+class AttachmentProcessor:
+    """
+    Assemble and verify completed uploads.
+
+    Run by the process_attachments command. Chunks are concatenated
+    through a temporary file, images are decoded with Pillow (rejecting
+    files whose magic bytes lie) and get a thumbnail, and the chunks are
+    deleted afterwards. Uploads abandoned mid-way expire.
+    """
+
+    THUMBNAIL_SIZE = (400, 400)
+    IMAGE_TYPES = {'image/jpeg', 'image/png', 'image/gif'}
+
+    def __init__(self, expiry_hours: int = 24):
+        self.expiry = timedelta(hours=expiry_hours)
+
+    def run_once(self, batch_size: int = 20) -> Dict[str, int]:
+        """Process queued uploads and expire stale sessions"""
+        stats = {'processed': 0, 'failed': 0, 'expired': self.expire_stale()}
+
+        for _ in range(batch_size):
+            with transaction.atomic():
+                # Several workers can run side by side
+                upload = AttachmentUpload.objects.select_for_update(
+                    skip_locked=True
+                ).filter(status='processing').order_by('updated_at').first()
+                if upload is None:
+                    break
+
+                if self.process(upload):
+                    stats['processed'] += 1
+                else:
+                    stats['failed'] += 1
+
+        return stats
+
+    def process(self, upload: AttachmentUpload) -> bool:
+        """Assemble one upload; returns whether it is ready"""
+        try:
+            with tempfile.TemporaryFile() as assembled:
+                for index in range(upload.chunk_count):
+                    with default_storage.open(upload.chunk_name(index)) as chunk:
+                        shutil.copyfileobj(chunk, assembled)
+                assembled.seek(0)
+
+                if upload.content_type in self.IMAGE_TYPES:
+                    thumbnail = self.make_thumbnail(assembled)
+                    upload.thumbnail.save(
+                        f'{os.path.splitext(upload.filename)[0]}_thumb.jpg',
+                        ContentFile(thumbnail),
+                        save=False
+                    )
+                    assembled.seek(0)
+
+                upload.file.save(upload.filename, File(assembled), save=False)
+        except Exception as e:
+            logger.warning(f"Attachment upload {upload.id} failed processing: {e}")
+            self.fail(upload, f'Processing failed: {e}'[:255])
+            return False
+
+        upload.status = 'ready'
+        upload.save(update_fields=['file', 'thumbnail', 'status', 'updated_at'])
+        self.delete_chunks(upload)
+        return True
+
+    def make_thumbnail(self, image_file) -> bytes:
+        """Verify an image decodes and render a JPEG thumbnail"""
+        from PIL import Image, ImageOps
+
+        with Image.open(image_file) as image:
+            image.verify()
+
+        image_file.seek(0)
+        with Image.open(image_file) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(self.THUMBNAIL_SIZE)
+            output = io.BytesIO()
+            image.convert('RGB').save(output, format='JPEG', quality=80)
+        return output.getvalue()
+
+    def expire_stale(self) -> int:
+        """Expire sessions that stopped receiving chunks"""
+        stale = AttachmentUpload.objects.filter(
+            status='uploading',
+            updated_at__lt=timezone.now() - self.expiry
+        )
+        expired = 0
+        for upload in stale.iterator():
+            self.delete_chunks(upload)
+            expired += AttachmentUpload.objects.filter(
+                pk=upload.pk, status='uploading'
+            ).update(status='expired', updated_at=timezone.now())
+        return expired
+
+    @classmethod
+    def fail(cls, upload: AttachmentUpload, error: str):
+        upload.status = 'failed'
+        upload.error = error
+        upload.save(update_fields=['status', 'error', 'updated_at'])
+        cls.delete_chunks(upload)
+
+    @staticmethod
+    def delete_chunks(upload: AttachmentUpload):
+        for index in range(upload.chunk_count):
+            try:
+                default_storage.delete(upload.chunk_name(index))
+            except Exception as e:
+                logger.debug(f"Could not delete chunk {index} of upload {upload.id}: {e}")
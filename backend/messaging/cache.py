@@ -1,8 +1,11 @@
 # backend/messaging/cache.py
 from django.core.cache import cache
-from typing import List, Optional, Dict, Any
+from typing import Iterable, List, Optional, Dict, Any
 import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
 
 
 class MessageCache:
@@ -10,6 +13,9 @@ class MessageCache:
     
     CACHE_VERSION = 1  # Increment when cache structure changes
     DEFAULT_TIMEOUT = 300  # 5 minutes
+    SENT_MESSAGE_TIMEOUT = 600  # Covers client retries after a reconnect
+    USER_CONVERSATIONS_TIMEOUT = 60  # Bounds staleness of online status
+    ETAG_MAX_AGE = 60  # Same bound for conditional GETs
     
     @classmethod
     def _make_key(cls, key_type: str, *args) -> str:
@@ -17,63 +23,131 @@ class MessageCache:
         key_parts = [f"v{cls.CACHE_VERSION}", "msg", key_type] + [str(arg) for arg in args]
         return ":".join(key_parts)
     
+    # Generation counters
+    #
+    # Cached entries embed the current version of the user or conversation
+    # they depend on. Bumping a version makes every older entry unreachable,
+    # so invalidation is a single INCR and stale entries just expire.
+    
+    @classmethod
+    def _version_key(cls, scope: str, object_id: int) -> str:
+        return cls._make_key('ver', scope, object_id)
+    
+    @staticmethod
+    def _initial_version() -> int:
+        # Time-based so a version evicted from the cache is never reused
+        return int(time.time() * 1000)
+    
+    @classmethod
+    def get_version(cls, scope: str, object_id: int) -> int:
+        """Current version of a user ('user') or conversation ('conv')"""
+        key = cls._version_key(scope, object_id)
+        version = cache.get(key)
+        if version is None:
+            version = cls._initial_version()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        return version
+    
+    @classmethod
+    def bump_version(cls, scope: str, object_id: int):
+        """Invalidate everything cached under a user or conversation"""
+        key = cls._version_key(scope, object_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Missing or evicted: start again from a fresh, higher value
+            cache.set(key, cls._initial_version(), None)
+    
+    @classmethod
+    def bump_conversation(cls, conversation_id: int, user_ids: Iterable[int]):
+        """A conversation changed: invalidate it and its participants' lists"""
+        cls.bump_version('conv', conversation_id)
+        for user_id in user_ids:
+            cls.bump_version('user', user_id)
+    
+    @classmethod
+    def get_etag(cls, scope: str, object_id: int, *parts) -> str:
+        """Weak ETag for a response derived from a user or conversation version"""
+        # Time-derived fields (online status, can_edit) are not versioned,
+        # so every ETag also rolls over each ETAG_MAX_AGE seconds
+        window = int(time.time() // cls.ETAG_MAX_AGE)
+        stamp = json.dumps(
+            [scope, object_id, cls.get_version(scope, object_id), window, *parts],
+            sort_keys=True, default=str
+        )
+        return f'W/"{hashlib.md5(stamp.encode()).hexdigest()[:16]}"'
+    
+    # Read-through entries
+    #
+    # Callers take the key - and with it the version - before querying and
+    # store under that same key, so a bump that lands while the value is
+    # computed leaves the result under the old, unreachable version.
+    
     @classmethod
-    def get_conversation_messages(cls, conversation_id: int, page: int = 1) -> Optional[List]:
+    def conversation_messages_key(cls, conversation_id: int, page: int = 1) -> str:
+        return cls._make_key('conv_msgs', conversation_id, cls.get_version('conv', conversation_id), page)
+    
+    @classmethod
+    def get_conversation_messages(cls, cache_key: str) -> Optional[List]:
         """Get cached messages for a conversation"""
-        cache_key = cls._make_key('conv_msgs', conversation_id, page)
         return cache.get(cache_key)
     
     @classmethod
-    def set_conversation_messages(cls, conversation_id: int, page: int, messages: List, timeout: int = None):
+    def set_conversation_messages(cls, cache_key: str, messages: List, timeout: int = None):
         """Cache messages for a conversation"""
-        cache_key = cls._make_key('conv_msgs', conversation_id, page)
         cache.set(cache_key, messages, timeout or cls.DEFAULT_TIMEOUT)
     
     @classmethod
-    def get_conversation_stats(cls, conversation_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    def conversation_stats_key(cls, conversation_id: int, user_id: int) -> str:
+        return cls._make_key('conv_stats', conversation_id, cls.get_version('conv', conversation_id), user_id)
+    
+    @classmethod
+    def get_conversation_stats(cls, cache_key: str) -> Optional[Dict[str, Any]]:
         """Get cached conversation statistics"""
-        cache_key = cls._make_key('conv_stats', conversation_id, user_id)
         return cache.get(cache_key)
     
     @classmethod
-    def set_conversation_stats(cls, conversation_id: int, user_id: int, stats: Dict[str, Any], timeout: int = None):
+    def set_conversation_stats(cls, cache_key: str, stats: Dict[str, Any], timeout: int = None):
         """Cache conversation statistics"""
-        cache_key = cls._make_key('conv_stats', conversation_id, user_id)
         cache.set(cache_key, stats, timeout or cls.DEFAULT_TIMEOUT)
     
     @classmethod
     def invalidate_conversation(cls, conversation_id: int):
         """Invalidate all cached data for a conversation"""
-        # Delete message pages
-        for page in range(1, 11):  # Assume max 10 pages cached
-            cache.delete(cls._make_key('conv_msgs', conversation_id, page))
-        
-        # Delete stats for all possible users (this is a pattern delete)
-        # In production, you might want to track which users have cached data
-        cache_pattern = f"v{cls.CACHE_VERSION}:msg:conv_stats:{conversation_id}:*"
-        # Note: pattern delete depends on your cache backend
-        # For Redis, you'd use: cache.delete_pattern(cache_pattern)
-        
+        cls.bump_version('conv', conversation_id)
+    
     @classmethod
-    def get_user_conversations(cls, user_id: int, filters: Optional[Dict] = None) -> Optional[List]:
-        """Get cached conversation list for a user"""
+    def user_conversations_key(cls, user_id: int, filters: Optional[Dict] = None) -> str:
         filter_hash = hashlib.md5(json.dumps(filters or {}, sort_keys=True).encode()).hexdigest()[:8]
-        cache_key = cls._make_key('user_convs', user_id, filter_hash)
+        return cls._make_key('user_convs', user_id, cls.get_version('user', user_id), filter_hash)
+    
+    @classmethod
+    def get_user_conversations(cls, cache_key: str) -> Optional[List]:
+        """Get cached conversation list for a user"""
         return cache.get(cache_key)
     
     @classmethod
-    def set_user_conversations(cls, user_id: int, conversations: List, filters: Optional[Dict] = None, timeout: int = None):
+    def set_user_conversations(cls, cache_key: str, conversations: List, timeout: int = None):
         """Cache user's conversation list"""
-        filter_hash = hashlib.md5(json.dumps(filters or {}, sort_keys=True).encode()).hexdigest()[:8]
-        cache_key = cls._make_key('user_convs', user_id, filter_hash)
-        cache.set(cache_key, conversations, timeout or cls.DEFAULT_TIMEOUT)
+        cache.set(cache_key, conversations, timeout or cls.USER_CONVERSATIONS_TIMEOUT)
     
     @classmethod
     def invalidate_user_conversations(cls, user_id: int):
         """Invalidate all cached conversation lists for a user"""
-        # This would need pattern delete support
-        # For now, we'll have to invalidate specific filter combinations
-        pass
+        cls.bump_version('user', user_id)
+    
+    @classmethod
+    def get_sent_message(cls, conversation_id: int, sender_id: int, temp_id: str) -> Optional[Dict[str, Any]]:
+        """Get the payload of a message already sent with this temp_id"""
+        cache_key = cls._make_key('sent', conversation_id, sender_id, temp_id)
+        return cache.get(cache_key)
+    
+    @classmethod
+    def set_sent_message(cls, conversation_id: int, sender_id: int, temp_id: str, message_data: Dict[str, Any]):
+        """Remember the payload of a sent message for deduplicating retries"""
+        cache_key = cls._make_key('sent', conversation_id, sender_id, temp_id)
+        cache.set(cache_key, message_data, cls.SENT_MESSAGE_TIMEOUT)
 
 
 class TypingIndicatorCache:
@@ -99,3 +173,284 @@ class TypingIndicatorCache:
         # This would need to scan keys with pattern matching
         # Implementation depends on your cache backend
         return []
+
+
+class ConversationContextCache:
+    """
+    Rolling buffer of recent message text per conversation.
+    
+    Feeds context-aware content filtering without querying messages on
+    every send. The buffer holds normalized (lowercased) text, one cache
+    entry per message in numbered slots; appends claim their slot with an
+    atomic INCR of the slot counter, so concurrent senders never
+    overwrite each other. It is shared by the REST and WebSocket send
+    paths and rebuilt from the database on a miss.
+    """
+    
+    CONTEXT_WINDOW = 5
+    CONTEXT_TIMEOUT = 3600  # Idle conversations fall back to the database
+    
+    @staticmethod
+    def _key(conversation_id: int) -> str:
+        # Slot counter: number of the newest slot
+        return f'msg_context:{conversation_id}'
+    
+    @staticmethod
+    def _slot_key(conversation_id: int, slot: int) -> str:
+        return f'msg_context:{conversation_id}:{slot}'
+    
+    @staticmethod
+    def normalize(content: str) -> str:
+        return ' '.join((content or '').lower().split())
+    
+    @classmethod
+    def get_context(cls, conversation_id: int, window: int = CONTEXT_WINDOW) -> List[str]:
+        """Recent message text, oldest first"""
+        newest = cache.get(cls._key(conversation_id))
+        if newest is not None:
+            keys = [cls._slot_key(conversation_id, slot) for slot in range(max(1, newest - window + 1), newest + 1)]
+            cached = cache.get_many(keys)
+            if len(cached) == len(keys):
+                return [cached[key] for key in keys]
+        
+        # Cold, expired, or a concurrent append has not stored its text yet
+        context = cls._load(conversation_id, window)
+        if newest is None:
+            cls._store(conversation_id, context, 1)
+            cache.add(cls._key(conversation_id), len(context), cls.CONTEXT_TIMEOUT)
+        else:
+            # Refill the slots just read; later appends have slots of their own
+            cls._store(conversation_id, context, newest - len(context) + 1)
+        return context
+    
+    @classmethod
+    def append(cls, conversation_id: int, content: str, window: int = CONTEXT_WINDOW):
+        """Add a sent message to the buffer"""
+        try:
+            slot = cache.incr(cls._key(conversation_id))
+        except ValueError:
+            # Rebuilt from the database (including this message) on next read
+            return
+        cache.set(cls._slot_key(conversation_id, slot), cls.normalize(content), cls.CONTEXT_TIMEOUT)
+    
+    @classmethod
+    def invalidate(cls, conversation_id: int):
+        """Drop the buffer after edits or deletions"""
+        cache.delete(cls._key(conversation_id))
+    
+    @classmethod
+    def _store(cls, conversation_id: int, context: List[str], first_slot: int):
+        cache.set_many({
+            cls._slot_key(conversation_id, first_slot + offset): text
+            for offset, text in enumerate(context)
+        }, cls.CONTEXT_TIMEOUT)
+    
+    @classmethod
+    def _load(cls, conversation_id: int, window: int) -> List[str]:
+        from .models import Message
+        
+        recent = Message.objects.filter(
+            conversation_id=conversation_id
+        ).order_by('-created_at').values_list('content', flat=True)[:window]
+        return [cls.normalize(content) for content in reversed(list(recent))]
+
+
+class ReplayBuffer:
+    """
+    Recently sent messages per conversation, keyed by sequence number.
+    
+    Lets a reconnecting chat socket catch up on what it missed without
+    reloading history. Every message is its own entry, so writers never
+    contend on a shared list; a range is complete only if no entry in it
+    has expired or been evicted.
+    """
+    
+    REPLAY_TIMEOUT = 600  # Covers reconnects after a network blip
+    
+    @staticmethod
+    def _key(conversation_id: int, sequence: int) -> str:
+        return f'replay:{conversation_id}:{sequence}'
+    
+    @classmethod
+    def add(cls, conversation_id: int, sequence: int, message_data: Dict[str, Any]):
+        cache.set(cls._key(conversation_id, sequence), message_data, cls.REPLAY_TIMEOUT)
+    
+    @classmethod
+    def get_range(cls, conversation_id: int, after: int, through: int) -> Optional[List[Dict[str, Any]]]:
+        """Messages with after < sequence <= through in order, or None if any is missing"""
+        keys = [cls._key(conversation_id, sequence) for sequence in range(after + 1, through + 1)]
+        cached = cache.get_many(keys)
+        if len(cached) != len(keys):
+            return None
+        return [cached[key] for key in keys]
+
+
+class UnreadCounterCache:
+    """Per-user total of unread messages across all conversations"""
+    
+    COUNTER_TIMEOUT = 600  # Expiry forces a reconcile from participant state
+    
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f'unread_total:{user_id}'
+    
+    @classmethod
+    def get(cls, user_id: int) -> Optional[int]:
+        return cache.get(cls._key(user_id))
+    
+    @classmethod
+    def set(cls, user_id: int, count: int):
+        cache.set(cls._key(user_id), count, cls.COUNTER_TIMEOUT)
+    
+    @classmethod
+    def adjust(cls, user_id: int, delta: int) -> Optional[int]:
+        """Atomically add to the counter; None when it is not cached"""
+        try:
+            return cache.incr(cls._key(user_id), delta)
+        except ValueError:
+            return None
+    
+    @classmethod
+    def delete_many(cls, user_ids: Iterable[int]):
+        cache.delete_many([cls._key(user_id) for user_id in user_ids])
+
+
+class TemplateCache:
+    """
+    Serialized message template payloads.
+    
+    Two tiers: a short-lived in-process copy in front of the shared
+    cache. Shared entries are keyed by the 'templates' version, which
+    template edits bump; in-process copies expire within LOCAL_TIMEOUT
+    and at most LOCAL_MAX_ENTRIES are kept, least recently used first out.
+    """
+    
+    LOCAL_TIMEOUT = 30
+    LOCAL_MAX_ENTRIES = 128
+    SHARED_TIMEOUT = 3600
+    _local: 'OrderedDict[str, Any]' = OrderedDict()
+    _local_lock = threading.Lock()
+    
+    @staticmethod
+    def _local_key(template_type: str, property_type: str, language: str) -> str:
+        return f'{template_type}:{property_type}:{language}'
+    
+    @classmethod
+    def _shared_key(cls, local_key: str) -> str:
+        return MessageCache._make_key('templates', MessageCache.get_version('templates', 0), local_key)
+    
+    @classmethod
+    def get(cls, template_type: str, property_type: str, language: str) -> Optional[List]:
+        """Cached payload for a template listing"""
+        local_key = cls._local_key(template_type, property_type, language)
+        with cls._local_lock:
+            local = cls._local.get(local_key)
+            if local and local[0] > time.monotonic():
+                cls._local.move_to_end(local_key)
+                return local[1]
+        
+        payload = cache.get(cls._shared_key(local_key))
+        if payload is not None:
+            cls._remember(local_key, payload)
+        return payload
+    
+    @classmethod
+    def set(cls, template_type: str, property_type: str, language: str, payload: List):
+        local_key = cls._local_key(template_type, property_type, language)
+        cache.set(cls._shared_key(local_key), payload, cls.SHARED_TIMEOUT)
+        cls._remember(local_key, payload)
+    
+    @classmethod
+    def _remember(cls, local_key: str, payload: List):
+        with cls._local_lock:
+            cls._local[local_key] = (time.monotonic() + cls.LOCAL_TIMEOUT, payload)
+            cls._local.move_to_end(local_key)
+            while len(cls._local) > cls.LOCAL_MAX_ENTRIES:
+                cls._local.popitem(last=False)
+    
+    @classmethod
+    def invalidate(cls):
+        """Templates changed: drop every cached payload"""
+        MessageCache.bump_version('templates', 0)
+        with cls._local_lock:
+            cls._local.clear()
+
+
+class TemplateUsageBuffer:
+    """
+    Buffered template usage counts.
+    
+    Uses are counted in the cache and written to MessageTemplate by the
+    flush_template_usage command, so tracking usage neither writes the
+    row on every use nor invalidates cached template payloads.
+    """
+    
+    @staticmethod
+    def _count_key(template_id: int) -> str:
+        return f'template_usage:{template_id}'
+    
+    @staticmethod
+    def _last_used_key(template_id: int) -> str:
+        return f'template_last_used:{template_id}'
+    
+    @classmethod
+    def record(cls, template_id: int):
+        """Count one use of a template"""
+        key = cls._count_key(template_id)
+        if not cache.add(key, 1, None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+        cache.set(cls._last_used_key(template_id), time.time(), None)
+    
+    @classmethod
+    def flush(cls) -> int:
+        """Write buffered counts in a single UPDATE; returns uses flushed"""
+        from datetime import datetime, timezone as dt_timezone
+        from django.db.models import Case, DateTimeField, F, IntegerField, Value, When
+        from .models import MessageTemplate
+        
+        template_ids = list(MessageTemplate.objects.values_list('id', flat=True))
+        counts = cache.get_many([cls._count_key(template_id) for template_id in template_ids])
+        last_used = cache.get_many([cls._last_used_key(template_id) for template_id in template_ids])
+        
+        pending = {}
+        for template_id in template_ids:
+            count = counts.get(cls._count_key(template_id))
+            # Negative after an eviction raced a decrement; later uses make up for it
+            if count and count > 0:
+                pending[template_id] = count
+        if not pending:
+            return 0
+        
+        used_at = {
+            template_id: datetime.fromtimestamp(
+                last_used[cls._last_used_key(template_id)], tz=dt_timezone.utc
+            )
+            for template_id in pending
+            if last_used.get(cls._last_used_key(template_id))
+        }
+        # update() skips signals, so cached payloads stay valid
+        MessageTemplate.objects.filter(pk__in=list(pending)).update(
+            usage_count=F('usage_count') + Case(
+                *[When(pk=template_id, then=Value(count)) for template_id, count in pending.items()],
+                default=Value(0),
+                output_field=IntegerField()
+            ),
+            # An evicted timestamp leaves last_used as it was
+            last_used=Case(
+                *[When(pk=template_id, then=Value(value)) for template_id, value in used_at.items()],
+                default=F('last_used'),
+                output_field=DateTimeField()
+            )
+        )
+        
+        for template_id, count in pending.items():
+            # Uses recorded meanwhile stay buffered
+            try:
+                cache.decr(cls._count_key(template_id), count)
+            except ValueError:
+                # Evicted since the read; the uses were written all the same
+                pass
+        return sum(pending.values())
@@ -0,0 +1,265 @@
+# backend/messaging/channel_layer.py
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, Optional
+from asgiref.sync import sync_to_async
+from channels.exceptions import ChannelFull
+from django.utils.module_loading import import_string
+from .monitoring import WebSocketMonitor
+
+logger = logging.getLogger('messaging.websocket')
+
+# Send timestamp stamped on every event, stripped again on receive
+SENT_AT_KEY = '__sent_at'
+
+
+class ChannelStats:
+    """Receive-side backpressure stats for a single channel"""
+
+    __slots__ = ('lag', 'depth', 'max_depth', 'strikes')
+
+    def __init__(self):
+        self.lag = 0.0
+        self.depth = None
+        self.max_depth = 0
+        self.strikes = 0
+
+
+class _OverCapacityCounter(logging.Filter):
+    """
+    Count events dropped by channels_redis group_send.
+
+    channels_redis discards events for full channels inside a Lua script
+    and only reports the number of dropped channels through its logger.
+    """
+
+    def __init__(self, layer):
+        super().__init__()
+        self.layer = layer
+
+    def filter(self, record):
+        if 'over capacity' in str(record.msg) and record.args:
+            try:
+                self.layer.record_channel_full(int(record.args[0]))
+            except (TypeError, ValueError):
+                pass
+        return True
+
+
+class MonitoredChannelLayer:
+    """
+    Channel layer wrapper that measures backpressure.
+
+    Wraps the configured backend and:
+    - times every send/group_send
+    - stamps events with their send time so receivers can measure lag
+    - tracks per-channel queue depth where the backend exposes it
+    - counts ChannelFull occurrences instead of losing them silently
+    - flags slow consumers (lag keeps exceeding the limit while their
+      queue keeps growing, or their channel overflowed) so they can be
+      disconnected with a resync hint
+
+    Shared counters (WebSocketMonitor) are written from a worker thread at
+    most every METRICS_FLUSH_SECONDS, never on the event loop.
+
+    Configure it in CHANNEL_LAYERS with the real backend in CONFIG:
+        'BACKEND': 'messaging.channel_layer.MonitoredChannelLayer',
+        'CONFIG': {'backend': 'channels_redis.core.RedisChannelLayer', 'config': {...}}
+    """
+
+    METRICS_FLUSH_SECONDS = 10
+
+    def __init__(self, backend: str = 'channels.layers.InMemoryChannelLayer',
+                 config: Optional[Dict] = None, slow_consumer_lag: float = 2.0,
+                 slow_consumer_strikes: int = 5, slow_consumer_depth: Optional[int] = None):
+        backend_class = import_string(backend)
+        self.inner = backend_class(**(config or {}))
+
+        self.slow_consumer_lag = slow_consumer_lag
+        self.slow_consumer_strikes = slow_consumer_strikes
+        capacity = getattr(self.inner, 'capacity', 100)
+        self.slow_consumer_depth = slow_consumer_depth or max(1, int(capacity * 0.8))
+
+        self.channel_stats: Dict[str, ChannelStats] = {}
+        self.overflowed = set()
+        self.metrics = {
+            'sends': 0,
+            'send_seconds': 0.0,
+            'max_send_seconds': 0.0,
+            'channel_full': 0,
+            'slow_consumers': 0,
+        }
+        self.unflushed = Counter()
+        self._last_flush = 0.0
+        self._flush_task = None
+
+        # Redis drops group events server-side; count them from its log records
+        if not hasattr(self.inner, 'groups'):
+            logging.getLogger('channels_redis.core').addFilter(_OverCapacityCounter(self))
+
+    def __getattr__(self, name):
+        # Everything not monitored is delegated to the real backend
+        if name == 'inner':
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    # Sending
+
+    async def send(self, channel, message):
+        """Send an event to a channel, counting overflows"""
+        await self._send_stamped(channel, self._stamp(message))
+
+    async def group_send(self, group, message):
+        """Send an event to every channel in a group"""
+        message = self._stamp(message)
+
+        group_channels = getattr(self.inner, 'groups', None)
+        if group_channels is None:
+            await self._timed(self.inner.group_send(group, message))
+            return
+
+        # In-memory layer: fan out ourselves so overflows are visible
+        for channel in list(group_channels.get(group, {})):
+            try:
+                await self._send_stamped(channel, message)
+            except ChannelFull:
+                pass
+
+    async def _send_stamped(self, channel, message):
+        try:
+            await self._timed(self.inner.send(channel, message))
+        except ChannelFull:
+            self.overflowed.add(channel)
+            self.record_channel_full()
+            logger.warning(f"Channel {channel} is full, consumer will be asked to resync")
+            raise
+
+    async def _timed(self, operation):
+        start = time.monotonic()
+        try:
+            return await operation
+        finally:
+            duration = time.monotonic() - start
+            self.metrics['sends'] += 1
+            self.metrics['send_seconds'] += duration
+            self.metrics['max_send_seconds'] = max(self.metrics['max_send_seconds'], duration)
+
+    @staticmethod
+    def _stamp(message):
+        return {**message, SENT_AT_KEY: time.time()}
+
+    def record_channel_full(self, count: int = 1):
+        """Count events dropped because a channel was at capacity"""
+        self.metrics['channel_full'] += count
+        self._count('channel_full', count)
+
+    # Receiving
+
+    async def receive(self, channel):
+        """Receive the next event and record its lag and the queue depth"""
+        message = await self.inner.receive(channel)
+        sent_at = message.pop(SENT_AT_KEY, None)
+
+        stats = self.channel_stats.get(channel)
+        if stats is None:
+            stats = self.channel_stats[channel] = ChannelStats()
+
+        previous_depth = stats.depth
+        stats.depth = self.queue_depth(channel)
+        if stats.depth is not None:
+            stats.max_depth = max(stats.max_depth, stats.depth)
+
+        if sent_at is not None:
+            stats.lag = max(0.0, time.time() - sent_at)
+            growing = (
+                stats.depth is None or previous_depth is None
+                or stats.depth >= previous_depth
+            )
+            if stats.lag > self.slow_consumer_lag and growing:
+                stats.strikes += 1
+            else:
+                stats.strikes = 0
+
+        return message
+
+    def queue_depth(self, channel) -> Optional[int]:
+        """Number of events waiting for a channel in this process, if known"""
+        queues = getattr(self.inner, 'channels', None)  # InMemoryChannelLayer
+        if queues is None:
+            queues = getattr(self.inner, 'receive_buffer', None)  # RedisChannelLayer
+        if queues is None:
+            return None
+        queue = queues.get(channel)
+        return queue.qsize() if queue is not None else 0
+
+    # Slow consumer detection
+
+    def is_slow_consumer(self, channel) -> bool:
+        """Whether a consumer can no longer keep up with its channel"""
+        if channel in self.overflowed:
+            return True
+        stats = self.channel_stats.get(channel)
+        if stats is None:
+            return False
+        return (
+            stats.strikes >= self.slow_consumer_strikes
+            or (stats.depth or 0) >= self.slow_consumer_depth
+        )
+
+    def record_slow_consumer(self, channel):
+        """Count a slow consumer disconnect"""
+        self.metrics['slow_consumers'] += 1
+        self._count('slow_consumer_disconnects')
+
+    # Shared metrics
+
+    def _count(self, name: str, amount: int = 1):
+        """Queue a shared counter update and make sure a flush is scheduled"""
+        self.unflushed[name] += amount
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop to flush from; picked up by the next flush
+            return
+        self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(max(0.0, self._last_flush + self.METRICS_FLUSH_SECONDS - time.monotonic()))
+        await self.flush_metrics()
+
+    async def flush_metrics(self):
+        """Add the counts recorded since the last flush to WebSocketMonitor"""
+        pending, self.unflushed = self.unflushed, Counter()
+        self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            await sync_to_async(self._write_metrics, thread_sensitive=False)(pending)
+        except Exception as e:
+            logger.error(f"Failed to flush channel layer metrics: {e}")
+
+    @staticmethod
+    def _write_metrics(pending):
+        for name, amount in pending.items():
+            WebSocketMonitor.increment_metric(name, amount)
+
+    def forget(self, channel):
+        """Drop stats for a channel whose consumer has gone away"""
+        self.channel_stats.pop(channel, None)
+        self.overflowed.discard(channel)
+
+    def get_metrics(self) -> Dict:
+        """Process-local backpressure metrics"""
+        sends = self.metrics['sends']
+        return {
+            **self.metrics,
+            'avg_send_ms': round(self.metrics['send_seconds'] / sends * 1000, 3) if sends else 0.0,
+            'tracked_channels': len(self.channel_stats),
+            'max_queue_depth': max(
+                (stats.max_depth for stats in self.channel_stats.values()), default=0
+            ),
+        }
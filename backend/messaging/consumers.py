@@ -7,19 +7,109 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from django.utils.text import Truncator
 from django.core.cache import cache
-from .models import Conversation, Message
+from django.db import IntegrityError, transaction
+from .models import Conversation, ConversationParticipantState, Message, MessageClientKey
+from .archive import ArchivedHistory
+from .cache import ConversationContextCache, MessageCache, ReplayBuffer
+from .services.conversation_state import ConversationStateService
+from .services.unread_counter import UnreadCounterService
 from .serializers import MessageSerializer
 from .monitoring import WebSocketMonitor
+from .draining import DRAIN_CLOSE_CODE, get_drainer
+from .pagination import MessageCursorPagination
 from channels.exceptions import StopConsumer
 import logging
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+# Characters of a message shown in conversation list deltas
+LIST_PREVIEW_LENGTH = 100
+
+
+class BackpressureMixin:
+    """
+    Disconnect consumers that can't keep up with their channel.
+
+    When the channel layer (MonitoredChannelLayer) reports that this
+    consumer's channel overflowed or keeps lagging, the client gets a
+    resync hint and the socket is closed instead of events being
+    silently dropped.
+    """
+    
+    SLOW_CONSUMER_CLOSE_CODE = 4008
+    
+    async def dispatch(self, message):
+        if (
+            not message['type'].startswith('websocket.')
+            and self._is_slow_consumer()
+        ):
+            await self.disconnect_slow_consumer()
+            return
+        await super().dispatch(message)
+    
+    def _is_slow_consumer(self):
+        is_slow = getattr(self.channel_layer, 'is_slow_consumer', None)
+        return bool(is_slow and is_slow(self.channel_name))
+    
+    async def disconnect_slow_consumer(self):
+        """Ask the client to resync and close the socket once"""
+        if getattr(self, '_resync_requested', False):
+            return
+        self._resync_requested = True
+        
+        logger.warning(
+            f"Disconnecting slow consumer {self.channel_name} "
+            f"(user {getattr(self.user, 'id', None)})"
+        )
+        self.channel_layer.record_slow_consumer(self.channel_name)
+        
+        try:
+            await self.send(json.dumps({
+                'type': 'resync_required',
+                'reason': 'slow_consumer',
+                'timestamp': timezone.now().isoformat()
+            }))
+        finally:
+            await self.close(code=self.SLOW_CONSUMER_CLOSE_CODE)
+    
+    def forget_channel_stats(self):
+        """Release backpressure stats kept for this consumer's channel"""
+        forget = getattr(self.channel_layer, 'forget', None)
+        if forget and getattr(self, 'channel_name', None):
+            forget(self.channel_name)
+
+
+class DrainMixin:
+    """
+    Take part in graceful connection draining.
+    
+    New sockets are rejected while the process drains; open ones are
+    registered so the drainer can ask them to reconnect and close them.
+    """
+    
+    async def websocket_connect(self, message):
+        drainer = get_drainer()
+        if drainer.draining:
+            # Closing before accept rejects the handshake
+            await self.close(code=DRAIN_CLOSE_CODE)
+            return
+        await super().websocket_connect(message)
+        drainer.register(self)
+    
+    async def websocket_disconnect(self, message):
+        get_drainer().unregister(self)
+        await super().websocket_disconnect(message)
+
+
+class ChatConsumer(DrainMixin, BackpressureMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for real-time messaging with enhanced features"""
     
+    # Clients further behind than this reload history instead of resuming
+    MAX_REPLAY = 200
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Only initialize essential attributes
@@ -186,6 +276,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             for task in tasks_to_cancel:
                 task.cancel()
             
+            self.forget_channel_stats()
+            
             # Only proceed if we have required attributes
             if hasattr(self, 'user') and self.user and hasattr(self, 'conversation_group_name'):
                 # Leave groups with error handling
@@ -248,6 +340,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'typing_start': self.handle_typing_start,
                 'typing_stop': self.handle_typing_stop,
                 'request_history': self.handle_request_history,
+                'resume': self.handle_resume,
                 'edit_message': self.handle_edit_message,
                 'delete_message': self.handle_delete_message,
             }
@@ -355,6 +448,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.send_error('Message too long (max 5000 characters)')
             return
         
+        # Retried sends return the original message instead of a duplicate
+        client_temp_id = str(temp_id)[:64] if temp_id not in (None, '') else ''
+        if client_temp_id:
+            original = await self.get_sent_message(client_temp_id)
+            if original:
+                await self.send_duplicate_ack(original, temp_id)
+                return
+        
         # Apply content filtering
         filter_result = await self.filter_content(content)
         
@@ -373,7 +474,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
         
         # Create message in database
-        message = await self.create_message(content, metadata, filter_result)
+        message, created = await self.create_message(
+            content, metadata, filter_result, client_temp_id
+        )
         
         # Serialize message for frontend
         message_data = await self.serialize_message(message)
@@ -382,15 +485,25 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if temp_id:
             message_data['temp_id'] = temp_id
         
-        # Notify conversation list updates for all participants
-        participants = await self.get_conversation_participants()
-        for participant in participants:
+        if client_temp_id:
+            await self.remember_sent_message(client_temp_id, message_data)
+        
+        # Lost the race against a concurrent retry: the original was already broadcast
+        if not created:
+            await self.send_duplicate_ack(message_data, temp_id)
+            return
+        
+        # Buffered before the broadcast so a racing resume can't miss it
+        await self.buffer_for_replay(message.sequence, message_data)
+        
+        # Notify conversation lists of all participants with a compact delta
+        frames = await self.build_list_delta_frames(message)
+        for user_id, frame in frames.items():
             await self.channel_layer.group_send(
-                f'conversations_user_{participant.id}',
+                f'conversations_user_{user_id}',
                 {
-                    'type': 'new_message_notification',
-                    'conversation_id': int(self.conversation_id),
-                    'message': message_data
+                    'type': 'conversation_delta',
+                    'frame': frame
                 }
             )
         
@@ -427,6 +540,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if duration > 0.5:
             logger.warning(f"Slow message send: {duration:.3f}s")
     
+    async def send_duplicate_ack(self, message_data, temp_id):
+        """Acknowledge a retried send with the original message"""
+        await self.send(json.dumps({
+            'type': 'message_sent',
+            'message_id': message_data['id'],
+            'temp_id': temp_id,
+            'timestamp': message_data['createdAt'],
+            'duplicate': True,
+            'message': message_data
+        }))
+    
+    @database_sync_to_async
+    def get_sent_message(self, client_temp_id):
+        """Look up a message already sent with this temp_id"""
+        try:
+            return MessageCache.get_sent_message(
+                self.conversation_id, self.user.id, client_temp_id
+            )
+        except Exception as e:
+            logger.error(f"Sent message lookup failed: {e}")
+            return None
+    
+    @database_sync_to_async
+    def remember_sent_message(self, client_temp_id, message_data):
+        """Remember a sent message so retries can be deduplicated"""
+        try:
+            MessageCache.set_sent_message(
+                self.conversation_id, self.user.id, client_temp_id, message_data
+            )
+        except Exception as e:
+            logger.error(f"Failed to cache sent message: {e}")
+    
     # Include all other handler methods with the same implementation
     # but ensure proper error handling and type conversions
     
@@ -504,6 +649,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'has_more': len(messages) == limit
         }))
     
+    async def handle_resume(self, data):
+        """Replay messages sent after the client's last seen sequence"""
+        try:
+            last_sequence = int(data.get('last_sequence'))
+        except (TypeError, ValueError):
+            await self.send_error('last_sequence required')
+            return
+        
+        latest, messages = await self.get_missed_messages(max(last_sequence, 0))
+        if messages is None:
+            # Too far behind: the client reloads history instead
+            await self.send(json.dumps({
+                'type': 'resync_required',
+                'last_sequence': latest
+            }))
+            return
+        
+        await self.send(json.dumps({
+            'type': 'resume_result',
+            'messages': messages,
+            'last_sequence': latest
+        }))
+    
     async def handle_edit_message(self, data):
         """Handle message editing"""
         message_id = data.get('message_id')
@@ -579,7 +747,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             # Auto-mark as delivered
             await self.mark_message_delivered(event['message']['id'])
-    
+
+    async def redeliver_message(self, event):
+        """Re-send an undelivered message pushed by the delivery scheduler"""
+        # The user group is shared by all of the user's chat sockets
+        if event['conversation_id'] != int(self.conversation_id):
+            return
+
+        await self.send(json.dumps({
+            'type': 'new_message',
+            'message': event['message']
+        }))
+        await self.mark_message_delivered(event['message']['id'])
+
     async def typing_indicator(self, event):
         """Send typing indicator to WebSocket"""
         # Don't send own typing status back
@@ -634,8 +814,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return []
     
     @database_sync_to_async
-    def create_message(self, content, metadata, filter_result):
-        """Create message in database"""
+    def build_list_delta_frames(self, message):
+        """
+        Encoded conversation_delta frames per participant.
+        
+        The shared part is encoded once; only the recipient's unread
+        count is appended to it.
+        """
+        shared = json.dumps({
+            'type': 'conversation_delta',
+            'conversation_id': message.conversation_id,
+            'message_id': message.id,
+            'sender_id': message.sender_id,
+            'preview': Truncator(
+                message.filtered_content if message.has_filtered_content else message.content
+            ).chars(LIST_PREVIEW_LENGTH),
+            'created_at': message.created_at.isoformat(),
+        })
+        unread_counts = ConversationParticipantState.objects.filter(
+            conversation_id=message.conversation_id
+        ).values_list('user_id', 'unread_count')
+        # Splice the count in before the closing brace of the shared object
+        return {
+            user_id: f'{shared[:-1]}, "unread_count": {unread_count}}}'
+            for user_id, unread_count in unread_counts
+        }
+    
+    @database_sync_to_async
+    def create_message(self, content, metadata, filter_result, client_temp_id=''):
+        """
+        Create message in database.
+        
+        Returns (message, created); created is False when a message with
+        the same temp_id already exists (a retried send).
+        """
         conversation = Conversation.objects.select_related('property').get(
             id=self.conversation_id
         )
@@ -647,7 +859,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'metadata': metadata,
             'delivered': False,
             'read': False,
-            'message_type': metadata.get('type', 'text')
+            'message_type': metadata.get('type', 'text'),
+            'client_temp_id': client_temp_id
         }
         
         if filter_result['action'] == 'warn':
@@ -657,13 +870,30 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'filter_warnings': filter_result['violations']
             })
             
-        message = Message.objects.create(**message_data)
-        
-        # Update conversation's latest_message
-        conversation.latest_message = message
-        conversation.save(update_fields=['latest_message', 'updated_at'])
+        try:
+            with transaction.atomic():
+                message = Message.objects.create(**message_data)
+                if client_temp_id:
+                    MessageClientKey.objects.create(
+                        sender=self.user,
+                        conversation_id=self.conversation_id,
+                        client_temp_id=client_temp_id,
+                        message_id=message.id
+                    )
+        except IntegrityError:
+            if not client_temp_id:
+                raise
+            # Enforced by unique_message_client_temp_id
+            message_id = MessageClientKey.objects.filter(
+                sender=self.user,
+                conversation_id=self.conversation_id,
+                client_temp_id=client_temp_id
+            ).values('message_id')
+            message = Message.objects.get(id__in=message_id)
+            return message, False
         
-        return message
+        # Message.save has updated the conversation's latest_message
+        return message, True
     
     @database_sync_to_async
     def serialize_message(self, message):
@@ -700,24 +930,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def mark_messages_read(self, message_ids):
         """Mark specific messages as read"""
-        return Message.objects.filter(
-            id__in=message_ids,
-            conversation_id=self.conversation_id
-        ).exclude(sender=self.user).update(
-            read=True,
-            read_at=timezone.now()
+        return ConversationStateService.mark_read(
+            self.conversation_id, self.user, message_ids=message_ids
         )
     
     @database_sync_to_async
     def mark_all_read(self):
         """Mark all messages in conversation as read"""
-        return Message.objects.filter(
-            conversation_id=self.conversation_id,
-            read=False
-        ).exclude(sender=self.user).update(
-            read=True,
-            read_at=timezone.now()
-        )
+        return ConversationStateService.mark_read(self.conversation_id, self.user)
     
     @database_sync_to_async
     def update_conversation_timestamp(self):
@@ -734,17 +954,67 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         query = Message.objects.filter(
             conversation_id=self.conversation_id
-        ).select_related('sender').order_by('-created_at')
+        ).select_related('sender', 'upload')
+        archive = ArchivedHistory(self.conversation_id)
         
+        position = None
         if before_id:
-            query = query.filter(id__lt=before_id)
-            
-        messages = query[:limit]
+            before = query.filter(id=before_id).first() or archive.get(int(before_id))
+            if before is None:
+                return []
+            position = (before.created_at, before.id)
+        
+        # Hot and archived messages, merged by (created_at, id)
+        messages = MessageCursorPagination.messages_before(query, position, limit, archive)
         serializer = MessageSerializer(messages, many=True)
         
         # Convert to camelCase and reverse order (oldest first)
         return [snake_to_camel_case(msg) for msg in reversed(serializer.data)]
     
+    @database_sync_to_async
+    def buffer_for_replay(self, sequence, message_data):
+        """Keep a sent message around for reconnecting clients"""
+        try:
+            ReplayBuffer.add(self.conversation_id, sequence, message_data)
+        except Exception as e:
+            logger.error(f"Failed to buffer message for replay: {e}")
+    
+    @database_sync_to_async
+    def get_missed_messages(self, last_sequence):
+        """
+        Latest sequence and the messages after ``last_sequence``.
+        
+        Served from the replay buffer, or from the database when part of
+        the range is no longer buffered (or was sent over REST). Messages
+        are None when the client is more than MAX_REPLAY behind.
+        """
+        from .utils import snake_to_camel_case
+        
+        latest = Conversation.objects.filter(
+            id=self.conversation_id
+        ).values_list('last_sequence', flat=True).first() or 0
+        if last_sequence >= latest:
+            return latest, []
+        if latest - last_sequence > self.MAX_REPLAY:
+            return latest, None
+        
+        try:
+            buffered = ReplayBuffer.get_range(self.conversation_id, last_sequence, latest)
+        except Exception as e:
+            logger.error(f"Replay buffer lookup failed: {e}")
+            buffered = None
+        if buffered is not None:
+            return latest, buffered
+        
+        messages = Message.objects.filter(
+            conversation_id=self.conversation_id,
+            sequence__gt=last_sequence,
+            sequence__lte=latest
+        ).select_related('sender', 'upload').order_by('sequence')
+        return latest, [
+            snake_to_camel_case(data) for data in MessageSerializer(messages, many=True).data
+        ]
+    
     @database_sync_to_async
     def edit_message_in_db(self, message_id, new_content, filter_result):
         """Edit message if user has permission"""
@@ -800,9 +1070,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def filter_content(self, content):
         """Apply content filtering asynchronously"""
         # Run sync filter in thread pool
-        return await database_sync_to_async(
-            self.content_filter.analyze_message
-        )(content)
+        return await database_sync_to_async(self._analyze_with_context)(content)
+    
+    def _analyze_with_context(self, content):
+        # Same rolling context buffer as the REST send path
+        history = ConversationContextCache.get_context(
+            self.conversation_id, self.content_filter.context_window
+        )
+        return self.content_filter.analyze_message(content, history)
     
     async def check_rate_limit(self):
         """Simple rate limiting per user"""
@@ -836,7 +1111,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             logger.error(f"Error sending error message: {e}")
 
-class ConversationListConsumer(AsyncWebsocketConsumer):
+class ConversationListConsumer(DrainMixin, BackpressureMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for real-time conversation list updates"""
     
     def __init__(self, *args, **kwargs):
@@ -882,10 +1157,11 @@ class ConversationListConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         
-        # Send connection success
+        # Send connection success with the current badge count
         await self.send(json.dumps({
             'type': 'connection_established',
             'user_id': self.user.id,
+            'unread_count': await self.get_unread_total(),
             'timestamp': timezone.now().isoformat()
         }))
         
@@ -899,6 +1175,7 @@ class ConversationListConsumer(AsyncWebsocketConsumer):
                     self.user_group_name,
                     self.channel_name
                 )
+                self.forget_channel_stats()
                 
             if hasattr(self, 'user') and self.user and self.connection_time:
                 duration = time.time() - self.connection_time
@@ -943,6 +1220,10 @@ class ConversationListConsumer(AsyncWebsocketConsumer):
             'message': event['message']
         }))
     
+    async def conversation_delta(self, event):
+        """Forward a conversation_delta frame, already encoded by the sender"""
+        await self.send(text_data=event['frame'])
+    
     async def conversation_status_change(self, event):
         """Notify about conversation status change"""
         await self.send(json.dumps({
@@ -950,6 +1231,17 @@ class ConversationListConsumer(AsyncWebsocketConsumer):
             'conversation_id': event['conversation_id'],
             'status': event['status']
         }))
+    
+    async def unread_count_update(self, event):
+        """Push the user's new global unread count"""
+        await self.send(json.dumps({
+            'type': 'unread_count',
+            'unread_count': event['unread_count']
+        }))
+    
+    @database_sync_to_async
+    def get_unread_total(self):
+        return UnreadCounterService.get_total(self.user.id)
 
 
 # class ConversationListConsumer(AsyncWebsocketConsumer):
@@ -0,0 +1,185 @@
+# backend/messaging/delivery.py
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Conversation, Message
+from .monitoring import WebSocketMonitor
+
+logger = logging.getLogger('messaging.delivery')
+
+
+class DeliveryScheduler:
+    """
+    Re-push undelivered messages to recipients that are online.
+
+    Scans pending messages in primary-key order (backed by the
+    ``pending_delivery_idx`` partial index), pushes each eligible message
+    to the ``user_<id>`` group of every online recipient and records the
+    attempts with bulk UPDATEs. Retries follow the exponential backoff
+    defined on ``Message``.
+    """
+
+    BACKLOG_GAUGE = 'delivery_backlog'
+
+    def __init__(self, batch_size: int = 500, grace_seconds: int = 30,
+                 expiry_hours: int = 24, channel_layer=None):
+        self.batch_size = batch_size
+        # Give the live WebSocket fan-out a chance before retrying
+        self.grace_period = timedelta(seconds=grace_seconds)
+        self.expiry = timedelta(hours=expiry_hours)
+        self.channel_layer = channel_layer or get_channel_layer()
+
+    def pending_messages(self):
+        """Undelivered messages still waiting for delivery"""
+        return Message.objects.filter(
+            delivered=False,
+            delivery_status='pending',
+            is_deleted=False
+        )
+
+    def run_once(self) -> Dict[str, int]:
+        """Run a full pass over the pending backlog"""
+        now = timezone.now()
+        stats = {'scanned': 0, 'pushed': 0, 'failed': 0, 'expired': 0}
+
+        # Messages nobody came online for are no longer worth pushing
+        stats['expired'] = self.pending_messages().filter(
+            created_at__lt=now - self.expiry
+        ).update(delivery_status='expired')
+
+        last_id = 0
+        while True:
+            batch = list(
+                self.pending_messages().filter(
+                    id__gt=last_id,
+                    created_at__lte=now - self.grace_period
+                ).order_by('id').values(
+                    'id', 'conversation_id', 'sender_id',
+                    'delivery_attempts', 'last_delivery_attempt'
+                )[:self.batch_size]
+            )
+            if not batch:
+                break
+
+            last_id = batch[-1]['id']
+            stats['scanned'] += len(batch)
+            pushed, failed = self._process_batch(batch, now)
+            stats['pushed'] += pushed
+            stats['failed'] += failed
+
+        # Whatever is still pending, including messages in their grace
+        # period or backoff; counted from pending_delivery_idx alone
+        WebSocketMonitor.set_gauge(self.BACKLOG_GAUGE, self.pending_messages().count())
+
+        if stats['pushed'] or stats['failed'] or stats['expired']:
+            logger.info(
+                f"Delivery pass: scanned={stats['scanned']} pushed={stats['pushed']} "
+                f"failed={stats['failed']} expired={stats['expired']}"
+            )
+        return stats
+
+    @classmethod
+    def get_backlog_size(cls) -> Optional[int]:
+        """Backlog size recorded by the most recent pass"""
+        gauge = WebSocketMonitor.get_gauges().get(cls.BACKLOG_GAUGE)
+        return gauge['value'] if gauge else None
+
+    def _process_batch(self, batch: List[Dict], now):
+        """Push one batch of pending messages and record the attempts"""
+        conversation_ids = {row['conversation_id'] for row in batch}
+        participants = self._get_participants(conversation_ids)
+        online = self._get_online_users(conversation_ids)
+
+        failed_ids = []
+        recipients_by_message = {}
+
+        for row in batch:
+            if row['delivery_attempts'] >= Message.MAX_DELIVERY_ATTEMPTS:
+                failed_ids.append(row['id'])
+                continue
+
+            next_attempt = Message.next_delivery_attempt_at(
+                row['delivery_attempts'], row['last_delivery_attempt']
+            )
+            if next_attempt and now < next_attempt:
+                continue
+
+            conversation_id = row['conversation_id']
+            recipients = (
+                participants.get(conversation_id, set())
+                & online.get(conversation_id, set())
+            ) - {row['sender_id']}
+
+            # Offline recipients get their messages when they reconnect
+            if recipients:
+                recipients_by_message[row['id']] = (conversation_id, recipients)
+
+        if failed_ids:
+            Message.objects.filter(id__in=failed_ids).update(delivery_status='failed')
+
+        if recipients_by_message:
+            self._push(recipients_by_message)
+            Message.objects.filter(id__in=recipients_by_message.keys()).update(
+                delivery_attempts=F('delivery_attempts') + 1,
+                last_delivery_attempt=now
+            )
+
+        return len(recipients_by_message), len(failed_ids)
+
+    def _get_participants(self, conversation_ids):
+        """Map conversation id to participant ids with a single query"""
+        participants = defaultdict(set)
+        rows = Conversation.participants.through.objects.filter(
+            conversation_id__in=conversation_ids
+        ).values_list('conversation_id', 'user_id')
+        for conversation_id, user_id in rows:
+            participants[conversation_id].add(user_id)
+        return participants
+
+    def _get_online_users(self, conversation_ids):
+        """Map conversation id to online user ids from the presence cache"""
+        # Same keys as ChatConsumer.update_user_presence
+        keys = {
+            f'presence:conversation:{conversation_id}': conversation_id
+            for conversation_id in conversation_ids
+        }
+        try:
+            cached = cache.get_many(list(keys))
+        except Exception as e:
+            logger.error(f"Presence lookup failed: {e}")
+            return {}
+        return {keys[key]: set(users) for key, users in cached.items()}
+
+    def _push(self, recipients_by_message):
+        """Send the serialized messages to each recipient's user group"""
+        from .serializers import MessageSerializer
+        from .utils import snake_to_camel_case
+
+        messages = Message.objects.filter(
+            id__in=recipients_by_message.keys()
+        ).select_related('sender', 'sender__university')
+
+        events = []
+        for message in messages:
+            conversation_id, recipients = recipients_by_message[message.id]
+            payload = snake_to_camel_case(MessageSerializer(message).data)
+            for user_id in recipients:
+                events.append((f'user_{user_id}', {
+                    'type': 'redeliver_message',
+                    'conversation_id': conversation_id,
+                    'message': payload
+                }))
+
+        async def send_all():
+            for group, event in events:
+                await self.channel_layer.group_send(group, event)
+
+        async_to_sync(send_all)()
@@ -0,0 +1,205 @@
+# backend/messaging/digest.py
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from typing import Dict, List
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from .models import ConversationParticipantState, DigestWatermark, Message, UnreadDigestState
+
+logger = logging.getLogger('messaging.digest')
+
+User = get_user_model()
+
+
+class UnreadDigestPipeline:
+    """
+    Email recipients about messages they have not read.
+
+    Each run scans unread messages newer than the pipeline watermark
+    (``read=False`` is served by ``unread_messages_idx``) that have sat
+    unread for ``delay``, groups them per recipient and sends one email
+    per user over a single SMTP connection. Per-user watermarks are
+    advanced after every chunk is sent, so an interrupted run resumes
+    without emailing anyone twice. Users emailed within ``window`` are
+    deferred to a later run and hold the pipeline watermark back.
+    """
+
+    WATERMARK = 'unread_digest'
+    SEND_CHUNK_SIZE = 100
+    MESSAGES_PER_CONVERSATION = 3
+
+    def __init__(self, delay_minutes: int = 15, window_minutes: int = 60,
+                 max_messages: int = 5000, connection=None):
+        self.delay = timedelta(minutes=delay_minutes)
+        self.window = timedelta(minutes=window_minutes)
+        self.max_messages = max_messages
+        self.connection = connection
+
+    def run_once(self) -> Dict[str, int]:
+        """Run one digest pass"""
+        now = timezone.now()
+        stats = {'scanned': 0, 'emails': 0, 'deferred': 0}
+
+        watermark, _ = DigestWatermark.objects.get_or_create(name=self.WATERMARK)
+        messages = list(
+            Message.objects.filter(
+                read=False,
+                is_deleted=False,
+                id__gt=watermark.last_message_id,
+                created_at__lte=now - self.delay
+            ).order_by('id').values(
+                'id', 'conversation_id', 'sender_id', 'content',
+                'filtered_content', 'has_filtered_content', 'created_at'
+            )[:self.max_messages]
+        )
+        if not messages:
+            return stats
+        stats['scanned'] = len(messages)
+
+        pending = self._group_by_recipient(messages)
+        states = UnreadDigestState.objects.in_bulk(list(pending))
+        recipients = User.objects.filter(
+            id__in=list(pending),
+            is_active=True
+        ).exclude(email='').in_bulk()
+
+        # Recently emailed users wait for the next window
+        deferred_ids = []
+        digests = []
+        for user_id, user_messages in pending.items():
+            state = states.get(user_id)
+            if state is not None:
+                user_messages = [m for m in user_messages if m['id'] > state.last_message_id]
+            if not user_messages or user_id not in recipients:
+                continue
+            if state is not None and state.last_sent_at and state.last_sent_at > now - self.window:
+                deferred_ids.append(user_messages[0]['id'])
+                continue
+            digests.append((recipients[user_id], user_messages))
+
+        stats['deferred'] = len(deferred_ids)
+        stats['emails'] = self._send(digests, now)
+        if stats['emails']:
+            logger.info(f"Sent {stats['emails']} unread digests, deferred {stats['deferred']}")
+
+        # Everything before the oldest deferred message is done
+        if deferred_ids:
+            position = min(deferred_ids) - 1
+        else:
+            position = messages[-1]['id']
+        if position > watermark.last_message_id:
+            watermark.last_message_id = position
+            watermark.save(update_fields=['last_message_id', 'updated_at'])
+
+        return stats
+
+    def _group_by_recipient(self, messages: List[Dict]) -> Dict[int, List[Dict]]:
+        """Unread messages per recipient, oldest first"""
+        participants = defaultdict(list)
+        for conversation_id, user_id in ConversationParticipantState.objects.filter(
+            conversation_id__in={m['conversation_id'] for m in messages}
+        ).values_list('conversation_id', 'user_id'):
+            participants[conversation_id].append(user_id)
+
+        pending = defaultdict(list)
+        for message in messages:
+            for user_id in participants[message['conversation_id']]:
+                if user_id != message['sender_id']:
+                    pending[user_id].append(message)
+        return pending
+
+    def _send(self, digests, now) -> int:
+        """Send digests in chunks over one connection, recording progress per chunk"""
+        if not digests:
+            return 0
+
+        senders = User.objects.in_bulk({
+            message['sender_id'] for _, user_messages in digests for message in user_messages
+        })
+        connection = self.connection or get_connection()
+        sent = 0
+        with connection:
+            for start in range(0, len(digests), self.SEND_CHUNK_SIZE):
+                chunk = digests[start:start + self.SEND_CHUNK_SIZE]
+                connection.send_messages([
+                    self.build_email(user, user_messages, senders, connection)
+                    for user, user_messages in chunk
+                ])
+                self._record_sent(chunk, now)
+                sent += len(chunk)
+        return sent
+
+    def build_email(self, user, user_messages, senders, connection=None) -> EmailMultiAlternatives:
+        """One email covering every conversation with unread messages"""
+        conversations = defaultdict(list)
+        for message in user_messages:
+            conversations[message['conversation_id']].append(message)
+
+        context = {
+            'user': user,
+            'unread_count': len(user_messages),
+            'conversations': [
+                {
+                    'url': f"{settings.FRONTEND_URL}/messages/{conversation_id}",
+                    'more': max(0, len(conversation_messages) - self.MESSAGES_PER_CONVERSATION),
+                    'messages': [
+                        {
+                            'sender': self._sender_name(senders.get(message['sender_id'])),
+                            'preview': Truncator(
+                                message['filtered_content'] if message['has_filtered_content']
+                                else message['content']
+                            ).chars(140),
+                            'created_at': message['created_at'],
+                        }
+                        # Newest few per conversation
+                        for message in conversation_messages[-self.MESSAGES_PER_CONVERSATION:]
+                    ],
+                }
+                for conversation_id, conversation_messages in conversations.items()
+            ],
+            'messages_url': f"{settings.FRONTEND_URL}/messages",
+        }
+
+        count = len(user_messages)
+        email = EmailMultiAlternatives(
+            subject=f"You have {count} unread message{'s' if count != 1 else ''} on Micalli",
+            body=render_to_string('messaging/email/unread_digest.txt', context),
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[user.email],
+            connection=connection
+        )
+        email.attach_alternative(
+            render_to_string('messaging/email/unread_digest.html', context), 'text/html'
+        )
+        return email
+
+    @staticmethod
+    def _sender_name(sender) -> str:
+        if sender is None:
+            return 'Someone'
+        return sender.get_full_name() or sender.username
+
+    @staticmethod
+    def _record_sent(chunk, now):
+        with transaction.atomic():
+            UnreadDigestState.objects.bulk_create(
+                [
+                    UnreadDigestState(
+                        user_id=user.id,
+                        last_message_id=user_messages[-1]['id'],
+                        last_sent_at=now
+                    )
+                    for user, user_messages in chunk
+                ],
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['last_message_id', 'last_sent_at']
+            )
@@ -0,0 +1,174 @@
+# backend/messaging/draining.py
+import json
+import random
+import signal
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger('messaging.websocket')
+
+# Tells clients the server is restarting; Daphne (autobahn) only allows
+# application close codes in the 4000 range, not 1012 "Service Restart"
+DRAIN_CLOSE_CODE = 4012
+
+
+class ConnectionDrainer:
+    """
+    Drain WebSocket consumers gracefully before the process exits.
+
+    On SIGTERM the drainer stops new sockets from being accepted, sends
+    every open consumer a ``reconnect`` frame with a jittered delay
+    (``reconnect_after_ms``, counted from when the frame arrives) and
+    then closes the consumers in staggered waves spread over the drain
+    period, so clients reconnect to the new process gradually instead of
+    all at once. The previous SIGTERM handler (Daphne's) runs once the
+    drain is complete.
+
+    Configured through the WEBSOCKET_DRAIN setting:
+        WEBSOCKET_DRAIN = {'PERIOD': 30, 'WAVES': 10, 'JITTER': 2.0}
+    """
+
+    def __init__(self, period: Optional[float] = None, waves: Optional[int] = None,
+                 jitter: Optional[float] = None):
+        config = getattr(settings, 'WEBSOCKET_DRAIN', {})
+        self.period = period if period is not None else config.get('PERIOD', 30)
+        self.waves = max(1, waves if waves is not None else config.get('WAVES', 10))
+        self.jitter = jitter if jitter is not None else config.get('JITTER', 2.0)
+
+        self.consumers = set()
+        self.draining = False
+        self.drain_task = None
+        self._signals_installed = False
+        self._previous_handler = None
+
+    # Registry
+
+    def register(self, consumer):
+        """Track an open consumer"""
+        self.install_signal_handler()
+        self.consumers.add(consumer)
+
+    def unregister(self, consumer):
+        """Stop tracking a consumer that has disconnected"""
+        self.consumers.discard(consumer)
+
+    # Signal handling
+
+    def install_signal_handler(self):
+        """
+        Hook SIGTERM on first use.
+
+        Installed lazily from the first connection so the server's own
+        handler is already in place and can be chained.
+        """
+        if self._signals_installed:
+            return
+        self._signals_installed = True
+
+        try:
+            loop = asyncio.get_running_loop()
+            self._previous_handler = signal.getsignal(signal.SIGTERM)
+
+            def handle_sigterm(signum, frame):
+                loop.call_soon_threadsafe(self.start, signum, frame)
+
+            signal.signal(signal.SIGTERM, handle_sigterm)
+            logger.info("Connection draining enabled on SIGTERM")
+        except (RuntimeError, ValueError) as e:
+            # No running loop, or not on the main thread (e.g. tests)
+            logger.debug(f"Could not install drain signal handler: {e}")
+
+    def start(self, signum=None, frame=None):
+        """Begin draining; the previous SIGTERM handler runs afterwards"""
+        if self.draining:
+            return
+        self.draining = True
+        self.drain_task = asyncio.ensure_future(self.drain(signum, frame))
+
+    def _chain_previous_handler(self, signum, frame):
+        previous = self._previous_handler
+        if callable(previous):
+            previous(signum or signal.SIGTERM, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.raise_signal(signal.SIGTERM)
+
+    # Draining
+
+    def plan_waves(self, consumers) -> List[Tuple[float, list]]:
+        """Split consumers into waves evenly spaced over the drain period"""
+        consumers = list(consumers)
+        random.shuffle(consumers)
+
+        wave_count = min(self.waves, len(consumers))
+        if not wave_count:
+            return []
+
+        interval = self.period / wave_count
+        return [
+            (index * interval, consumers[index::wave_count])
+            for index in range(wave_count)
+        ]
+
+    async def drain(self, signum=None, frame=None):
+        """Send reconnect hints and close consumers wave by wave"""
+        self.draining = True
+        waves = self.plan_waves(self.consumers)
+        logger.warning(
+            f"Draining {len(self.consumers)} WebSocket connections "
+            f"in {len(waves)} waves over {self.period}s"
+        )
+
+        # Every client learns when to come back before anyone is closed
+        for delay, consumers in waves:
+            for consumer in consumers:
+                reconnect_after = delay + random.uniform(0, self.jitter)
+                await self._send_reconnect(consumer, reconnect_after)
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for delay, consumers in waves:
+            await asyncio.sleep(max(0, started + delay - loop.time()))
+            await asyncio.gather(
+                *(self._close(consumer) for consumer in consumers),
+                return_exceptions=True
+            )
+
+        logger.warning("WebSocket drain complete")
+        if signum is not None:
+            # Let the last close handshakes finish before the server stops
+            await asyncio.sleep(1)
+            self._chain_previous_handler(signum, frame)
+
+    async def _send_reconnect(self, consumer, reconnect_after):
+        try:
+            await consumer.send(json.dumps({
+                'type': 'reconnect',
+                'reason': 'server_restart',
+                'reconnect_after_ms': int(reconnect_after * 1000),
+                'timestamp': timezone.now().isoformat()
+            }))
+        except Exception as e:
+            logger.debug(f"Could not send reconnect frame: {e}")
+
+    async def _close(self, consumer):
+        try:
+            await consumer.close(code=DRAIN_CLOSE_CODE)
+        except Exception as e:
+            logger.debug(f"Could not close draining consumer: {e}")
+        finally:
+            self.unregister(consumer)
+
+
+_drainer = None
+
+
+def get_drainer() -> ConnectionDrainer:
+    """Process-wide drainer shared by all consumers"""
+    global _drainer
+    if _drainer is None:
+        _drainer = ConnectionDrainer()
+    return _drainer
@@ -0,0 +1,377 @@
+# backend/messaging/loadtest.py
+import os
+import json
+import base64
+import random
+import struct
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger('messaging.loadtest')
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of a list of samples"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class LoadTestStats:
+    """Measurements collected by all simulated users of a run"""
+
+    def __init__(self):
+        self.connect_latency: List[float] = []
+        self.round_trip: List[float] = []
+        self.delivery_latency: List[float] = []
+        self.errors = Counter()
+        self.close_codes = Counter()
+        self.frames = Counter()
+        self.sent = 0
+        self.typing = 0
+        # Drain scenario: offsets (seconds from drain start)
+        self.reconnect_hints: List[float] = []
+        self.reconnect_attempts: List[float] = []
+
+    def summary(self) -> Dict:
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            'connections': len(self.connect_latency),
+            'connect_p50_ms': ms(percentile(self.connect_latency, 50)),
+            'connect_p99_ms': ms(percentile(self.connect_latency, 99)),
+            'messages_sent': self.sent,
+            'typing_events': self.typing,
+            'acks': len(self.round_trip),
+            'rtt_p50_ms': ms(percentile(self.round_trip, 50)),
+            'rtt_p99_ms': ms(percentile(self.round_trip, 99)),
+            'deliveries': len(self.delivery_latency),
+            'delivery_p50_ms': ms(percentile(self.delivery_latency, 50)),
+            'delivery_p99_ms': ms(percentile(self.delivery_latency, 99)),
+            'errors': dict(self.errors),
+            'close_codes': dict(self.close_codes),
+        }
+
+    @staticmethod
+    def histogram(offsets: List[float], bucket_seconds: float = 1.0) -> Dict[int, int]:
+        """Count offsets per bucket, e.g. reconnects per second"""
+        buckets = Counter(int(offset // bucket_seconds) for offset in offsets)
+        return dict(sorted(buckets.items()))
+
+
+class WebSocketConnection:
+    """
+    Minimal asyncio WebSocket client (RFC 6455, text frames only).
+
+    autobahn's asyncio flavour can't be used here: txaio is already bound
+    to Twisted once Daphne is imported, and websocket-client is blocking.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.close_code = None
+
+    @classmethod
+    async def connect(cls, host, port, path, origin, secure=False):
+        reader, writer = await asyncio.open_connection(host, port, ssl=secure or None)
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host}:{port}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            f"Origin: {origin}\r\n\r\n"
+        ).encode())
+        await writer.drain()
+
+        response = await reader.readuntil(b'\r\n\r\n')
+        status_line = response.split(b'\r\n', 1)[0].decode(errors='replace')
+        if ' 101 ' not in status_line + ' ':
+            writer.close()
+            raise ConnectionRefusedError(f"Handshake rejected: {status_line}")
+        return cls(reader, writer)
+
+    async def send_text(self, text):
+        self.writer.write(self._frame(0x1, text.encode('utf8')))
+        await self.writer.drain()
+
+    async def close(self, code=1000):
+        try:
+            self.writer.write(self._frame(0x8, struct.pack('!H', code)))
+            await self.writer.drain()
+        except (ConnectionError, RuntimeError):
+            pass
+
+    async def recv(self) -> Optional[str]:
+        """Next text frame, or None once the connection is closed"""
+        message = b''
+        while True:
+            try:
+                header = await self.reader.readexactly(2)
+                opcode = header[0] & 0x0F
+                length = header[1] & 0x7F
+                if length == 126:
+                    length = struct.unpack('!H', await self.reader.readexactly(2))[0]
+                elif length == 127:
+                    length = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+                payload = await self.reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                self.close_code = self.close_code or 1006
+                return None
+
+            if opcode == 0x8:
+                self.close_code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else 1005
+                await self.close(self.close_code)
+                self.writer.close()
+                return None
+            if opcode == 0x9:
+                self.writer.write(self._frame(0xA, payload))
+                continue
+            if opcode in (0x1, 0x0):
+                message += payload
+                if header[0] & 0x80:
+                    return message.decode('utf8')
+
+    @staticmethod
+    def _frame(opcode, payload):
+        # Client frames must be masked
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        masked = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+        return header + mask + masked
+
+
+class SimulatedUser:
+    """A single user holding a chat socket and sending at random intervals"""
+
+    def __init__(self, run: 'LoadTestRun', user_id: int, token: str, conversation_id: int):
+        self.run = run
+        self.user_id = user_id
+        self.token = token
+        self.conversation_id = conversation_id
+        self.connection = None
+        self.reader_task = None
+        self.reconnect_after = None
+        self.sequence = 0
+
+    @property
+    def path(self):
+        return f"{self.run.path_prefix}/ws/chat/{self.conversation_id}/?token={self.token}"
+
+    async def connect(self) -> bool:
+        """Open the socket and wait for connection_established"""
+        loop = asyncio.get_running_loop()
+        stats = self.run.stats
+        started = loop.time()
+        try:
+            connection = await asyncio.wait_for(
+                WebSocketConnection.connect(
+                    self.run.host, self.run.port, self.path, self.run.origin, self.run.secure
+                ),
+                timeout=self.run.connect_timeout
+            )
+            text = await asyncio.wait_for(connection.recv(), self.run.connect_timeout)
+        except asyncio.TimeoutError:
+            stats.errors['connect_timeout'] += 1
+            return False
+        except OSError as e:
+            stats.errors['connect_refused' if isinstance(e, ConnectionRefusedError) else 'connect_error'] += 1
+            return False
+
+        if text is None:
+            stats.errors[f'rejected:{connection.close_code}'] += 1
+            stats.close_codes[connection.close_code] += 1
+            return False
+
+        self.connection = connection
+        self.on_text(text)
+        stats.connect_latency.append(loop.time() - started)
+        self.reader_task = asyncio.ensure_future(self.read_frames(connection))
+        return True
+
+    async def read_frames(self, connection):
+        while True:
+            text = await connection.recv()
+            if text is None:
+                break
+            self.on_text(text)
+        self.on_close(connection.close_code)
+
+    async def act(self, until: float):
+        """Send messages and typing events at the configured rates"""
+        loop = asyncio.get_running_loop()
+        message_rate = self.run.message_rate / 60
+        typing_rate = self.run.typing_rate / 60
+        total_rate = message_rate + typing_rate
+        if not total_rate:
+            return
+
+        while self.connection:
+            await asyncio.sleep(min(random.expovariate(total_rate), max(0, until - loop.time())))
+            if not self.connection or loop.time() >= until:
+                break
+            if random.random() < message_rate / total_rate:
+                await self.send_message()
+            else:
+                await self.send_typing()
+
+    async def send_message(self):
+        self.sequence += 1
+        temp_id = f"lt-{self.user_id}-{self.sequence}"
+        self.run.sent_at[temp_id] = asyncio.get_running_loop().time()
+        await self.send({
+            'type': 'send_message',
+            'content': f"Load test message {self.sequence} from user {self.user_id}",
+            'temp_id': temp_id
+        })
+        self.run.stats.sent += 1
+
+    async def send_typing(self):
+        await self.send({'type': 'typing_start'})
+        self.run.stats.typing += 1
+
+    async def send(self, frame):
+        if not self.connection:
+            return
+        try:
+            await self.connection.send_text(json.dumps(frame))
+        except (ConnectionError, RuntimeError):
+            self.run.stats.errors['send_failed'] += 1
+
+    async def close(self):
+        self.reconnect_after = None
+        if self.connection:
+            await self.connection.close()
+
+    # Socket events
+
+    def on_text(self, text):
+        try:
+            self.on_frame(json.loads(text))
+        except ValueError:
+            self.run.stats.errors['invalid_json'] += 1
+
+    def on_frame(self, frame):
+        stats = self.run.stats
+        now = asyncio.get_running_loop().time()
+        frame_type = frame.get('type')
+        stats.frames[frame_type] += 1
+
+        if frame_type == 'message_sent':
+            sent_at = self.run.sent_at.get(frame.get('temp_id'))
+            if sent_at is not None:
+                stats.round_trip.append(now - sent_at)
+        elif frame_type == 'new_message':
+            sent_at = self.run.sent_at.get(frame.get('message', {}).get('temp_id'))
+            if sent_at is not None:
+                stats.delivery_latency.append(now - sent_at)
+        elif frame_type == 'error':
+            stats.errors[f"server_error:{frame.get('code') or frame.get('message')}"] += 1
+        elif frame_type == 'reconnect':
+            # Delay counts from now, not from when the socket closes
+            self.reconnect_after = now + frame.get('reconnect_after_ms', 0) / 1000
+            if self.run.drain_started is not None:
+                stats.reconnect_hints.append(now - self.run.drain_started)
+
+    def on_close(self, code):
+        self.connection = None
+        self.run.stats.close_codes[code] += 1
+
+        # Drain scenario: come back when the server asked us to
+        if self.reconnect_after is not None:
+            delay = max(0, self.reconnect_after - asyncio.get_running_loop().time())
+            self.reconnect_after = None
+            asyncio.ensure_future(self.reconnect(delay))
+
+    async def reconnect(self, delay):
+        await asyncio.sleep(delay)
+        if self.run.drain_started is not None:
+            self.run.stats.reconnect_attempts.append(
+                asyncio.get_running_loop().time() - self.run.drain_started
+            )
+        await self.connect()
+
+
+class LoadTestRun:
+    """
+    Drive many simulated users against a running server.
+
+    Scenarios:
+    - steady: users connect over the ramp-up period, then send messages and
+      typing events at the configured per-minute rates for the duration
+    - drain: users connect, then the server is sent SIGTERM (or drained
+      externally) and the reconnect hints and attempts are recorded so the
+      reconnect curve can be inspected
+    """
+
+    def __init__(self, base_url: str, users: List[Dict], origin: str = 'http://localhost:3000',
+                 duration: float = 60, ramp_up: float = 10, message_rate: float = 6,
+                 typing_rate: float = 6, connect_timeout: float = 10):
+        parsed = urlparse(base_url)
+        self.path_prefix = parsed.path.rstrip('/')
+        self.secure = parsed.scheme == 'wss'
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or (443 if self.secure else 80)
+        self.origin = origin
+        self.duration = duration
+        self.ramp_up = ramp_up
+        self.message_rate = message_rate
+        self.typing_rate = typing_rate
+        self.connect_timeout = connect_timeout
+
+        self.stats = LoadTestStats()
+        self.sent_at: Dict[str, float] = {}
+        self.drain_started = None
+        self.users = [
+            SimulatedUser(self, user['user_id'], user['token'], user['conversation_id'])
+            for user in users
+        ]
+
+    async def connect_all(self):
+        """Connect every user, spread evenly over the ramp-up period"""
+        interval = self.ramp_up / len(self.users) if self.users else 0
+
+        async def delayed_connect(index, user):
+            await asyncio.sleep(index * interval)
+            await user.connect()
+
+        await asyncio.gather(*(
+            delayed_connect(index, user) for index, user in enumerate(self.users)
+        ))
+
+    async def run_steady(self):
+        await self.connect_all()
+        until = asyncio.get_running_loop().time() + self.duration
+        await asyncio.gather(*(user.act(until) for user in self.users))
+        # Give in-flight acks a moment to arrive
+        await asyncio.sleep(1)
+        await self.close_all()
+
+    async def run_drain(self, trigger=None):
+        """Connect everyone, trigger a drain and wait for the reconnects"""
+        await self.connect_all()
+        self.drain_started = asyncio.get_running_loop().time()
+        if trigger:
+            trigger()
+
+        await asyncio.sleep(self.duration)
+        await self.close_all()
+
+    async def close_all(self):
+        await asyncio.gather(*(user.close() for user in self.users), return_exceptions=True)
+        await asyncio.sleep(0.5)
@@ -1,8 +1,13 @@
 # backend/messaging/management/commands/cleanup_messages.py
 from django.core.management.base import BaseCommand
+from django.db.models import Count
 from django.utils import timezone
 from datetime import timedelta
-from messaging.models import Message, Conversation
+from messaging.models import Message, Conversation, ConversationChange, MessageArchiveSegment
+from messaging.archive import MessageArchiveService
+from messaging.partitions import MessagePartitionManager
+from messaging.services.change_log import ChangeLogService
+from messaging.services.conversation_state import ConversationStateService
 from django.db import transaction
 import logging
 
@@ -31,6 +36,16 @@ class Command(BaseCommand):
             default=1000,
             help='Process records in batches of this size'
         )
+        parser.add_argument(
+            '--cold-storage',
+            action='store_true',
+            help='Move messages of archived conversations to the message archive storage'
+        )
+        parser.add_argument(
+            '--detach',
+            action='store_true',
+            help='Detach expired message partitions instead of dropping them'
+        )
         parser.add_argument(
             '--dry-run',
             action='store_true',
@@ -59,12 +74,24 @@ class Command(BaseCommand):
         # Archive old conversations
         self._archive_conversations(archive_cutoff, batch_size, dry_run)
         
+        # Move archived conversations' history out of the messages table
+        if options['cold_storage']:
+            self._export_archived_messages(archive_cutoff, dry_run)
+        
         # Clean up old delivered messages
-        self._cleanup_old_messages(delete_cutoff, batch_size, dry_run)
+        partitions = MessagePartitionManager()
+        if partitions.is_partitioned():
+            self._drop_old_partitions(partitions, delete_cutoff, options['detach'], dry_run)
+        else:
+            self._cleanup_old_messages(delete_cutoff, batch_size, dry_run)
+        self._prune_archive_segments(delete_cutoff, dry_run)
         
         # Clean up orphaned data
         self._cleanup_orphaned_data(dry_run)
         
+        # Drop delta sync entries past retention
+        self._prune_change_log(batch_size, dry_run)
+        
         self.stdout.write(self.style.SUCCESS("Cleanup completed successfully"))
     
     def _archive_conversations(self, cutoff_date, batch_size, dry_run):
@@ -87,6 +114,26 @@ class Command(BaseCommand):
                 
                 logger.info(f"Archived {updated} conversations older than {cutoff_date}")
     
+    def _export_archived_messages(self, cutoff_date, dry_run):
+        """Write old messages of archived conversations to cold storage"""
+        conversation_ids = list(
+            Conversation.objects.filter(
+                status='archived',
+                messages__created_at__lt=cutoff_date
+            ).distinct().values_list('id', flat=True)
+        )
+        self.stdout.write(f"Found {len(conversation_ids)} archived conversations with hot messages")
+        
+        if dry_run or not conversation_ids:
+            return
+        
+        exported = 0
+        for conversation_id in conversation_ids:
+            exported += MessageArchiveService.archive_conversation(conversation_id, before=cutoff_date)
+        
+        self.stdout.write(self.style.SUCCESS(f"Moved {exported} messages to cold storage"))
+        logger.info(f"Moved {exported} messages of {len(conversation_ids)} archived conversations to cold storage")
+    
     def _cleanup_old_messages(self, cutoff_date, batch_size, dry_run):
         """Delete very old, read messages"""
         # Only delete messages that are:
@@ -109,12 +156,17 @@ class Command(BaseCommand):
             
             while True:
                 # Delete in batches to avoid locking issues
-                batch_ids = list(queryset.values_list('id', flat=True)[:batch_size])
+                batch = list(queryset.values_list('id', 'conversation_id')[:batch_size])
                 
-                if not batch_ids:
+                if not batch:
                     break
                 
-                deleted, _ = Message.objects.filter(id__in=batch_ids).delete()
+                batch_ids = [message_id for message_id, _ in batch]
+                with transaction.atomic(), ChangeLogService.collect_deletions():
+                    deleted, _ = Message.objects.filter(id__in=batch_ids).delete()
+                    
+                    # Bulk deletes bypass Message.save; recount affected inboxes
+                    ConversationStateService.refresh({conversation_id for _, conversation_id in batch})
                 deleted_count += deleted
                 
                 self.stdout.write(f"Deleted {deleted_count}/{total_count} messages...")
@@ -122,6 +174,50 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS(f"Deleted {deleted_count} old messages"))
             logger.info(f"Deleted {deleted_count} messages older than {cutoff_date}")
     
+    def _drop_old_partitions(self, partitions, cutoff_date, detach, dry_run):
+        """Drop whole months of messages older than the cutoff"""
+        # A month is removed as a unit once all of it is past the cutoff;
+        # months holding messages of flagged conversations are kept
+        expired = partitions.expired_partitions(cutoff_date)
+        self.stdout.write(f"Found {len(expired)} message partitions past the cutoff")
+        
+        removed = 0
+        for name in expired.values():
+            if partitions.has_flagged_messages(name):
+                self.stdout.write(self.style.WARNING(f"Keeping {name}: it has flagged conversations"))
+                continue
+            
+            if dry_run:
+                self.stdout.write(f"Would {'detach' if detach else 'drop'} {name}")
+                continue
+            
+            partitions.remove_partition(name, detach_only=detach)
+            removed += 1
+            self.stdout.write(f"{'Detached' if detach else 'Dropped'} {name}")
+        
+        if removed:
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} message partitions"))
+            logger.info(f"Removed {removed} message partitions older than {cutoff_date}")
+    
+    def _prune_archive_segments(self, cutoff_date, dry_run):
+        """Delete cold-storage segments past the retention period"""
+        segments = MessageArchiveSegment.objects.filter(
+            last_created_at__lt=cutoff_date,
+            conversation__has_flagged_content=False
+        ).exclude(
+            conversation__status='flagged'
+        )
+        
+        total_count = segments.count()
+        if total_count == 0:
+            return
+        
+        self.stdout.write(f"Found {total_count} archive segments past the cutoff")
+        if not dry_run:
+            # Segment files are removed by the post_delete signal
+            deleted, _ = segments.delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} archive segments"))
+    
     def _cleanup_orphaned_data(self, dry_run):
         """Clean up orphaned data"""
         # Delete conversations with no messages
@@ -137,3 +233,15 @@ class Command(BaseCommand):
             if not dry_run:
                 deleted, _ = empty_conversations.delete()
                 self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} empty conversations"))
+    
+    def _prune_change_log(self, batch_size, dry_run):
+        """Delete change log entries older than the sync retention period"""
+        cutoff = timezone.now() - timedelta(days=ChangeLogService.RETENTION_DAYS)
+        
+        if dry_run:
+            total_count = ConversationChange.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f"Found {total_count} change log entries to prune")
+            return
+        
+        deleted = ChangeLogService.prune(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} change log entries"))
@@ -0,0 +1,51 @@
+# backend/messaging/management/commands/create_message_partitions.py
+from django.core.management.base import BaseCommand, CommandError
+from messaging.partitions import MessagePartitionError, MessagePartitionManager
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly partitions of the messages table (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='Make sure partitions exist this many months past the current one'
+        )
+        parser.add_argument(
+            '--convert',
+            action='store_true',
+            help='One-time: rebuild the messages table as a partitioned table (copies every row)'
+        )
+        parser.add_argument(
+            '--drop-foreign-keys',
+            action='store_true',
+            help='With --convert: drop the foreign keys pointing at messages, which a partitioned table cannot keep'
+        )
+
+    def handle(self, *args, **options):
+        manager = MessagePartitionManager()
+        months_ahead = options['months_ahead']
+
+        try:
+            if options['convert']:
+                foreign_keys = manager.inbound_foreign_keys()
+                created = manager.convert(
+                    months_ahead=months_ahead,
+                    drop_foreign_keys=options['drop_foreign_keys']
+                )
+                for table, name in foreign_keys:
+                    self.stdout.write(self.style.WARNING(f"Dropped foreign key {name} on {table}"))
+                self.stdout.write(self.style.SUCCESS(
+                    f"Partitioned {manager.TABLE} into {created} monthly partitions"
+                ))
+                return
+
+            created = manager.ensure_partitions(months_ahead=months_ahead)
+        except MessagePartitionError as e:
+            raise CommandError(str(e))
+
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions created"))
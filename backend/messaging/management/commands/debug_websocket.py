@@ -7,8 +7,10 @@ import asyncio
 import websocket
 import json
 import time
+import os
+import signal
 from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
 User = get_user_model()
 
@@ -22,6 +24,24 @@ class Command(BaseCommand):
         parser.add_argument('--check-channel-layer', action='store_true', help='Check channel layer')
         parser.add_argument('--user-id', type=int, help='User ID for testing')
         parser.add_argument('--conversation-id', type=int, help='Conversation ID for testing')
+        
+        # Load testing
+        parser.add_argument('--load', action='store_true', help='Run a load test with simulated users')
+        parser.add_argument('--users', type=int, default=100, help='Number of simulated users (load test)')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to keep users active (load test)')
+        parser.add_argument('--ramp-up', type=float, default=10, help='Seconds over which users connect (load test)')
+        parser.add_argument('--message-rate', type=float, default=6, help='Messages per user per minute (load test)')
+        parser.add_argument('--typing-rate', type=float, default=6, help='Typing events per user per minute (load test)')
+        parser.add_argument('--url', default='ws://localhost:8000', help='Server base URL (load test)')
+        parser.add_argument('--origin', default='http://localhost:3000', help='Origin header sent by simulated users')
+        parser.add_argument(
+            '--scenario',
+            choices=['steady', 'drain'],
+            default='steady',
+            help='steady: send and type at the given rates; drain: measure reconnects during a drain'
+        )
+        parser.add_argument('--drain-pid', type=int, help='Server PID to send SIGTERM to (drain scenario)')
+        parser.add_argument('--cleanup', action='store_true', help='Delete load test users and conversations')
 
     def handle(self, *args, **options):
         if options['check_redis']:
@@ -35,6 +55,12 @@ class Command(BaseCommand):
                 options.get('user_id', 1),
                 options.get('conversation_id', 1)
             )
+        
+        if options['load']:
+            self.run_load_test(options)
+        
+        if options['cleanup']:
+            self.cleanup_load_test()
 
     def check_redis(self):
         """Test Redis connection and operations"""
@@ -150,3 +176,149 @@ class Command(BaseCommand):
             
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"✗ WebSocket test failed: {e}"))
+
+    # Load testing
+    
+    LOAD_TEST_PREFIX = 'loadtest_'
+    
+    def setup_load_test_users(self, count):
+        """Create simulated users in pairs, each pair sharing a conversation"""
+        from messaging.models import Conversation
+        
+        count += count % 2
+        usernames = [f'{self.LOAD_TEST_PREFIX}{index:05d}' for index in range(count)]
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        
+        new_users = []
+        for username in usernames:
+            if username in existing:
+                continue
+            user = User(
+                username=username,
+                email=f'{username}@loadtest.local',
+                first_name='Load',
+                last_name='Test',
+                user_type='student'
+            )
+            # Hashing thousands of passwords would dominate setup time
+            user.set_unusable_password()
+            new_users.append(user)
+        User.objects.bulk_create(new_users, batch_size=1000)
+        
+        users = list(User.objects.filter(username__in=usernames).order_by('username'))
+        user_ids = [user.id for user in users]
+        
+        # Reuse conversations from previous runs
+        participants = {}
+        rows = Conversation.participants.through.objects.filter(
+            user_id__in=user_ids
+        ).values_list('conversation_id', 'user_id')
+        for conversation_id, user_id in rows:
+            participants.setdefault(conversation_id, set()).add(user_id)
+        conversation_for_pair = {
+            frozenset(members): conversation_id
+            for conversation_id, members in participants.items()
+            if len(members) == 2
+        }
+        
+        simulated = []
+        for first, second in zip(users[::2], users[1::2]):
+            pair = frozenset((first.id, second.id))
+            conversation_id = conversation_for_pair.get(pair)
+            if conversation_id is None:
+                conversation = Conversation.objects.create()
+                conversation.participants.add(first, second)
+                conversation_id = conversation.id
+            
+            for user in (first, second):
+                simulated.append({
+                    'user_id': user.id,
+                    # Access tokens only: refresh tokens would fill the blacklist tables
+                    'token': str(AccessToken.for_user(user)),
+                    'conversation_id': conversation_id
+                })
+        
+        return simulated
+    
+    def run_load_test(self, options):
+        """Drive simulated users against a running server and report the results"""
+        from messaging.loadtest import LoadTestRun
+        from messaging.monitoring import WebSocketMonitor
+        
+        self.stdout.write(f"Preparing {options['users']} simulated users...")
+        users = self.setup_load_test_users(options['users'])
+        
+        run = LoadTestRun(
+            options['url'],
+            users,
+            origin=options['origin'],
+            duration=options['duration'],
+            ramp_up=options['ramp_up'],
+            message_rate=options['message_rate'],
+            typing_rate=options['typing_rate']
+        )
+        
+        # Server-side counters are shared through the cache (Redis)
+        metrics_before = WebSocketMonitor.get_metrics()
+        
+        self.stdout.write(
+            f"Running '{options['scenario']}' scenario against {options['url']} "
+            f"with {len(users)} users..."
+        )
+        started = time.time()
+        if options['scenario'] == 'drain':
+            trigger = None
+            if options['drain_pid']:
+                trigger = lambda: os.kill(options['drain_pid'], signal.SIGTERM)
+            else:
+                self.stdout.write("Send SIGTERM to the server now to start the drain")
+            asyncio.run(run.run_drain(trigger))
+        else:
+            asyncio.run(run.run_steady())
+        elapsed = time.time() - started
+        
+        self.stdout.write(self.style.SUCCESS(f"\nLoad test finished in {elapsed:.1f}s"))
+        for key, value in run.stats.summary().items():
+            self.stdout.write(f"  {key}: {value}")
+        
+        metrics_after = WebSocketMonitor.get_metrics()
+        self.stdout.write("\nServer counters (delta):")
+        for key in sorted(set(metrics_before) | set(metrics_after)):
+            delta = metrics_after.get(key, 0) - metrics_before.get(key, 0)
+            self.stdout.write(f"  {key}: {delta}")
+        for name, gauge in WebSocketMonitor.get_gauges().items():
+            self.stdout.write(f"  {name}: {gauge['value']} (at {gauge['updated_at']})")
+        
+        if options['scenario'] == 'drain':
+            self.write_histogram("Reconnect hints (s after drain start)", run.stats.reconnect_hints)
+            self.write_histogram("Reconnect attempts (s after drain start)", run.stats.reconnect_attempts)
+    
+    def write_histogram(self, title, offsets):
+        from messaging.loadtest import LoadTestStats
+        
+        self.stdout.write(f"\n{title}:")
+        histogram = LoadTestStats.histogram(offsets)
+        if not histogram:
+            self.stdout.write("  (none)")
+            return
+        peak = max(histogram.values())
+        for second, count in histogram.items():
+            bar = '#' * max(1, round(count / peak * 50))
+            self.stdout.write(f"  {second:>4}s {count:>6} {bar}")
+    
+    def cleanup_load_test(self):
+        """Remove users and conversations created by load tests"""
+        from messaging.models import Conversation
+        
+        users = User.objects.filter(
+            username__startswith=self.LOAD_TEST_PREFIX,
+            email__endswith='@loadtest.local'
+        )
+        conversations = Conversation.objects.filter(participants__in=users).distinct()
+        conversation_count = conversations.count()
+        user_count = users.count()
+        Conversation.objects.filter(id__in=conversations.values('id')).delete()
+        users.delete()
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Removed {user_count} load test users and {conversation_count} conversations"
+        ))
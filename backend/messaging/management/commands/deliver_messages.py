@@ -0,0 +1,70 @@
+# backend/messaging/management/commands/deliver_messages.py
+import time
+import logging
+from django.core.management.base import BaseCommand
+from messaging.delivery import DeliveryScheduler
+
+logger = logging.getLogger('messaging.delivery')
+
+
+class Command(BaseCommand):
+    help = 'Retry delivery of undelivered messages to online recipients'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=15,
+            help='Seconds to wait between delivery passes'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of pending messages scanned per query'
+        )
+        parser.add_argument(
+            '--grace-seconds',
+            type=int,
+            default=30,
+            help='Only retry messages older than this many seconds'
+        )
+        parser.add_argument(
+            '--expiry-hours',
+            type=int,
+            default=24,
+            help='Stop retrying messages older than this many hours'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single pass and exit'
+        )
+
+    def handle(self, *args, **options):
+        scheduler = DeliveryScheduler(
+            batch_size=options['batch_size'],
+            grace_seconds=options['grace_seconds'],
+            expiry_hours=options['expiry_hours']
+        )
+
+        self.stdout.write("Starting message delivery scheduler...")
+
+        try:
+            while True:
+                try:
+                    stats = scheduler.run_once()
+                    self.stdout.write(
+                        f"Scanned {stats['scanned']}, pushed {stats['pushed']}, "
+                        f"failed {stats['failed']}, expired {stats['expired']}"
+                    )
+                except Exception as e:
+                    logger.error(f"Delivery pass failed: {e}", exc_info=True)
+                    if options['once']:
+                        raise
+
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Delivery scheduler stopped"))
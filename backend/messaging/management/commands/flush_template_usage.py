@@ -0,0 +1,44 @@
+# backend/messaging/management/commands/flush_template_usage.py
+import time
+import logging
+from django.core.management.base import BaseCommand
+from messaging.cache import TemplateUsageBuffer
+
+logger = logging.getLogger('messaging.templates')
+
+
+class Command(BaseCommand):
+    help = 'Write buffered message template usage counts to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=60,
+            help='Seconds to wait between flushes'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Flush once and exit'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Starting template usage flusher...")
+
+        try:
+            while True:
+                try:
+                    flushed = TemplateUsageBuffer.flush()
+                    if flushed:
+                        self.stdout.write(f"Flushed {flushed} template uses")
+                except Exception as e:
+                    logger.error(f"Template usage flush failed: {e}", exc_info=True)
+                    if options['once']:
+                        raise
+
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Template usage flusher stopped"))
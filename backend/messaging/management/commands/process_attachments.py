@@ -0,0 +1,60 @@
+# backend/messaging/management/commands/process_attachments.py
+import time
+import logging
+from django.core.management.base import BaseCommand
+from messaging.attachments import AttachmentProcessor
+
+logger = logging.getLogger('messaging.attachments')
+
+
+class Command(BaseCommand):
+    help = 'Assemble, verify and thumbnail completed chunked attachment uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=5,
+            help='Seconds to wait between processing passes'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='Maximum uploads processed per pass'
+        )
+        parser.add_argument(
+            '--expiry-hours',
+            type=int,
+            default=24,
+            help='Expire upload sessions idle for this many hours'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single pass and exit'
+        )
+
+    def handle(self, *args, **options):
+        processor = AttachmentProcessor(expiry_hours=options['expiry_hours'])
+
+        self.stdout.write("Starting attachment processor...")
+
+        try:
+            while True:
+                try:
+                    stats = processor.run_once(batch_size=options['batch_size'])
+                    self.stdout.write(
+                        f"Processed {stats['processed']}, failed {stats['failed']}, "
+                        f"expired {stats['expired']}"
+                    )
+                except Exception as e:
+                    logger.error(f"Attachment processing pass failed: {e}", exc_info=True)
+                    if options['once']:
+                        raise
+
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Attachment processor stopped"))
@@ -0,0 +1,70 @@
+# backend/messaging/management/commands/send_unread_digests.py
+import time
+import logging
+from django.core.management.base import BaseCommand
+from messaging.digest import UnreadDigestPipeline
+
+logger = logging.getLogger('messaging.digest')
+
+
+class Command(BaseCommand):
+    help = 'Email users a digest of messages they have left unread'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=300,
+            help='Seconds to wait between digest passes'
+        )
+        parser.add_argument(
+            '--delay-minutes',
+            type=int,
+            default=15,
+            help='Only include messages unread for at least this many minutes'
+        )
+        parser.add_argument(
+            '--window-minutes',
+            type=int,
+            default=60,
+            help='Send each user at most one digest per this many minutes'
+        )
+        parser.add_argument(
+            '--max-messages',
+            type=int,
+            default=5000,
+            help='Maximum unread messages scanned per pass'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single pass and exit'
+        )
+
+    def handle(self, *args, **options):
+        pipeline = UnreadDigestPipeline(
+            delay_minutes=options['delay_minutes'],
+            window_minutes=options['window_minutes'],
+            max_messages=options['max_messages']
+        )
+
+        self.stdout.write("Starting unread digest pipeline...")
+
+        try:
+            while True:
+                try:
+                    stats = pipeline.run_once()
+                    self.stdout.write(
+                        f"Scanned {stats['scanned']}, emailed {stats['emails']}, "
+                        f"deferred {stats['deferred']}"
+                    )
+                except Exception as e:
+                    logger.error(f"Digest pass failed: {e}", exc_info=True)
+                    if options['once']:
+                        raise
+
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING("Unread digest pipeline stopped"))
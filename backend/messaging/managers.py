@@ -1,5 +1,5 @@
 # backend/messaging/managers.py
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.db.models import Count, Q, Max, Prefetch
 
 
@@ -7,21 +7,24 @@ class ConversationQuerySet(models.QuerySet):
     """Optimized queryset for conversations"""
     
     def with_details(self):
-        """Prefetch all related data for list views"""
-        from .models import Message  # Import here to avoid circular imports
+        """Load everything list serializers need in a fixed number of queries"""
+        from django.contrib.auth import get_user_model
+        from properties.models import PropertyImage
         
         return self.select_related(
             'property',
             'property__owner',
-            'latest_message',
-            'latest_message__sender'
+            'property__owner__university',
+            'latest_message'
         ).prefetch_related(
-            'participants',
-            'participants__university',
             Prefetch(
-                'messages',
-                queryset=Message.objects.order_by('-created_at')[:1],
-                to_attr='recent_messages'
+                'participants',
+                queryset=get_user_model().objects.select_related('university')
+            ),
+            Prefetch(
+                'property__images',
+                queryset=PropertyImage.objects.filter(is_main=True),
+                to_attr='main_images'
             )
         )
     
@@ -62,6 +65,43 @@ class ConversationManager(models.Manager):
     
     def for_user(self, user):
         return self.get_queryset().for_user(user)
+    
+    def get_or_create_for_participants(self, users, property=None, conversation_type='general', **defaults):
+        """
+        Find or start the conversation between ``users``.
+        
+        Two-party conversations are keyed by participant_key, so starting
+        one twice - or concurrently - returns the same conversation.
+        Returns (conversation, created); any other constraint violation
+        raises IntegrityError.
+        """
+        user_ids = {user.id for user in users}
+        key = None
+        if len(user_ids) == 2:
+            key = self.model.build_participant_key(
+                user_ids, property.id if property else None, conversation_type
+            )
+            conversation = self.filter(participant_key=key).first()
+            if conversation is not None:
+                return conversation, False
+        
+        try:
+            with transaction.atomic():
+                # A concurrent insert of the same key waits for the other
+                # transaction and then fails here
+                conversation = self.create(
+                    property=property,
+                    conversation_type=conversation_type,
+                    participant_key=key,
+                    **defaults
+                )
+                conversation.participants.add(*users)
+        except IntegrityError:
+            conversation = self.filter(participant_key=key).first() if key else None
+            if conversation is None:
+                raise
+            return conversation, False
+        return conversation, True
 
 
 class MessageQuerySet(models.QuerySet):
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-19 06:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('delivered', False), ('delivery_status', 'pending'), ('is_deleted', False)), fields=['id'], name='pending_delivery_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-19 06:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0002_message_pending_delivery_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='client_temp_id',
+            field=models.CharField(blank=True, help_text='Client-generated temp_id used to deduplicate retried sends', max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(condition=models.Q(('client_temp_id', ''), _negated=True), fields=('sender', 'conversation', 'client_temp_id'), name='unique_message_client_temp_id'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.1 on 2026-10-19 06:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def backfill_participant_states(apps, schema_editor):
+    """Create a state row per participant from the existing messages"""
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Message = apps.get_model('messaging', 'Message')
+    State = apps.get_model('messaging', 'ConversationParticipantState')
+    Participant = Conversation.participants.through
+
+    last_id = 0
+    while True:
+        conversations = list(
+            Conversation.objects.filter(id__gt=last_id)
+            .order_by('id').values_list('id', 'created_at')[:1000]
+        )
+        if not conversations:
+            break
+        last_id = conversations[-1][0]
+        ids = [conversation_id for conversation_id, _ in conversations]
+        created = dict(conversations)
+
+        totals = {
+            row['conversation_id']: row
+            for row in Message.objects.filter(conversation_id__in=ids)
+            .values('conversation_id').annotate(
+                total=Count('id'),
+                unread=Count('id', filter=Q(read=False)),
+                last_activity=Max('created_at')
+            )
+        }
+        sent_unread = {
+            (row['conversation_id'], row['sender_id']): row['unread']
+            for row in Message.objects.filter(conversation_id__in=ids, read=False)
+            .values('conversation_id', 'sender_id').annotate(unread=Count('id'))
+        }
+        last_messages = dict(
+            Message.objects.filter(conversation_id__in=ids)
+            .order_by('conversation_id', '-created_at')
+            .distinct('conversation_id').values_list('conversation_id', 'id')
+        )
+
+        states = []
+        rows = Participant.objects.filter(conversation_id__in=ids).values_list('conversation_id', 'user_id')
+        for conversation_id, user_id in rows:
+            total = totals.get(conversation_id)
+            unread = (total['unread'] if total else 0) - sent_unread.get((conversation_id, user_id), 0)
+            last_message_id = last_messages.get(conversation_id)
+            states.append(State(
+                conversation_id=conversation_id,
+                user_id=user_id,
+                message_count=total['total'] if total else 0,
+                unread_count=unread,
+                last_message_id=last_message_id,
+                last_read_message_id=last_message_id if not unread else None,
+                last_activity=total['last_activity'] if total else created[conversation_id]
+            ))
+        State.objects.bulk_create(states, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0003_message_client_temp_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationParticipantState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('last_activity', models.DateTimeField(default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participant_states', to='messaging.conversation')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messaging.message')),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messaging.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Conversation Participant State',
+                'verbose_name_plural': 'Conversation Participant States',
+                'indexes': [models.Index(fields=['user', '-last_activity'], name='participant_inbox_idx')],
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'user'), name='unique_conversation_participant_state')],
+            },
+        ),
+        migrations.RunPython(backfill_participant_states, migrations.RunPython.noop),
+    ]
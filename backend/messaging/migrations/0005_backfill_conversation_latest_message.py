@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:00
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_latest_message(apps, schema_editor):
+    """Point every conversation at its most recent message"""
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Message = apps.get_model('messaging', 'Message')
+
+    Conversation.objects.filter(latest_message__isnull=True).update(
+        latest_message=Subquery(
+            Message.objects.filter(
+                conversation_id=OuterRef('pk')
+            ).order_by('-created_at').values('id')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_conversation_participant_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_latest_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:06
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0006_message_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('chunk_size', models.PositiveIntegerField()),
+                ('received_chunks', django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), blank=True, default=list, size=None)),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed'), ('expired', 'Expired')], db_index=True, default='uploading', max_length=20)),
+                ('content_type', models.CharField(blank=True, help_text="Detected from the file's magic bytes, not the client", max_length=50)),
+                ('file', models.FileField(blank=True, upload_to='message_attachments/%Y/%m/')),
+                ('thumbnail', models.ImageField(blank=True, upload_to='message_attachments/thumbnails/%Y/%m/')),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachment_uploads', to='messaging.conversation')),
+                ('uploader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachment_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Attachment Upload',
+                'verbose_name_plural': 'Attachment Uploads',
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='upload',
+            field=models.OneToOneField(blank=True, help_text='Chunked upload this attachment came from', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='message', to='messaging.attachmentupload'),
+        ),
+        migrations.AddIndex(
+            model_name='attachmentupload',
+            index=models.Index(fields=['status', 'updated_at'], name='messaging_a_status_262fd2_idx'),
+        ),
+    ]
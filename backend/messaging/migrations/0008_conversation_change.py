@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0007_attachment_upload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('message_created', 'Message Created'), ('message_updated', 'Message Updated'), ('message_deleted', 'Message Deleted'), ('messages_read', 'Messages Read'), ('conversation_updated', 'Conversation Updated')], max_length=30)),
+                ('message_id', models.BigIntegerField(blank=True, null=True)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='messaging.conversation')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Conversation Change',
+                'verbose_name_plural': 'Conversation Changes',
+                'indexes': [models.Index(fields=['user', 'id'], name='change_log_user_idx')],
+            },
+        ),
+    ]
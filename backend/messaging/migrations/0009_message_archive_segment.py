@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0008_conversation_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('message_count', models.PositiveIntegerField()),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('first_message_id', models.BigIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('last_created_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='messaging.conversation')),
+            ],
+            options={
+                'verbose_name': 'Message Archive Segment',
+                'verbose_name_plural': 'Message Archive Segments',
+                'indexes': [models.Index(fields=['conversation', 'first_created_at', 'first_message_id'], name='archive_segment_range_idx')],
+            },
+        ),
+    ]
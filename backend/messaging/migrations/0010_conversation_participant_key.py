@@ -0,0 +1,63 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:20
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_participant_key(apps, schema_editor):
+    """Key existing two-party conversations; the most recent one wins a shared key"""
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Participant = Conversation.participants.through
+
+    two_party = Conversation.objects.annotate(
+        participant_count=Count('participants')
+    ).filter(participant_count=2)
+
+    # One pass over the participants of every two-party conversation
+    participants = defaultdict(list)
+    rows = Participant.objects.filter(
+        conversation_id__in=two_party.values('id')
+    ).values_list('conversation_id', 'user_id')
+    for conversation_id, user_id in rows.iterator(chunk_size=5000):
+        participants[conversation_id].append(user_id)
+
+    assigned = set()
+    batch = []
+    conversations = two_party.order_by('-updated_at', '-id').only('id', 'property_id', 'conversation_type')
+    for conversation in conversations.iterator(chunk_size=1000):
+        user_ids = sorted(participants[conversation.id])
+        key = f"{user_ids[0]}-{user_ids[1]}:{conversation.property_id or 0}:{conversation.conversation_type}"
+        if key in assigned:
+            continue
+        assigned.add(key)
+        conversation.participant_key = key
+        batch.append(conversation)
+        if len(batch) >= 1000:
+            Conversation.objects.bulk_update(batch, ['participant_key'])
+            batch = []
+    Conversation.objects.bulk_update(batch, ['participant_key'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0009_message_archive_segment'),
+        ('properties', '0001_initial'),
+        ('subleases', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='participant_key',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.RunPython(backfill_participant_key, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='conversation',
+            constraint=models.UniqueConstraint(fields=('participant_key',), name='unique_conversation_participant_key'),
+        ),
+    ]
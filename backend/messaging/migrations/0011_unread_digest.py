@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_initial'),
+        ('messaging', '0010_conversation_participant_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Digest Watermark',
+                'verbose_name_plural': 'Digest Watermarks',
+            },
+        ),
+        migrations.CreateModel(
+            name='UnreadDigestState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_digest_state', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('last_sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Unread Digest State',
+                'verbose_name_plural': 'Unread Digest States',
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:25
+
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+
+BATCH_SIZE = 500  # conversations per transaction
+
+
+def backfill_sequence(apps, schema_editor):
+    """Number existing messages per conversation in (created_at, id) order"""
+    Conversation = apps.get_model('messaging', 'Conversation')
+    Message = apps.get_model('messaging', 'Message')
+    messages = Message._meta.db_table
+    conversations = Conversation._meta.db_table
+
+    # One batch of conversations per transaction keeps locks and WAL short
+    conversation_ids = Conversation.objects.order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        batch = list(conversation_ids.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        first_id, last_id = batch[0], batch[-1]
+        with transaction.atomic(using=schema_editor.connection.alias):
+            schema_editor.execute(
+                f"""
+                UPDATE {messages} m SET sequence = numbered.sequence
+                FROM (
+                    SELECT id, created_at, ROW_NUMBER() OVER (
+                        PARTITION BY conversation_id ORDER BY created_at, id
+                    ) AS sequence
+                    FROM {messages}
+                    WHERE conversation_id BETWEEN %s AND %s
+                ) numbered
+                WHERE m.id = numbered.id AND m.created_at = numbered.created_at
+                """,
+                [first_id, last_id]
+            )
+            schema_editor.execute(
+                f"""
+                UPDATE {conversations} c SET last_sequence = numbered.last_sequence
+                FROM (
+                    SELECT conversation_id, MAX(sequence) AS last_sequence
+                    FROM {messages}
+                    WHERE conversation_id BETWEEN %s AND %s
+                    GROUP BY conversation_id
+                ) numbered
+                WHERE c.id = numbered.conversation_id
+                """,
+                [first_id, last_id]
+            )
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits one batch of conversations at a time
+    atomic = False
+
+    dependencies = [
+        ('messaging', '0011_unread_digest'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_sequence',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='sequence',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_sequence, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('conversation', 'sequence', 'created_at'), name='unique_message_conversation_sequence'),
+        ),
+    ]
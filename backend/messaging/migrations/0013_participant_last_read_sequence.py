@@ -0,0 +1,32 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:27
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_last_read_sequence(apps, schema_editor):
+    """Start read pointers at the sequence of the last read message"""
+    ConversationParticipantState = apps.get_model('messaging', 'ConversationParticipantState')
+    Message = apps.get_model('messaging', 'Message')
+
+    ConversationParticipantState.objects.filter(last_read_message__sequence__isnull=False).update(
+        last_read_sequence=Subquery(
+            Message.objects.filter(pk=OuterRef('last_read_message_id')).values('sequence')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0012_message_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipantstate',
+            name='last_read_sequence',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_last_read_sequence, migrations.RunPython.noop),
+    ]
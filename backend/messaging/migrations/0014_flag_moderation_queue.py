@@ -0,0 +1,59 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Value, When
+
+# ConversationFlag.REASON_PRIORITIES at the time of this migration
+REASON_PRIORITIES = {
+    'harassment': 3,
+    'scam': 3,
+    'payment_circumvention': 2,
+    'contact_info': 2,
+    'inappropriate': 2,
+    'spam': 1,
+    'other': 1,
+}
+
+
+def backfill_priority(apps, schema_editor):
+    """Prioritize existing flags by reason"""
+    ConversationFlag = apps.get_model('messaging', 'ConversationFlag')
+    ConversationFlag.objects.update(
+        priority=Case(
+            *[When(reason=reason, then=Value(priority)) for reason, priority in REASON_PRIORITIES.items()],
+            default=Value(0)
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0013_participant_last_read_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationflag',
+            name='assigned_to',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='conversation_flags_assigned', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='conversationflag',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationflag',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='conversationflag',
+            index=models.Index(fields=['status', '-priority', 'created_at', 'id'], name='flag_queue_idx'),
+        ),
+        migrations.RunPython(backfill_priority, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_client_keys(apps, schema_editor):
+    """Claim the temp_ids of messages already sent"""
+    Message = apps.get_model('messaging', 'Message')
+    MessageClientKey = apps.get_model('messaging', 'MessageClientKey')
+
+    schema_editor.execute(
+        f"""
+        INSERT INTO {MessageClientKey._meta.db_table}
+            (sender_id, conversation_id, client_temp_id, message_id, created_at)
+        SELECT sender_id, conversation_id, client_temp_id, id, created_at
+        FROM {Message._meta.db_table}
+        WHERE client_temp_id <> ''
+        """
+    )
+
+
+def mark_attached_uploads(apps, schema_editor):
+    """Uploads already used by a message can no longer be claimed"""
+    AttachmentUpload = apps.get_model('messaging', 'AttachmentUpload')
+    Message = apps.get_model('messaging', 'Message')
+
+    AttachmentUpload.objects.filter(
+        status='ready',
+        pk__in=Message.objects.filter(upload__isnull=False).values('upload_id')
+    ).update(status='attached')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0014_flag_moderation_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageClientKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_temp_id', models.CharField(max_length=64)),
+                ('message_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Message Client Key',
+                'verbose_name_plural': 'Message Client Keys',
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='message',
+            name='unique_message_client_temp_id',
+        ),
+        migrations.AddField(
+            model_name='messageclientkey',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='messaging.conversation'),
+        ),
+        migrations.AddField(
+            model_name='messageclientkey',
+            name='sender',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_client_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='messageclientkey',
+            constraint=models.UniqueConstraint(fields=('sender', 'conversation', 'client_temp_id'), name='unique_message_client_temp_id'),
+        ),
+        migrations.AlterField(
+            model_name='attachmentupload',
+            name='status',
+            field=models.CharField(choices=[('uploading', 'Uploading'), ('processing', 'Processing'), ('ready', 'Ready'), ('attached', 'Attached'), ('failed', 'Failed'), ('expired', 'Expired')], db_index=True, default='uploading', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='upload',
+            field=models.ForeignKey(blank=True, help_text='Chunked upload this attachment came from', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='messaging.attachmentupload'),
+        ),
+        migrations.RunPython(mark_attached_uploads, migrations.RunPython.noop),
+    ]
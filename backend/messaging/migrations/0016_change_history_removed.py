@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-19 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0015_partition_safe_unique_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversationchange',
+            name='kind',
+            field=models.CharField(choices=[('message_created', 'Message Created'), ('message_updated', 'Message Updated'), ('message_deleted', 'Message Deleted'), ('messages_read', 'Messages Read'), ('conversation_updated', 'Conversation Updated'), ('history_removed', 'History Removed')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.1 on 2026-10-19 08:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+KEYED = models.UniqueConstraint(
+    fields=('conversation', 'sequence', 'created_at'),
+    name='unique_message_conversation_sequence'
+)
+UNKEYED = models.UniqueConstraint(
+    fields=('conversation', 'sequence'),
+    name='unique_message_conversation_sequence'
+)
+
+
+def is_partitioned(schema_editor, table):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)",
+            [table]
+        )
+        return cursor.fetchone()[0]
+
+
+def swap_constraint(old, new):
+    def swap(apps, schema_editor):
+        """Partitioned tables keep created_at in the key (see partitions.py)"""
+        Message = apps.get_model('messaging', 'Message')
+        if is_partitioned(schema_editor, Message._meta.db_table):
+            return
+        schema_editor.remove_constraint(Message, old)
+        schema_editor.add_constraint(Message, new)
+    return swap
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0016_change_history_removed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(swap_constraint(KEYED, UNKEYED), swap_constraint(UNKEYED, KEYED)),
+            ],
+            state_operations=[
+                migrations.RemoveConstraint(
+                    model_name='message',
+                    name='unique_message_conversation_sequence',
+                ),
+                migrations.AddConstraint(
+                    model_name='message',
+                    constraint=UNKEYED,
+                ),
+            ],
+        ),
+    ]
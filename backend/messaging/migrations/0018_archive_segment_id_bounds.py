@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-19 08:03
+
+import gzip
+import json
+
+from django.core.files.storage import storages
+from django.db import migrations, models
+
+
+def backfill_id_bounds(apps, schema_editor):
+    """Read each segment's ids; unreadable segments stay unbounded"""
+    MessageArchiveSegment = apps.get_model('messaging', 'MessageArchiveSegment')
+    storage = storages['message_archive']
+
+    for segment in MessageArchiveSegment.objects.filter(min_message_id__isnull=True).iterator():
+        try:
+            with storage.open(segment.path, 'rb') as segment_file:
+                lines = gzip.decompress(segment_file.read()).decode().splitlines()
+        except (OSError, EOFError):
+            continue
+        ids = [json.loads(line)['pk'] for line in lines if line]
+        if ids:
+            MessageArchiveSegment.objects.filter(pk=segment.pk).update(
+                min_message_id=min(ids),
+                max_message_id=max(ids)
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0017_message_sequence_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagearchivesegment',
+            name='max_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='messagearchivesegment',
+            name='min_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_id_bounds, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
 # backend/messaging/models.py
+import uuid
 from django.utils import timezone
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from django.db.models import Q, functions
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from .managers import ConversationManager, MessageManager
 
 class Conversation(models.Model):
@@ -74,6 +78,18 @@ class Conversation(models.Model):
         help_text="Time taken for property owner to respond"
     )
     
+    # Normalized "<user ids>:<property>:<type>" of two-party conversations,
+    # so start_conversation finds an existing thread with one index probe
+    participant_key = models.CharField(
+        max_length=100,
+        null=True,
+        blank=True,
+        editable=False
+    )
+    
+    # Sequence number of the latest message, see Message.sequence
+    last_sequence = models.PositiveIntegerField(default=0, editable=False)
+    
     # Content moderation
     has_flagged_content = models.BooleanField(default=False)
     flagged_at = models.DateTimeField(null=True, blank=True)
@@ -114,6 +130,10 @@ class Conversation(models.Model):
                 fields=['property'],
                 condition=Q(property__isnull=False, status='active'),
                 name='unique_active_property_conversation'
+            ),
+            models.UniqueConstraint(
+                fields=['participant_key'],
+                name='unique_conversation_participant_key'
             )
         ]
     
@@ -122,17 +142,25 @@ class Conversation(models.Model):
             return f"Conversation about {self.property.title} (#{self.id})"
         return f"Conversation #{self.id}"
     
+    @staticmethod
+    def build_participant_key(user_ids, property_id=None, conversation_type='general'):
+        """Key identifying a two-party conversation regardless of who started it"""
+        users = '-'.join(str(user_id) for user_id in sorted(user_ids))
+        return f"{users}:{property_id or 0}:{conversation_type}"
+    
     def other_participant(self, user):
         """Get the other participant in a conversation"""
         return self.participants.exclude(id=user.id).first()
     
     def mark_messages_as_read(self, user):
         """Mark all messages in conversation as read for a user"""
-        self.messages.exclude(sender=user).update(read=True)
+        from .services.conversation_state import ConversationStateService
+        return ConversationStateService.mark_read(self.id, user)
     
     def get_unread_count(self, user):
         """Get number of unread messages for a user"""
-        return self.messages.exclude(sender=user).filter(read=False).count()
+        from .services.conversation_state import ConversationStateService
+        return ConversationStateService.get_unread_count(self.id, user)
 
 
 class Message(models.Model):
@@ -184,6 +212,15 @@ class Message(models.Model):
         blank=True
     )
     attachment_type = models.CharField(max_length=50, blank=True)
+    # One message per upload, enforced by AttachmentUploadService.claim
+    upload = models.ForeignKey(
+        'AttachmentUpload',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='messages',
+        help_text="Chunked upload this attachment came from"
+    )
     
     # Content filtering
     filtered_content = models.TextField(
@@ -222,6 +259,30 @@ class Message(models.Model):
     is_edited = models.BooleanField(default=False)
     edited_at = models.DateTimeField(null=True, blank=True)
 
+    # Idempotent sends (deduplicated through MessageClientKey)
+    client_temp_id = models.CharField(
+        max_length=64,
+        blank=True,
+        help_text="Client-generated temp_id used to deduplicate retried sends"
+    )
+
+    # Per-conversation position, so clients can detect and replay missed messages
+    sequence = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    # Full-text search (English and Spanish stems), maintained by Postgres
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('content', config='english')
+            + SearchVector('content', config='spanish')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True
+    )
+
+    # Delivery retry policy
+    MAX_DELIVERY_ATTEMPTS = 3
+    DELIVERY_BACKOFF_SECONDS = 60
+
     # Add custom manager
     objects = MessageManager()
     
@@ -240,18 +301,60 @@ class Message(models.Model):
                 name='unread_messages_idx'
             ),  # Partial index for unread
             models.Index(fields=['created_at']),  # For time-based queries
+            models.Index(
+                fields=['id'],
+                condition=Q(delivered=False, delivery_status='pending', is_deleted=False),
+                name='pending_delivery_idx'
+            ),  # Partial index for the delivery scheduler
+            GinIndex(fields=['search_vector'], name='message_search_idx'),  # Full-text search
+        ]
+        constraints = [
+            # Partitioning extends this with created_at (see partitions.py)
+            models.UniqueConstraint(
+                fields=['conversation', 'sequence'],
+                name='unique_message_conversation_sequence'
+            )
         ]
     
     def __str__(self):
         return f"Message from {self.sender.username} in {self.conversation}"
     
     def save(self, *args, **kwargs):
-        # Update conversation timestamp when new message is added
-        if not self.pk:  # New message
-            self.conversation.updated_at = models.functions.Now()
-            self.conversation.save(update_fields=['updated_at'])
-        super().save(*args, **kwargs)
+        from .services.conversation_state import ConversationStateService
+        
+        is_new = not self.pk
+        with transaction.atomic():
+            if is_new and self.sequence is None:
+                self.sequence = self._next_sequence()
+            super().save(*args, **kwargs)
+            
+            if is_new:
+                # Update conversation timestamp and latest message cache
+                self.conversation.updated_at = models.functions.Now()
+                self.conversation.latest_message = self
+                self.conversation.save(update_fields=['updated_at', 'latest_message'])
+                
+                # Keep participant counters in the same transaction as the insert
+                ConversationStateService.record_message(self)
 
+    def _next_sequence(self):
+        """
+        Claim the conversation's next sequence number.
+        
+        The increment row-locks the conversation until commit (the
+        latest_message update below takes the same lock), so concurrent
+        senders get consecutive numbers in commit order.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Conversation._meta.db_table} SET last_sequence = last_sequence + 1 "
+                f"WHERE id = %s RETURNING last_sequence",
+                [self.conversation_id]
+            )
+            sequence = cursor.fetchone()[0]
+        self.conversation.last_sequence = sequence
+        return sequence
+    
     def mark_as_delivered(self):
         """Mark message as delivered"""
         if not self.delivered:
@@ -269,22 +372,33 @@ class Message(models.Model):
                 self.delivered_at = timezone.now()
             self.save(update_fields=['read', 'read_at', 'delivered', 'delivered_at'])
 
+    @classmethod
+    def next_delivery_attempt_at(cls, delivery_attempts, last_delivery_attempt):
+        """Earliest time the next delivery attempt is allowed (exponential backoff)"""
+        if not last_delivery_attempt:
+            return None
+        from datetime import timedelta
+        wait_time = timedelta(
+            seconds=cls.DELIVERY_BACKOFF_SECONDS * (2 ** delivery_attempts)
+        )
+        return last_delivery_attempt + wait_time
+
     def should_retry_delivery(self):
         """Check if message delivery should be retried"""
         if self.delivery_status in ['delivered', 'expired']:
             return False
         
-        if self.delivery_attempts >= 3:  # Max 3 attempts
+        if self.delivery_attempts >= self.MAX_DELIVERY_ATTEMPTS:
             self.delivery_status = 'failed'
             self.save(update_fields=['delivery_status'])
             return False
         
         # Exponential backoff
-        if self.last_delivery_attempt:
-            from datetime import timedelta
-            wait_time = timedelta(seconds=60 * (2 ** self.delivery_attempts))
-            if timezone.now() < self.last_delivery_attempt + wait_time:
-                return False
+        next_attempt = self.next_delivery_attempt_at(
+            self.delivery_attempts, self.last_delivery_attempt
+        )
+        if next_attempt and timezone.now() < next_attempt:
+            return False
         
         return True
     
@@ -295,6 +409,45 @@ class Message(models.Model):
         self.save(update_fields=['delivery_attempts', 'last_delivery_attempt'])
 
 
+class MessageClientKey(models.Model):
+    """
+    Claimed client temp_ids of sent messages.
+    
+    A retried send with the same temp_id fails the unique constraint and
+    gets the original message back. The key lives outside the messages
+    table because a unique index on the partitioned table would have to
+    include created_at, which differs between retries.
+    """
+    
+    sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    client_temp_id = models.CharField(max_length=64)
+    # Plain id, since messages cannot be a foreign key target once partitioned
+    message_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Message Client Key')
+        verbose_name_plural = _('Message Client Keys')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sender', 'conversation', 'client_temp_id'],
+                name='unique_message_client_temp_id'
+            )
+        ]
+    
+    def __str__(self):
+        return f"{self.client_temp_id} from {self.sender_id} in conversation #{self.conversation_id}"
+
+
 class MessageTemplate(models.Model):
     """Pre-defined message templates for common inquiries"""
     
@@ -388,6 +541,18 @@ class ConversationFlag(models.Model):
         ('dismissed', _('Dismissed')),
     ]
     
+    # Review order, most urgent first
+    PRIORITY_CRITICAL = 4
+    REASON_PRIORITIES = {
+        'harassment': 3,
+        'scam': 3,
+        'payment_circumvention': 2,
+        'contact_info': 2,
+        'inappropriate': 2,
+        'spam': 1,
+        'other': 1,
+    }
+    
     # Core relationships
     conversation = models.ForeignKey(
         Conversation, 
@@ -428,6 +593,17 @@ class ConversationFlag(models.Model):
     reviewed_at = models.DateTimeField(null=True, blank=True)
     review_notes = models.TextField(blank=True)
     action_taken = models.TextField(blank=True)
+    priority = models.PositiveSmallIntegerField(default=0)
+    
+    # Moderation queue lease
+    assigned_to = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='conversation_flags_assigned'
+    )
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -438,6 +614,10 @@ class ConversationFlag(models.Model):
         verbose_name = _('Conversation Flag')
         verbose_name_plural = _('Conversation Flags')
         indexes = [
+            models.Index(
+                fields=['status', '-priority', 'created_at', 'id'],
+                name='flag_queue_idx'
+            ),  # Moderation queue order
             models.Index(fields=['status', '-created_at']),
             models.Index(fields=['conversation', 'status']),
             models.Index(fields=['flagged_by', '-created_at']),
@@ -450,3 +630,285 @@ class ConversationFlag(models.Model):
         
     def __str__(self):
         return f"Flag: {self.get_reason_display()} - {self.conversation}"
+    
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.priority:
+            self.priority = self.REASON_PRIORITIES.get(self.reason, 0)
+        super().save(*args, **kwargs)
+
+
+class ConversationParticipantState(models.Model):
+    """
+    Per-participant conversation state, denormalized for inbox queries.
+    
+    Maintained by ConversationStateService whenever messages are created
+    or read, so listing a user's conversations never has to scan messages.
+    """
+    
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='participant_states'
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='conversation_states'
+    )
+    
+    # Counters
+    unread_count = models.PositiveIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    
+    # Pointers
+    last_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    last_read_message = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    # Sequence of the newest message read; read receipts compare against it
+    last_read_sequence = models.PositiveIntegerField(default=0)
+    last_activity = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = _('Conversation Participant State')
+        verbose_name_plural = _('Conversation Participant States')
+        indexes = [
+            models.Index(fields=['user', '-last_activity'], name='participant_inbox_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['conversation', 'user'],
+                name='unique_conversation_participant_state'
+            )
+        ]
+    
+    def __str__(self):
+        return f"State of {self.user_id} in conversation #{self.conversation_id}"
+
+
+class AttachmentUpload(models.Model):
+    """
+    Chunked upload session for a message attachment.
+    
+    Chunks are written to storage one request at a time; once completed
+    the upload is verified, assembled and thumbnailed by the
+    process_attachments command, after which a message can reference it.
+    """
+    
+    STATUS_CHOICES = [
+        ('uploading', _('Uploading')),
+        ('processing', _('Processing')),
+        ('ready', _('Ready')),
+        ('attached', _('Attached')),
+        ('failed', _('Failed')),
+        ('expired', _('Expired')),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='attachment_uploads'
+    )
+    uploader = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='attachment_uploads'
+    )
+    
+    # Declared by the client when the session starts
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    received_chunks = ArrayField(models.PositiveIntegerField(), default=list, blank=True)
+    
+    # Filled in by processing
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='uploading',
+        db_index=True
+    )
+    content_type = models.CharField(
+        max_length=50,
+        blank=True,
+        help_text="Detected from the file's magic bytes, not the client"
+    )
+    file = models.FileField(upload_to='message_attachments/%Y/%m/', blank=True)
+    thumbnail = models.ImageField(upload_to='message_attachments/thumbnails/%Y/%m/', blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = _('Attachment Upload')
+        verbose_name_plural = _('Attachment Uploads')
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+    
+    def __str__(self):
+        return f"Upload {self.id} ({self.status})"
+    
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+    
+    def expected_chunk_size(self, index):
+        """Every chunk is chunk_size bytes except the last"""
+        if index < self.chunk_count - 1:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.chunk_count - 1)
+    
+    def chunk_name(self, index):
+        return f'message_uploads/{self.id}/{index:05d}.part'
+    
+    @property
+    def is_complete(self):
+        return len(set(self.received_chunks)) == self.chunk_count
+
+
+class ConversationChange(models.Model):
+    """
+    Per-user change log for delta sync.
+    
+    One row per affected participant, so a reconnecting client reads its
+    changes with a single range scan on (user, id) no matter how many
+    conversations it has. Written by ChangeLogService.
+    """
+    
+    CHANGE_KINDS = [
+        ('message_created', _('Message Created')),
+        ('message_updated', _('Message Updated')),
+        ('message_deleted', _('Message Deleted')),
+        ('messages_read', _('Messages Read')),
+        ('conversation_updated', _('Conversation Updated')),
+        ('history_removed', _('History Removed')),
+    ]
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='changes'
+    )
+    kind = models.CharField(max_length=30, choices=CHANGE_KINDS)
+    # Plain id so the entry outlives a hard-deleted message
+    message_id = models.BigIntegerField(null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        verbose_name = _('Conversation Change')
+        verbose_name_plural = _('Conversation Changes')
+        indexes = [
+            models.Index(fields=['user', 'id'], name='change_log_user_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.kind} in conversation #{self.conversation_id} for {self.user_id}"
+
+
+class MessageArchiveSegment(models.Model):
+    """
+    Index entry for a file of archived messages.
+    
+    Messages of archived conversations are moved out of the messages
+    table into gzipped JSONL segment files on the message_archive
+    storage (see messaging.archive). Each segment covers a contiguous
+    (created_at, id) range of one conversation, so history reads only
+    fetch the segments overlapping the requested page; lookups by id use
+    the separate min/max id bounds.
+    """
+    
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='archive_segments'
+    )
+    path = models.CharField(max_length=255)
+    message_count = models.PositiveIntegerField()
+    size_bytes = models.PositiveIntegerField(default=0)
+    
+    # Range covered, ordered by (created_at, id)
+    first_message_id = models.BigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_message_id = models.BigIntegerField()
+    last_created_at = models.DateTimeField()
+    
+    # Ids do not follow created_at, so lookups by id use the id bounds
+    min_message_id = models.BigIntegerField(null=True, blank=True)
+    max_message_id = models.BigIntegerField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Message Archive Segment')
+        verbose_name_plural = _('Message Archive Segments')
+        indexes = [
+            models.Index(
+                fields=['conversation', 'first_created_at', 'first_message_id'],
+                name='archive_segment_range_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.message_count} archived messages of conversation #{self.conversation_id}"
+
+
+class DigestWatermark(models.Model):
+    """
+    How far a notification pipeline has scanned the messages table.
+    
+    Every message up to ``last_message_id`` has been handled, so each
+    run only looks at newer unread messages.
+    """
+    
+    name = models.CharField(max_length=50, unique=True)
+    last_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = _('Digest Watermark')
+        verbose_name_plural = _('Digest Watermarks')
+    
+    def __str__(self):
+        return f"{self.name} at message #{self.last_message_id}"
+
+
+class UnreadDigestState(models.Model):
+    """Per-recipient progress of the unread-message email digest"""
+    
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='unread_digest_state'
+    )
+    # Newest message included in a digest sent to this user
+    last_message_id = models.BigIntegerField(default=0)
+    last_sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        verbose_name = _('Unread Digest State')
+        verbose_name_plural = _('Unread Digest States')
+    
+    def __str__(self):
+        return f"Digest state for {self.user_id}"
@@ -0,0 +1,147 @@
+# backend/messaging/moderation.py
+import logging
+from datetime import timedelta
+from typing import Iterable, List
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Q
+from django.utils import timezone
+
+from .models import Conversation, ConversationFlag
+
+logger = logging.getLogger('messaging.moderation')
+
+
+class ModerationQueue:
+    """
+    Review queue over ConversationFlag.
+
+    Open flags are served most urgent first - priority descending, then
+    oldest first - which is the order of flag_queue_idx. Moderators claim
+    a batch of flags, leasing them for LEASE_SECONDS; claims skip rows
+    another moderator is claiming, so concurrent pulls never hand out
+    the same flag. Flags whose lease runs out go back to the queue.
+    """
+
+    LEASE_SECONDS = 600  # 10 minutes
+    MAX_CLAIM = 50
+    OPEN_STATUSES = ('pending', 'reviewing')
+    CLOSED_STATUSES = ('resolved', 'dismissed')
+
+    @staticmethod
+    def ordered(queryset):
+        return queryset.order_by('-priority', 'created_at', 'id')
+
+    @classmethod
+    def with_context(cls, queryset):
+        """Preload what a moderator needs to judge a flag"""
+        return queryset.select_related(
+            'flagged_by__university',
+            'assigned_to__university',
+            'message',
+            'conversation__property',
+            'conversation__latest_message',
+        ).prefetch_related(
+            Prefetch(
+                'conversation__participants',
+                queryset=get_user_model().objects.select_related('university')
+            )
+        )
+
+    @classmethod
+    def claimable(cls, now=None):
+        """Pending flags and flags whose lease has expired"""
+        now = now or timezone.now()
+        return ConversationFlag.objects.filter(
+            Q(status='pending') | Q(status='reviewing', lease_expires_at__lt=now)
+        )
+
+    @classmethod
+    def claim(cls, moderator, limit: int = 10) -> List[ConversationFlag]:
+        """Lease the next ``limit`` flags to a moderator"""
+        limit = max(1, min(limit, cls.MAX_CLAIM))
+        now = timezone.now()
+        with transaction.atomic():
+            flag_ids = list(
+                cls.ordered(cls.claimable(now)).select_for_update(
+                    skip_locked=True
+                ).values_list('id', flat=True)[:limit]
+            )
+            ConversationFlag.objects.filter(id__in=flag_ids).update(
+                status='reviewing',
+                assigned_to=moderator,
+                lease_expires_at=now + timedelta(seconds=cls.LEASE_SECONDS),
+                updated_at=now
+            )
+
+        if flag_ids:
+            logger.info(f"Moderator {moderator.id} claimed {len(flag_ids)} flags")
+        return list(cls.ordered(cls.with_context(ConversationFlag.objects.filter(id__in=flag_ids))))
+
+    @classmethod
+    def release(cls, moderator, flag_ids: Iterable[int]) -> int:
+        """Hand a moderator's leased flags back to the queue"""
+        return ConversationFlag.objects.filter(
+            id__in=list(flag_ids),
+            status='reviewing',
+            assigned_to=moderator
+        ).update(
+            status='pending',
+            assigned_to=None,
+            lease_expires_at=None,
+            updated_at=timezone.now()
+        )
+
+    @classmethod
+    def resolve(cls, moderator, flag_ids: Iterable[int], status: str,
+                review_notes: str = '', action_taken: str = '') -> int:
+        """
+        Close open flags in one UPDATE; returns how many were closed.
+
+        Flags leased to another moderator are left alone. Conversations
+        without open flags afterwards stop counting as flagged.
+        """
+        if status not in cls.CLOSED_STATUSES:
+            raise ValueError(f'Cannot resolve flags as {status!r}')
+
+        flag_ids = list(flag_ids)
+        now = timezone.now()
+        with transaction.atomic():
+            updated = ConversationFlag.objects.filter(
+                id__in=flag_ids,
+                status__in=cls.OPEN_STATUSES
+            ).filter(
+                Q(assigned_to__isnull=True) | Q(assigned_to=moderator) | Q(lease_expires_at__lt=now)
+            ).update(
+                status=status,
+                reviewed_by=moderator,
+                reviewed_at=now,
+                review_notes=review_notes,
+                action_taken=action_taken,
+                assigned_to=None,
+                lease_expires_at=None,
+                updated_at=now
+            )
+            if updated:
+                cls._clear_resolved_conversations(flag_ids)
+
+        logger.info(f"Moderator {moderator.id} marked {updated} flags {status}")
+        return updated
+
+    @staticmethod
+    def _clear_resolved_conversations(flag_ids: List[int]):
+        Conversation.objects.filter(
+            id__in=ConversationFlag.objects.filter(id__in=flag_ids).values('conversation_id'),
+            has_flagged_content=True
+        ).exclude(
+            Exists(ConversationFlag.objects.filter(
+                conversation_id=OuterRef('pk'),
+                status__in=ModerationQueue.OPEN_STATUSES
+            ))
+        ).update(has_flagged_content=False, flagged_at=None)
+
+    @classmethod
+    def queue(cls, status: str = 'pending'):
+        """Flags of one status in review order, with their context preloaded"""
+        return cls.ordered(cls.with_context(ConversationFlag.objects.filter(status=status)))
@@ -38,7 +38,26 @@ class WebSocketMonitor:
             metrics['disconnections'] += 1
             
         cache.set(cache_key, metrics, 86400)  # 24 hours
+
+    # Daily counters kept under their own keys so updates are a single INCR
+    COUNTERS = ('channel_full', 'slow_consumer_disconnects')
+    
+    @staticmethod
+    def _counter_key(name: str, date) -> str:
+        return f'ws_metrics:{date.strftime("%Y%m%d")}:{name}'
     
+    @classmethod
+    def increment_metric(cls, name: str, amount: int = 1):
+        """Atomically increment a daily counter (e.g. channel overflows)"""
+        cache_key = cls._counter_key(name, timezone.now())
+        if cache.add(cache_key, amount, 86400):  # 24 hours
+            return
+        try:
+            cache.incr(cache_key, amount)
+        except ValueError:
+            # Expired between the add and the incr
+            cache.set(cache_key, amount, 86400)
+
     @staticmethod
     def log_message(user_id: int, conversation_id: int, message_type: str, success: bool):
         """Log message events"""
@@ -56,14 +75,33 @@ class WebSocketMonitor:
         # This would integrate with your WebSocket consumer to track active connections
         return cache.get('active_websocket_connections', 0)
     
-    @staticmethod
-    def get_metrics(date=None):
+    @classmethod
+    def get_metrics(cls, date=None):
         """Get WebSocket metrics for a specific date"""
         if not date:
             date = timezone.now()
         
         cache_key = f'ws_metrics:{date.strftime("%Y%m%d")}'
-        return cache.get(cache_key, {})
+        metrics = cache.get(cache_key, {})
+        counters = cache.get_many([cls._counter_key(name, date) for name in cls.COUNTERS])
+        for name in cls.COUNTERS:
+            metrics[name] = counters.get(cls._counter_key(name, date), 0)
+        return metrics
+
+    @staticmethod
+    def set_gauge(name: str, value):
+        """Record the latest value of a point-in-time metric (e.g. backlog size)"""
+        gauges = cache.get('ws_gauges', {})
+        gauges[name] = {
+            'value': value,
+            'updated_at': timezone.now().isoformat()
+        }
+        cache.set('ws_gauges', gauges, 86400)  # 24 hours
+
+    @staticmethod
+    def get_gauges():
+        """Get the latest values of all point-in-time metrics"""
+        return cache.get('ws_gauges', {})
 
 
 def monitor_websocket_performance(func):
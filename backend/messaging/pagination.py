@@ -1,20 +1,165 @@
 # backend/messaging/pagination.py
-from rest_framework.pagination import CursorPagination
+import base64
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
-class MessageCursorPagination(CursorPagination):
+class MessageCursorPagination(BasePagination):
     """
-    Cursor-based pagination for messages.
-    Provides stable pagination even with real-time updates.
+    Keyset pagination for messages over (created_at, id).
+
+    Pages are newest first. The cursor holds the position of the edge
+    row, so ties on created_at can never skip or repeat messages, and
+    every page is a range scan on the (conversation, created_at) index.
+
+    ``?around=<message_id>`` returns the message with up to page_size
+    messages on either side, e.g. to open a conversation at a search hit
+    or the first unread message; next/previous continue from there.
+
+    Views that return an ArchivedHistory from ``get_archived_history``
+    have archived messages merged into the pages by position.
     """
     page_size = 50
     page_size_query_param = 'page_size'
     max_page_size = 100
-    ordering = '-created_at'  # Newest first
     cursor_query_param = 'cursor'
-    template = None
-    
+    around_query_param = 'around'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = remove_query_param(
+            request.build_absolute_uri(), self.around_query_param
+        )
+        page_size = self.get_page_size(request)
+        get_archive = getattr(view, 'get_archived_history', None)
+        self.archive = get_archive() if get_archive else None
+
+        around = request.query_params.get(self.around_query_param)
+        if around:
+            return self._paginate_around(queryset, around, page_size)
+
+        cursor = self.decode_cursor(request)
+        position = (cursor['created_at'], cursor['id']) if cursor else None
+        if cursor is None or not cursor['reverse']:
+            # Older messages, newest first
+            rows = self.messages_before(queryset, position, page_size + 1, self.archive)
+            self.has_next = len(rows) > page_size
+            self.page = rows[:page_size]
+            self.has_previous = cursor is not None
+        else:
+            # Newer messages, fetched oldest first and flipped
+            rows = self.messages_after(queryset, position, page_size + 1, self.archive)
+            self.has_previous = len(rows) > page_size
+            self.page = list(reversed(rows[:page_size]))
+            self.has_next = True
+
+        return self.page
+
+    def _paginate_around(self, queryset, message_id, page_size):
+        try:
+            target = queryset.get(pk=message_id)
+        except (queryset.model.DoesNotExist, ValueError, TypeError):
+            target = None
+            if self.archive is not None and str(message_id).isdigit():
+                target = self.archive.get(int(message_id))
+            if target is None:
+                raise NotFound('Message not found')
+
+        position = (target.created_at, target.id)
+        before = self.messages_before(queryset, position, page_size + 1, self.archive)
+        after = self.messages_after(queryset, position, page_size + 1, self.archive)
+
+        self.has_next = len(before) > page_size
+        self.has_previous = len(after) > page_size
+        self.page = list(reversed(after[:page_size])) + [target] + before[:page_size]
+        return self.page
+
+    @classmethod
+    def messages_before(cls, queryset, position, limit, archive=None):
+        """Up to ``limit`` messages before ``position`` (or the newest), newest first"""
+        if position is not None:
+            queryset = queryset.filter(cls._before(*position))
+        rows = list(queryset.order_by('-created_at', '-id')[:limit])
+        if archive is not None:
+            rows = sorted(rows + archive.before(position, limit), key=cls._position, reverse=True)
+        return rows[:limit]
+
+    @classmethod
+    def messages_after(cls, queryset, position, limit, archive=None):
+        """Up to ``limit`` messages after ``position``, oldest first"""
+        rows = list(queryset.filter(cls._after(*position)).order_by('created_at', 'id')[:limit])
+        if archive is not None:
+            rows = sorted(rows + archive.after(position, limit), key=cls._position)
+        return rows[:limit]
+
+    @staticmethod
+    def _position(message):
+        return (message.created_at, message.id)
+
+    @staticmethod
+    def _before(created_at, message_id):
+        # (created_at, id) < position, written to keep the created_at range scan
+        return Q(created_at__lte=created_at) & (
+            Q(created_at__lt=created_at) | Q(id__lt=message_id)
+        )
+
+    @staticmethod
+    def _after(created_at, message_id):
+        return Q(created_at__gte=created_at) & (
+            Q(created_at__gt=created_at) | Q(id__gt=message_id)
+        )
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    # Cursors
+
+    def encode_cursor(self, message, reverse):
+        payload = json.dumps({
+            'c': message.created_at.isoformat(),
+            'i': message.id,
+            'r': 1 if reverse else 0,
+        })
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            created_at = parse_datetime(payload['c'])
+            if created_at is None:
+                raise ValueError(payload['c'])
+            return {
+                'created_at': created_at,
+                'id': int(payload['i']),
+                'reverse': bool(payload.get('r')),
+            }
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
     def get_paginated_response(self, data):
         return Response({
             'next': self.get_next_link(),
@@ -25,3 +170,80 @@ class MessageCursorPagination(CursorPagination):
         })
 
 
+class ModerationQueuePagination(BasePagination):
+    """
+    Keyset pagination for the moderation queue.
+
+    Follows the queue order (-priority, created_at, id), so every page is
+    a range scan on flag_queue_idx no matter how deep the backlog is.
+    Pages only move forward; moderators work from the front of the queue.
+    """
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self._after(**cursor))
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    @staticmethod
+    def _after(priority, created_at, flag_id):
+        # (-priority, created_at, id) > position
+        return Q(priority__lt=priority) | (Q(priority=priority) & (
+            Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=flag_id)
+        ))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def encode_cursor(self, flag):
+        payload = json.dumps({
+            'p': flag.priority,
+            'c': flag.created_at.isoformat(),
+            'i': flag.id,
+        })
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            created_at = parse_datetime(payload['c'])
+            if created_at is None:
+                raise ValueError(payload['c'])
+            return {
+                'priority': int(payload['p']),
+                'created_at': created_at,
+                'flag_id': int(payload['i']),
+            }
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+            'has_next': self.has_next,
+        })
@@ -0,0 +1,352 @@
+# backend/messaging/partitions.py
+import re
+import logging
+from datetime import date, datetime, time, timezone as dt_timezone
+from typing import Dict, List, Set, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import (
+    Conversation, ConversationFlag, ConversationParticipantState, Message, MessageClientKey
+)
+
+logger = logging.getLogger('messaging.partitions')
+
+
+class MessagePartitionError(Exception):
+    """Raised when a partition operation is not possible"""
+
+
+class MessagePartitionManager:
+    """
+    Monthly range partitions of the messages table on created_at.
+
+    Once the table is partitioned (see ``convert``), retention is a
+    matter of detaching or dropping whole months instead of deleting
+    rows, and create_message_partitions keeps the coming months ready
+    for inserts. Partitions are named ``<table>_pYYYYMM``.
+
+    Postgres cannot enforce a unique index or a foreign key target on a
+    partitioned table without the partition key, so:
+
+    - retried sends are deduplicated in MessageClientKey. Constraints in
+      PARTITION_KEYED_CONSTRAINTS are recreated with created_at added,
+      which still holds since each value is allocated once; ``convert``
+      refuses to run while any other unique index without created_at
+      exists.
+    - message ids stay unique through their identity sequence; the
+      primary key becomes (id, created_at).
+    - foreign keys into messages (INBOUND_POINTERS) cannot be kept.
+      ``convert`` only drops them when told to, after which the pointers
+      are checked by the application and dangling ones are cleared when
+      a partition is removed.
+    """
+
+    TABLE = Message._meta.db_table
+    NAME_PATTERN = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+
+    INBOUND_POINTERS = [
+        (Conversation, 'latest_message'),
+        (ConversationParticipantState, 'last_message'),
+        (ConversationParticipantState, 'last_read_message'),
+        (ConversationFlag, 'message'),
+    ]
+
+    PARTITION_KEYED_CONSTRAINTS = ['unique_message_conversation_sequence']
+
+    # Months
+
+    @staticmethod
+    def month_start(value) -> date:
+        return date(value.year, value.month, 1)
+
+    @staticmethod
+    def add_months(month: date, count: int) -> date:
+        index = month.year * 12 + month.month - 1 + count
+        return date(index // 12, index % 12 + 1, 1)
+
+    @classmethod
+    def bound(cls, month: date) -> datetime:
+        return datetime.combine(month, time.min, tzinfo=dt_timezone.utc)
+
+    @classmethod
+    def partition_name(cls, month: date) -> str:
+        return f'{cls.TABLE}_p{month:%Y%m}'
+
+    # Introspection
+
+    def is_partitioned(self) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)",
+                [self.TABLE]
+            )
+            return cursor.fetchone()[0]
+
+    def partitions(self) -> Dict[date, str]:
+        """Attached monthly partitions by month"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT child.relname
+                FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = %s::regclass
+                """,
+                [self.TABLE]
+            )
+            names = [row[0] for row in cursor.fetchall()]
+
+        partitions = {}
+        for name in names:
+            match = self.NAME_PATTERN.match(name)
+            if match:
+                partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+        return dict(sorted(partitions.items()))
+
+    # Maintenance
+
+    def ensure_partitions(self, months_ahead: int = 3) -> List[str]:
+        """Create partitions from the current month through ``months_ahead``"""
+        if not self.is_partitioned():
+            raise MessagePartitionError(f'{self.TABLE} is not partitioned')
+
+        existing = self.partitions()
+        current = self.month_start(timezone.now())
+        created = []
+        for offset in range(months_ahead + 1):
+            month = self.add_months(current, offset)
+            if month not in existing:
+                self._create_partition(month)
+                created.append(self.partition_name(month))
+        return created
+
+    def expired_partitions(self, cutoff: datetime) -> Dict[date, str]:
+        """Partitions whose whole month is older than ``cutoff``"""
+        return {
+            month: name
+            for month, name in self.partitions().items()
+            if self.bound(self.add_months(month, 1)) <= cutoff
+        }
+
+    def has_flagged_messages(self, name: str) -> bool:
+        """Whether a partition holds messages of flagged conversations"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT EXISTS (
+                    SELECT 1 FROM {connection.ops.quote_name(name)} m
+                    JOIN {Conversation._meta.db_table} c ON c.id = m.conversation_id
+                    WHERE c.has_flagged_content OR c.status = 'flagged'
+                )
+                """
+            )
+            return cursor.fetchone()[0]
+
+    def remove_partition(self, name: str, detach_only: bool = False) -> Set[int]:
+        """
+        Detach (and unless ``detach_only``, drop) one partition.
+
+        Returns the conversations that lost messages; pointers into the
+        removed rows are cleared and their inbox states recounted.
+        """
+        from .services.change_log import ChangeLogService
+        from .services.conversation_state import ConversationStateService
+
+        quoted = connection.ops.quote_name(name)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT DISTINCT conversation_id FROM {quoted}")
+                conversation_ids = {row[0] for row in cursor.fetchall()}
+
+                cursor.execute(f"ALTER TABLE {self.TABLE} DETACH PARTITION {quoted}")
+                if not detach_only:
+                    cursor.execute(f"DROP TABLE {quoted}")
+
+            self.clear_dangling_pointers(conversation_ids)
+            ConversationStateService.refresh(conversation_ids)
+            # Too many rows to log one by one; delta sync resets these participants
+            ChangeLogService.record_many(conversation_ids, 'history_removed')
+
+        logger.info(
+            f"{'Detached' if detach_only else 'Dropped'} message partition {name} "
+            f"({len(conversation_ids)} conversations affected)"
+        )
+        return conversation_ids
+
+    def clear_dangling_pointers(self, conversation_ids: Set[int]):
+        """Null out references to messages that no longer exist"""
+        if not conversation_ids:
+            return
+
+        for model, field in self.INBOUND_POINTERS:
+            lookup = 'id__in' if model is Conversation else 'conversation_id__in'
+            attname = model._meta.get_field(field).attname
+            model.objects.filter(
+                **{lookup: conversation_ids, f'{attname}__isnull': False}
+            ).exclude(
+                Exists(Message.objects.filter(pk=OuterRef(attname)))
+            ).update(**{attname: None})
+
+        # Temp ids of removed messages can no longer return them
+        MessageClientKey.objects.filter(conversation_id__in=conversation_ids).exclude(
+            Exists(Message.objects.filter(pk=OuterRef('message_id')))
+        ).delete()
+
+    def _create_partition(self, month: date):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.partition_name(month)} "
+                f"PARTITION OF {self.TABLE} FOR VALUES FROM (%s) TO (%s)",
+                [self.bound(month), self.bound(self.add_months(month, 1))]
+            )
+        logger.info(f"Created message partition {self.partition_name(month)}")
+
+    # One-time conversion
+
+    def inbound_foreign_keys(self) -> List[Tuple[str, str]]:
+        """(table, constraint) of every foreign key pointing at messages"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT conrelid::regclass::text, conname FROM pg_constraint
+                WHERE confrelid = %s::regclass AND contype = 'f'
+                ORDER BY 1, 2
+                """,
+                [self.TABLE]
+            )
+            return cursor.fetchall()
+
+    def unpartitionable_unique_indexes(self) -> List[str]:
+        """Unique indexes Postgres cannot keep once messages are partitioned"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT i.indexrelid::regclass::text
+                FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attname = 'created_at'
+                WHERE i.indrelid = %s::regclass AND i.indisunique AND NOT i.indisprimary
+                AND NOT a.attnum = ANY(i.indkey::int2[])
+                ORDER BY 1
+                """,
+                [self.TABLE]
+            )
+            return [row[0] for row in cursor.fetchall() if row[0] not in self.PARTITION_KEYED_CONSTRAINTS]
+
+    def partition_keyed_definition(self, name: str) -> str:
+        """A model unique constraint extended with the partition key"""
+        constraint = next(c for c in Message._meta.constraints if c.name == name)
+        columns = [Message._meta.get_field(field).column for field in constraint.fields]
+        return f"UNIQUE ({', '.join(connection.ops.quote_name(column) for column in columns + ['created_at'])})"
+
+    def convert(self, months_ahead: int = 3, drop_foreign_keys: bool = False) -> int:
+        """
+        Rebuild the messages table as a partitioned table.
+
+        Copies every row, so run it in a maintenance window. Unique
+        constraints and indexes are recreated as they were, except those
+        in PARTITION_KEYED_CONSTRAINTS, which gain created_at. Foreign keys
+        pointing at messages cannot be, so conversion is refused unless
+        ``drop_foreign_keys`` is set; each dropped key is logged. Returns
+        the number of partitions created.
+        """
+        if self.is_partitioned():
+            raise MessagePartitionError(f'{self.TABLE} is already partitioned')
+
+        unique_indexes = self.unpartitionable_unique_indexes()
+        if unique_indexes:
+            raise MessagePartitionError(
+                f"Unique indexes without created_at cannot be kept on a partitioned table: "
+                f"{', '.join(unique_indexes)}"
+            )
+
+        foreign_keys = self.inbound_foreign_keys()
+        if foreign_keys and not drop_foreign_keys:
+            raise MessagePartitionError(
+                f"Converting drops the foreign keys pointing at {self.TABLE}: "
+                f"{', '.join(f'{table}.{name}' for table, name in foreign_keys)}"
+            )
+
+        staging = f'{self.TABLE}_partitioned'
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Deferred foreign key checks would block the ALTER TABLEs below
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"LOCK TABLE {self.TABLE} IN ACCESS EXCLUSIVE MODE")
+
+            # Foreign keys pointing at messages cannot target a partitioned table
+            for table, constraint in self.inbound_foreign_keys():
+                cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {connection.ops.quote_name(constraint)}")
+                logger.warning(f"Dropped foreign key {constraint} on {table} to partition {self.TABLE}")
+
+            # Indexes and constraints are recreated once the data is copied
+            cursor.execute(
+                """
+                SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype IN ('c', 'f', 'u')
+                """,
+                [self.TABLE]
+            )
+            constraints = [
+                (name, self.partition_keyed_definition(name)
+                 if name in self.PARTITION_KEYED_CONSTRAINTS else definition)
+                for name, definition in cursor.fetchall()
+            ]
+            cursor.execute(
+                """
+                SELECT pg_get_indexdef(indexrelid) FROM pg_index
+                WHERE indrelid = %s::regclass AND NOT indisprimary
+                AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid)
+                """,
+                [self.TABLE]
+            )
+            indexes = [definition for definition, in cursor.fetchall()]
+
+            cursor.execute(
+                f"""
+                CREATE TABLE {staging} (
+                    LIKE {self.TABLE} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY
+                ) PARTITION BY RANGE (created_at)
+                """
+            )
+            cursor.execute(f"ALTER TABLE {staging} ADD PRIMARY KEY (id, created_at)")
+
+            cursor.execute(f"SELECT MIN(created_at), MAX(id) FROM {self.TABLE}")
+            oldest, last_id = cursor.fetchone()
+            month = self.month_start(oldest or timezone.now())
+            last_month = self.add_months(self.month_start(timezone.now()), months_ahead)
+            created = 0
+            while month <= last_month:
+                cursor.execute(
+                    f"CREATE TABLE {self.partition_name(month)} "
+                    f"PARTITION OF {staging} FOR VALUES FROM (%s) TO (%s)",
+                    [self.bound(month), self.bound(self.add_months(month, 1))]
+                )
+                month = self.add_months(month, 1)
+                created += 1
+
+            columns = ', '.join(
+                connection.ops.quote_name(field.column)
+                for field in Message._meta.concrete_fields
+                if not field.generated
+            )
+            cursor.execute(
+                f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {self.TABLE}"
+            )
+            if last_id:
+                cursor.execute(f"ALTER TABLE {staging} ALTER COLUMN id RESTART WITH {last_id + 1}")
+
+            cursor.execute(f"DROP TABLE {self.TABLE}")
+            cursor.execute(f"ALTER TABLE {staging} RENAME TO {self.TABLE}")
+            cursor.execute(f"ALTER SEQUENCE {staging}_id_seq RENAME TO {self.TABLE}_id_seq")
+
+            for definition in indexes:
+                cursor.execute(definition)
+            for name, definition in constraints:
+                cursor.execute(
+                    f"ALTER TABLE {self.TABLE} ADD CONSTRAINT {connection.ops.quote_name(name)} {definition}"
+                )
+
+        logger.info(f"Partitioned {self.TABLE} into {created} monthly partitions")
+        return created
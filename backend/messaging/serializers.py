@@ -1,13 +1,16 @@
 # backend/messaging/serializers.py
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError
 from django.utils import timezone
 from .models import (
+    AttachmentUpload,
     Conversation, 
     Message, 
     MessageTemplate, 
     ConversationFlag
 )
+from .services.conversation_state import ConversationStateService
 from properties.models import Property
 from accounts.serializers import UserSerializer
 from universities.serializers import UniversitySerializer
@@ -68,7 +71,11 @@ class PropertyBriefSerializer(serializers.ModelSerializer):
         ]
     
     def get_main_image(self, obj):
-        main_image = obj.images.filter(is_main=True).first()
+        # Prefetched by ConversationQuerySet.with_details
+        if hasattr(obj, 'main_images'):
+            main_image = obj.main_images[0] if obj.main_images else None
+        else:
+            main_image = obj.images.filter(is_main=True).first()
         if main_image and self.context.get('request'):
             return self.context['request'].build_absolute_uri(main_image.image.url)
         return None
@@ -80,6 +87,7 @@ class MessageSerializer(serializers.ModelSerializer):
     is_edited = serializers.SerializerMethodField()
     can_edit = serializers.SerializerMethodField()
     read_by = serializers.SerializerMethodField()
+    attachment_thumbnail = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
@@ -88,12 +96,13 @@ class MessageSerializer(serializers.ModelSerializer):
             'created_at', 'delivered', 'delivered_at', 'read', 'read_at',
             'message_type', 'metadata', 'attachment', 'attachment_type',
             'is_system_message', 'has_filtered_content', 'filter_warnings',
-            'filtered_content', 'is_edited', 'can_edit', 'read_by'
+            'filtered_content', 'is_edited', 'can_edit', 'read_by',
+            'upload', 'attachment_thumbnail', 'sequence'
         ]
         read_only_fields = [
             'sender', 'created_at', 'conversation', 
             'has_filtered_content', 'filter_warnings', 'filtered_content',
-            'is_system_message'
+            'is_system_message', 'upload', 'sequence'
         ]
     
     def get_is_edited(self, obj):  # Fixed method name
@@ -117,14 +126,72 @@ class MessageSerializer(serializers.ModelSerializer):
         validated_data['sender'] = self.context['request'].user
         return super().create(validated_data)
     
-    def get_read_by(self, obj):  # Fixed method name
-        """Get list of users who read this message"""
-        # This would require a MessageReadReceipt model
-        # For now, just return if current user read it
+    def get_attachment_thumbnail(self, obj):
+        """Thumbnail generated for chunked image uploads"""
+        if not obj.upload_id or not obj.upload.thumbnail:
+            return None
         request = self.context.get('request')
-        if request and request.user != obj.sender:
-            return [request.user.id] if obj.read else []
-        return []
+        url = obj.upload.thumbnail.url
+        return request.build_absolute_uri(url) if request else url
+    
+    def get_read_by(self, obj):  # Fixed method name
+        """Participants other than the sender whose read pointer has reached this message"""
+        if obj.sequence is None:
+            return []
+        
+        # Loaded once per conversation and shared by every message of the page
+        pointers = self.context.setdefault('read_pointers', {})
+        if obj.conversation_id not in pointers:
+            pointers.update(ConversationStateService.read_pointers([obj.conversation_id]))
+        return sorted(
+            user_id for user_id, sequence in pointers[obj.conversation_id].items()
+            if user_id != obj.sender_id and sequence >= obj.sequence
+        )
+
+
+class MessagePreviewSerializer(serializers.ModelSerializer):
+    """Latest message preview for conversation lists"""
+    
+    class Meta:
+        model = Message
+        fields = [
+            'id', 'content', 'sender', 'created_at', 'read',
+            'message_type', 'is_system_message', 'has_filtered_content',
+            'filtered_content'
+        ]
+        read_only_fields = fields
+
+
+class MessageSearchResultSerializer(serializers.ModelSerializer):
+    """Search hit with a highlighted snippet"""
+    sender_name = serializers.SerializerMethodField()
+    snippet = serializers.CharField(read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = Message
+        fields = [
+            'id', 'conversation', 'sender', 'sender_name', 'created_at',
+            'message_type', 'snippet', 'rank'
+        ]
+        read_only_fields = fields
+    
+    def get_sender_name(self, obj):
+        return obj.sender.get_full_name() or obj.sender.username
+
+
+class AttachmentUploadSerializer(serializers.ModelSerializer):
+    """Chunked upload session state"""
+    chunk_count = serializers.IntegerField(read_only=True)
+    
+    class Meta:
+        model = AttachmentUpload
+        fields = [
+            'id', 'filename', 'size', 'chunk_size', 'chunk_count',
+            'received_chunks', 'status', 'content_type', 'file',
+            'thumbnail', 'error', 'created_at', 'completed_at'
+        ]
+        read_only_fields = fields
 
 
 class ConversationSerializer(serializers.ModelSerializer):
@@ -162,16 +229,20 @@ class ConversationSerializer(serializers.ModelSerializer):
         """Get the other participant's details"""
         user = self.context.get('request').user
         if user:
-            other = obj.other_participant(user)
+            # Uses the prefetched participants instead of a query per row
+            other = next(
+                (participant for participant in obj.participants.all() if participant.id != user.id),
+                None
+            )
             if other:
                 return UserBriefSerializer(other).data
         return None
     
     def get_latest_message(self, obj):
         """Get the most recent message"""
-        latest = obj.messages.order_by('-created_at').first()
-        if latest:
-            return MessageSerializer(latest, context=self.context).data
+        # latest_message is kept up to date by Message.save
+        if obj.latest_message_id:
+            return MessagePreviewSerializer(obj.latest_message, context=self.context).data
         return None
     
     def get_unread_count(self, obj):  # Fixed method name
@@ -188,14 +259,18 @@ class ConversationSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Create conversation with participants"""
         participants = validated_data.pop('participants', [])
-        conversation = Conversation.objects.create(**validated_data)
         
         # Add current user as participant
         user = self.context['request'].user
         if user not in participants:
             participants.append(user)
         
-        conversation.participants.set(participants)
+        try:
+            conversation, _ = Conversation.objects.get_or_create_for_participants(
+                participants, **validated_data
+            )
+        except IntegrityError:
+            raise serializers.ValidationError('This conversation conflicts with an existing one')
         return conversation
 
 
@@ -251,8 +326,9 @@ class MessageTemplateSerializer(serializers.ModelSerializer):
     def get_localized_content(self, obj):  # Fixed method name
         """Get content in user's preferred language"""
         request = self.context.get('request')
-        if request and hasattr(request, 'LANGUAGE_CODE'):
-            if request.LANGUAGE_CODE == 'es' and obj.content_es:
+        language = self.context.get('language') or getattr(request, 'LANGUAGE_CODE', None)
+        if language:
+            if language.startswith('es') and obj.content_es:
                 return {
                     'title': obj.title_es or obj.title,
                     'content': obj.content_es
@@ -297,6 +373,38 @@ class ConversationFlagSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ModerationFlagSerializer(serializers.ModelSerializer):
+    """Flag with its conversation context, for the moderation queue"""
+    flagged_by_details = UserBriefSerializer(source='flagged_by', read_only=True)
+    assigned_to_details = UserBriefSerializer(source='assigned_to', read_only=True)
+    message_details = MessagePreviewSerializer(source='message', read_only=True)
+    conversation_details = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ConversationFlag
+        fields = [
+            'id', 'conversation', 'conversation_details', 'message', 'message_details',
+            'flagged_by', 'flagged_by_details', 'reason', 'description', 'priority',
+            'status', 'assigned_to', 'assigned_to_details', 'lease_expires_at',
+            'reviewed_by', 'reviewed_at', 'review_notes', 'action_taken',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+    
+    def get_conversation_details(self, obj):
+        """Conversation summary from the relations ModerationQueue preloads"""
+        conversation = obj.conversation
+        return {
+            'id': conversation.id,
+            'status': conversation.status,
+            'conversation_type': conversation.conversation_type,
+            'property': conversation.property.title if conversation.property else None,
+            'participants': UserBriefSerializer(conversation.participants.all(), many=True).data,
+            'latest_message': MessagePreviewSerializer(conversation.latest_message).data
+            if conversation.latest_message else None,
+        }
+
+
 # These serializers use camelCase input fields with source mapping, which is correct
 class ConversationStartSerializer(serializers.Serializer):
     """Serializer for starting a new conversation"""
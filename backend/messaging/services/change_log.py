@@ -0,0 +1,191 @@
+# backend/messaging/services/change_log.py
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db.models import Max
+from django.utils import timezone
+
+from ..models import ConversationChange, ConversationParticipantState
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeLogService:
+    """
+    Record and read the per-user change log behind delta sync.
+
+    Entries are written in the same transaction as the change itself,
+    one per participant. Readers page through their entries by id; only
+    entries older than SETTLE_SECONDS are handed out, so a transaction
+    that allocated a lower id but committed later is not skipped.
+    """
+
+    SETTLE_SECONDS = 2
+    RETENTION_DAYS = 30
+    MAX_LIMIT = 1000
+
+    # Deletions being collected by collect_deletions, per thread
+    _deletions = threading.local()
+
+    @classmethod
+    def record(cls, conversation_id: int, kind: str, message_id: Optional[int] = None,
+               data: Optional[Dict] = None, user_ids: Optional[Iterable[int]] = None):
+        """Log a change for every participant (or the given users)"""
+        if user_ids is None:
+            user_ids = ConversationParticipantState.objects.filter(
+                conversation_id=conversation_id
+            ).values_list('user_id', flat=True)
+
+        now = timezone.now()
+        ConversationChange.objects.bulk_create([
+            ConversationChange(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                kind=kind,
+                message_id=message_id,
+                data=data or {},
+                created_at=now
+            )
+            for user_id in user_ids
+        ])
+
+    @classmethod
+    def record_many(cls, conversation_ids: Iterable[int], kind: str, data: Optional[Dict] = None):
+        """Log the same change for every participant of many conversations"""
+        rows = ConversationParticipantState.objects.filter(
+            conversation_id__in=list(conversation_ids)
+        ).values_list('conversation_id', 'user_id')
+
+        now = timezone.now()
+        ConversationChange.objects.bulk_create([
+            ConversationChange(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                kind=kind,
+                data=data or {},
+                created_at=now
+            )
+            for conversation_id, user_id in rows
+        ], batch_size=1000)
+
+    @classmethod
+    def record_deletions(cls, deleted: Iterable[Tuple[int, int]]):
+        """Log message_deleted for (conversation_id, message_id) pairs"""
+        message_ids = defaultdict(list)
+        for conversation_id, message_id in deleted:
+            message_ids[conversation_id].append(message_id)
+        if not message_ids:
+            return
+
+        participants = defaultdict(list)
+        for conversation_id, user_id in ConversationParticipantState.objects.filter(
+            conversation_id__in=list(message_ids)
+        ).values_list('conversation_id', 'user_id'):
+            participants[conversation_id].append(user_id)
+
+        now = timezone.now()
+        ConversationChange.objects.bulk_create([
+            ConversationChange(
+                user_id=user_id,
+                conversation_id=conversation_id,
+                kind='message_deleted',
+                message_id=message_id,
+                created_at=now
+            )
+            for conversation_id, ids in message_ids.items()
+            for message_id in ids
+            for user_id in participants[conversation_id]
+        ], batch_size=1000)
+
+    @classmethod
+    def message_deleted(cls, conversation_id: int, message_id: int):
+        """Log a hard-deleted message, batched inside collect_deletions"""
+        collected = getattr(cls._deletions, 'pairs', None)
+        if collected is not None:
+            collected.append((conversation_id, message_id))
+        else:
+            cls.record_deletions([(conversation_id, message_id)])
+
+    @classmethod
+    @contextmanager
+    def collect_deletions(cls, record: bool = True):
+        """
+        Log the message deletions made inside the block in one batch.
+
+        Use inside the deleting transaction, around bulk deletes that
+        would otherwise log every row on its own. With ``record=False``
+        nothing is logged, for rows that live on elsewhere (archiving).
+        """
+        if getattr(cls._deletions, 'pairs', None) is not None:
+            yield
+            return
+
+        cls._deletions.pairs = []
+        try:
+            yield
+            pairs = cls._deletions.pairs
+        finally:
+            cls._deletions.pairs = None
+        if record:
+            cls.record_deletions(pairs)
+
+    @classmethod
+    def latest_position(cls, user_id: int) -> int:
+        """Log position after everything recorded for a user so far"""
+        return ConversationChange.objects.filter(
+            user_id=user_id
+        ).aggregate(position=Max('id'))['position'] or 0
+
+    # Cursors are "<position>.<issued at>" so stale ones can be detected
+
+    @staticmethod
+    def encode_cursor(position: int) -> str:
+        return f'{position}.{int(timezone.now().timestamp())}'
+
+    @classmethod
+    def decode_cursor(cls, cursor: str) -> Optional[int]:
+        """Log position of a cursor, or None when it is invalid or expired"""
+        try:
+            position, issued_at = (int(part) for part in str(cursor).split('.'))
+        except ValueError:
+            return None
+
+        # Entries after an old cursor may already have been pruned
+        oldest_safe = timezone.now() - timedelta(days=cls.RETENTION_DAYS - 1)
+        if issued_at < oldest_safe.timestamp():
+            return None
+        return position
+
+    @classmethod
+    def changes_since(cls, user_id: int, position: int, limit: int = 500):
+        """Settled changes after ``position`` in log order, plus whether more remain"""
+        limit = max(1, min(limit, cls.MAX_LIMIT))
+        settled = timezone.now() - timedelta(seconds=cls.SETTLE_SECONDS)
+
+        changes = list(
+            ConversationChange.objects.filter(
+                user_id=user_id,
+                id__gt=position,
+                created_at__lte=settled
+            ).order_by('id')[:limit + 1]
+        )
+        return changes[:limit], len(changes) > limit
+
+    @classmethod
+    def prune(cls, days: Optional[int] = None, batch_size: int = 5000) -> int:
+        """Delete entries older than the retention period"""
+        cutoff = timezone.now() - timedelta(days=days or cls.RETENTION_DAYS)
+        deleted = 0
+        while True:
+            batch = list(
+                ConversationChange.objects.filter(
+                    created_at__lt=cutoff
+                ).values_list('id', flat=True)[:batch_size]
+            )
+            if not batch:
+                return deleted
+            deleted += ConversationChange.objects.filter(id__in=batch).delete()[0]
@@ -0,0 +1,335 @@
+# backend/messaging/services/conversation_state.py
+import logging
+import threading
+from collections import defaultdict
+from functools import partial
+from typing import Dict, Iterable, Optional
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Max, Q, Value, When
+from django.utils import timezone
+
+from ..cache import ConversationContextCache, MessageCache
+from ..models import Conversation, ConversationParticipantState, Message
+from .change_log import ChangeLogService
+from .unread_counter import UnreadCounterService
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStateService:
+    """
+    Maintain ConversationParticipantState rows.
+
+    Every write path that creates or reads messages goes through here so
+    the per-participant counters stay consistent with the messages table.
+    Reads lock the reader's state row first; message inserts update the
+    same rows in their own transaction, so the two serialize instead of
+    losing an increment.
+    """
+
+    # Conversations waiting for a post-commit recount, per thread
+    _pending_refresh = threading.local()
+
+    @classmethod
+    def ensure_states(cls, conversation_id: int, user_ids: Iterable[int]):
+        """Create missing state rows for participants of a conversation"""
+        latest = Message.objects.filter(
+            conversation_id=conversation_id
+        ).order_by('-created_at').values('id', 'created_at').first()
+
+        ConversationParticipantState.objects.bulk_create(
+            [
+                ConversationParticipantState(
+                    conversation_id=conversation_id,
+                    user_id=user_id,
+                    last_message_id=latest['id'] if latest else None,
+                    last_read_message_id=latest['id'] if latest else None,
+                    last_activity=latest['created_at'] if latest else timezone.now()
+                )
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True
+        )
+
+    @classmethod
+    def record_message(cls, message: Message):
+        """Update every participant's state for a newly created message"""
+        sender_id = message.sender_id
+        ConversationParticipantState.objects.filter(
+            conversation_id=message.conversation_id
+        ).update(
+            message_count=F('message_count') + 1,
+            last_message_id=message.id,
+            last_activity=message.created_at,
+            # Senders have read their own message
+            unread_count=Case(
+                When(user_id=sender_id, then=F('unread_count')),
+                default=F('unread_count') + 1
+            ),
+            last_read_message_id=Case(
+                When(user_id=sender_id, then=Value(message.id)),
+                default=F('last_read_message_id'),
+                output_field=models.BigIntegerField()
+            ),
+            last_read_sequence=Case(
+                When(user_id=sender_id, then=Value(message.sequence)),
+                default=F('last_read_sequence'),
+                output_field=models.PositiveIntegerField()
+            )
+        )
+        ChangeLogService.record(message.conversation_id, 'message_created', message_id=message.id)
+        transaction.on_commit(partial(
+            cls._after_message_commit, message.conversation_id, sender_id, message.content
+        ))
+
+    @classmethod
+    def mark_read(cls, conversation_id: int, user, message_ids: Optional[Iterable[int]] = None,
+                  up_to: Optional[Message] = None) -> int:
+        """
+        Mark messages from other participants as read.
+
+        Marks everything when neither ``message_ids`` nor ``up_to`` is
+        given, otherwise the listed messages or everything sent up to
+        ``up_to``. Returns the number of messages marked.
+        """
+        with transaction.atomic():
+            state = ConversationParticipantState.objects.select_for_update(of=('self',)).filter(
+                conversation_id=conversation_id,
+                user=user
+            ).select_related('last_message', 'last_read_message').first()
+
+            unread = Message.objects.filter(
+                conversation_id=conversation_id,
+                read=False
+            ).exclude(sender=user)
+
+            mark_all = message_ids is None and up_to is None
+            if message_ids is not None:
+                unread = unread.filter(id__in=list(message_ids))
+            elif up_to is not None:
+                unread = unread.filter(created_at__lte=up_to.created_at)
+
+            # The pointer follows the requested messages even when another
+            # reader already cleared their shared read flag
+            newest_read = up_to
+            if message_ids is not None:
+                newest_read = Message.objects.filter(
+                    conversation_id=conversation_id,
+                    id__in=list(message_ids)
+                ).exclude(sender=user).order_by(
+                    F('sequence').desc(nulls_last=True), '-created_at'
+                ).first()
+
+            updated = unread.update(read=True, read_at=timezone.now())
+
+            if state is None:
+                if updated:
+                    cls.invalidate_caches(conversation_id)
+                return updated
+
+            previous_unread = state.unread_count
+            previous_pointer = (state.last_read_message_id, state.last_read_sequence)
+            if mark_all:
+                state.unread_count = 0
+                state.last_read_message_id = state.last_message_id
+                newest_read = state.last_message
+            else:
+                state.unread_count = cls._count_unread(conversation_id, user)
+                current = state.last_read_message
+                if newest_read and (current is None or newest_read.created_at >= current.created_at):
+                    state.last_read_message_id = newest_read.id
+            if newest_read and newest_read.sequence:
+                state.last_read_sequence = max(state.last_read_sequence, newest_read.sequence)
+
+            state.save(update_fields=['unread_count', 'last_read_message', 'last_read_sequence'])
+            pointer_moved = (state.last_read_message_id, state.last_read_sequence) != previous_pointer
+            if updated or pointer_moved:
+                cls.invalidate_caches(conversation_id)
+            # The badge total is a sum of state rows, so follow this row's change
+            if state.unread_count != previous_unread:
+                transaction.on_commit(partial(
+                    UnreadCounterService.adjust, [user.id], state.unread_count - previous_unread
+                ))
+            if updated or pointer_moved:
+                ChangeLogService.record(conversation_id, 'messages_read', data={
+                    'reader': user.id,
+                    'last_read_message_id': state.last_read_message_id,
+                    'last_read_sequence': state.last_read_sequence,
+                    'marked': updated,
+                })
+            return updated
+
+    @classmethod
+    def get_unread_count(cls, conversation_id: int, user) -> int:
+        """Unread messages for a participant"""
+        unread_count = ConversationParticipantState.objects.filter(
+            conversation_id=conversation_id,
+            user=user
+        ).values_list('unread_count', flat=True).first()
+
+        if unread_count is None:
+            return cls._count_unread(conversation_id, user)
+        return unread_count
+
+    @classmethod
+    def read_pointers(cls, conversation_ids: Iterable[int]) -> Dict[int, Dict[int, int]]:
+        """Last read sequence of every participant, per conversation"""
+        pointers = {conversation_id: {} for conversation_id in conversation_ids}
+        rows = ConversationParticipantState.objects.filter(
+            conversation_id__in=list(pointers)
+        ).values_list('conversation_id', 'user_id', 'last_read_sequence')
+        for conversation_id, user_id, sequence in rows:
+            pointers[conversation_id][user_id] = sequence
+        return pointers
+
+    @classmethod
+    def refresh(cls, conversation_ids: Iterable[int]):
+        """
+        Recompute states from the messages table.
+
+        Used after bulk operations that bypass Message.save (e.g. cleanup
+        deletes) and to repair drift.
+        """
+        conversation_ids = list(conversation_ids)
+        if not conversation_ids:
+            return
+
+        participants = defaultdict(list)
+        rows = Conversation.participants.through.objects.filter(
+            conversation_id__in=conversation_ids
+        ).values_list('conversation_id', 'user_id')
+        for conversation_id, user_id in rows:
+            participants[conversation_id].append(user_id)
+        for conversation_id, user_ids in participants.items():
+            cls.ensure_states(conversation_id, user_ids)
+
+        totals = {
+            row['conversation_id']: row
+            for row in Message.objects.filter(
+                conversation_id__in=conversation_ids
+            ).values('conversation_id').annotate(
+                total=Count('id'),
+                unread=Count('id', filter=Q(read=False)),
+                last_activity=Max('created_at')
+            )
+        }
+        # Unread messages each participant sent themselves
+        sent_unread = {
+            (row['conversation_id'], row['sender_id']): row['unread']
+            for row in Message.objects.filter(
+                conversation_id__in=conversation_ids,
+                read=False
+            ).values('conversation_id', 'sender_id').annotate(unread=Count('id'))
+        }
+        last_messages = {}
+        last_sequences = {}
+        for conversation_id, message_id, sequence in Message.objects.filter(
+            conversation_id__in=conversation_ids
+        ).order_by('conversation_id', '-created_at').distinct(
+            'conversation_id'
+        ).values_list('conversation_id', 'id', 'sequence'):
+            last_messages[conversation_id] = message_id
+            last_sequences[conversation_id] = sequence
+
+        states = list(ConversationParticipantState.objects.filter(
+            conversation_id__in=conversation_ids
+        ))
+        for state in states:
+            total = totals.get(state.conversation_id)
+            state.message_count = total['total'] if total else 0
+            state.unread_count = (total['unread'] if total else 0) - sent_unread.get(
+                (state.conversation_id, state.user_id), 0
+            )
+            state.last_message_id = last_messages.get(state.conversation_id)
+            if total:
+                state.last_activity = total['last_activity']
+            if not state.unread_count:
+                state.last_read_message_id = state.last_message_id
+                state.last_read_sequence = max(
+                    state.last_read_sequence, last_sequences.get(state.conversation_id) or 0
+                )
+
+        ConversationParticipantState.objects.bulk_update(
+            states,
+            [
+                'message_count', 'unread_count', 'last_message', 'last_activity',
+                'last_read_message', 'last_read_sequence'
+            ],
+            batch_size=500
+        )
+
+        # The conversation's latest_message cache may point at a deleted row
+        conversations = [
+            Conversation(id=conversation_id, latest_message_id=last_messages.get(conversation_id))
+            for conversation_id in conversation_ids
+        ]
+        Conversation.objects.bulk_update(conversations, ['latest_message'], batch_size=500)
+
+        user_ids = {state.user_id for state in states}
+        transaction.on_commit(partial(UnreadCounterService.reset, user_ids))
+
+    @classmethod
+    def refresh_on_commit(cls, conversation_id: int):
+        """
+        Recount a conversation's states and drop its caches after commit.
+
+        Called once per deleted row; conversations are collected so a
+        bulk delete refreshes each of them once.
+        """
+        cls._pending_refresh.__dict__.setdefault('ids', set()).add(conversation_id)
+        transaction.on_commit(cls._refresh_pending)
+
+    @classmethod
+    def _refresh_pending(cls):
+        # Ids left over from a rolled-back transaction only cost an extra recount
+        conversation_ids = cls._pending_refresh.__dict__.pop('ids', set())
+        if not conversation_ids:
+            return
+        with transaction.atomic():
+            cls.refresh(conversation_ids)
+        for conversation_id in conversation_ids:
+            cls.invalidate_caches(conversation_id)
+            try:
+                ConversationContextCache.invalidate(conversation_id)
+            except Exception as e:
+                logger.error(f"Failed to drop context cache for conversation {conversation_id}: {e}")
+
+    @classmethod
+    def invalidate_caches(cls, conversation_id: int):
+        """Bump cache versions of a conversation and its participants once committed"""
+        def bump():
+            user_ids = ConversationParticipantState.objects.filter(
+                conversation_id=conversation_id
+            ).values_list('user_id', flat=True)
+            try:
+                MessageCache.bump_conversation(conversation_id, user_ids)
+            except Exception as e:
+                logger.error(f"Failed to invalidate caches for conversation {conversation_id}: {e}")
+
+        transaction.on_commit(bump)
+
+    @classmethod
+    def _after_message_commit(cls, conversation_id: int, sender_id: int, content: str):
+        """Update caches and counters once a new message is committed"""
+        user_ids = list(ConversationParticipantState.objects.filter(
+            conversation_id=conversation_id
+        ).values_list('user_id', flat=True))
+
+        try:
+            MessageCache.bump_conversation(conversation_id, user_ids)
+            ConversationContextCache.append(conversation_id, content)
+        except Exception as e:
+            logger.error(f"Failed to update caches for conversation {conversation_id}: {e}")
+
+        UnreadCounterService.adjust(
+            [user_id for user_id in user_ids if user_id != sender_id], 1
+        )
+
+    @staticmethod
+    def _count_unread(conversation_id: int, user) -> int:
+        # Served by the (conversation, read, -created_at) index
+        return Message.objects.filter(
+            conversation_id=conversation_id,
+            read=False
+        ).exclude(sender=user).count()
@@ -0,0 +1,121 @@
+# backend/messaging/services/search.py
+import base64
+import json
+import logging
+from typing import Dict, Optional
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+from ..models import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSearchService:
+    """
+    Full-text search over messages.
+
+    Matches against Message.search_vector (English and Spanish stems,
+    GIN indexed), so only matching rows are visited. Results are ordered
+    by (rank, id) and paginated with an opaque keyset cursor; snippets
+    are only generated for the rows on the returned page.
+    """
+
+    CONFIGS = ('english', 'spanish')
+    MAX_QUERY_LENGTH = 200
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 50
+
+    @classmethod
+    def build_query(cls, text: str) -> Optional[SearchQuery]:
+        """Web-search style query matching either language's stems"""
+        text = (text or '').strip()[:cls.MAX_QUERY_LENGTH]
+        if not text:
+            return None
+
+        query = None
+        for config in cls.CONFIGS:
+            part = SearchQuery(text, config=config, search_type='websearch')
+            query = part if query is None else query | part
+        return query
+
+    @classmethod
+    def search(cls, user, text: str, conversation_id: Optional[int] = None,
+               cursor: Optional[str] = None, page_size: Optional[int] = None,
+               all_conversations: bool = False) -> Dict:
+        """
+        Search messages visible to ``user``.
+
+        Participants only see their own conversations; staff may pass
+        ``all_conversations`` to search everything. Returns the page of
+        messages and the cursor for the next page (or None).
+        """
+        query = cls.build_query(text)
+        if query is None:
+            return {'results': [], 'next_cursor': None}
+
+        page_size = min(max(1, page_size or cls.DEFAULT_PAGE_SIZE), cls.MAX_PAGE_SIZE)
+
+        messages = Message.objects.filter(
+            search_vector=query,
+            is_deleted=False
+        )
+        if not (all_conversations and user.is_staff):
+            messages = messages.filter(conversation__participants=user)
+        if conversation_id is not None:
+            messages = messages.filter(conversation_id=conversation_id)
+
+        # ts_rank returns real; as double precision it survives the JSON cursor exactly
+        messages = messages.annotate(
+            rank=Cast(SearchRank(F('search_vector'), query), FloatField())
+        )
+
+        position = cls.decode_cursor(cursor)
+        if position:
+            messages = messages.filter(
+                Q(rank__lt=position['rank'])
+                | Q(rank=position['rank'], id__lt=position['id'])
+            )
+
+        page = list(
+            messages.annotate(
+                snippet=SearchHeadline(
+                    'content',
+                    query,
+                    config=cls.CONFIGS[0],
+                    start_sel='<mark>',
+                    stop_sel='</mark>',
+                    max_words=30,
+                    min_words=10,
+                    max_fragments=2
+                )
+            ).select_related(
+                'sender', 'conversation'
+            ).order_by('-rank', '-id')[:page_size + 1]
+        )
+
+        next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            last = page[-1]
+            next_cursor = cls.encode_cursor(last.rank, last.id)
+
+        return {'results': page, 'next_cursor': next_cursor}
+
+    @staticmethod
+    def encode_cursor(rank: float, message_id: int) -> str:
+        payload = json.dumps({'rank': rank, 'id': message_id})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: Optional[str]) -> Optional[Dict]:
+        if not cursor:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return {'rank': float(position['rank']), 'id': int(position['id'])}
+        except (ValueError, TypeError, KeyError) as e:
+            logger.debug(f"Ignoring invalid search cursor: {e}")
+            return None
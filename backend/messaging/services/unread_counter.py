@@ -0,0 +1,76 @@
+# backend/messaging/services/unread_counter.py
+import logging
+from typing import Iterable
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db.models import Sum
+
+from ..cache import UnreadCounterCache
+from ..models import ConversationParticipantState
+
+logger = logging.getLogger(__name__)
+
+
+class UnreadCounterService:
+    """
+    Global unread badge count per user.
+
+    The count lives in the cache and is adjusted atomically when messages
+    are created or read (after the transaction commits). A missing,
+    expired or negative counter is reconciled from the participant state
+    rows, which are the source of truth. Every change is pushed to the
+    user's conversation list sockets as an ``unread_count`` frame.
+    """
+
+    @classmethod
+    def get_total(cls, user_id: int) -> int:
+        """Unread messages across all of a user's conversations"""
+        count = UnreadCounterCache.get(user_id)
+        if count is None or count < 0:
+            count = cls.reconcile(user_id)
+        return count
+
+    @classmethod
+    def reconcile(cls, user_id: int) -> int:
+        """Recompute a user's total from ConversationParticipantState"""
+        count = ConversationParticipantState.objects.filter(
+            user_id=user_id
+        ).aggregate(total=Sum('unread_count'))['total'] or 0
+        UnreadCounterCache.set(user_id, count)
+        return count
+
+    @classmethod
+    def adjust(cls, user_ids: Iterable[int], delta: int, push: bool = True):
+        """Apply a committed change to several users' counters"""
+        for user_id in user_ids:
+            try:
+                count = UnreadCounterCache.adjust(user_id, delta)
+                if count is None or count < 0:
+                    count = cls.reconcile(user_id)
+                if push:
+                    cls.push(user_id, count)
+            except Exception as e:
+                logger.error(f"Failed to update unread counter for user {user_id}: {e}")
+
+    @classmethod
+    def reset(cls, user_ids: Iterable[int]):
+        """Forget counters after bulk changes; the next read reconciles"""
+        try:
+            UnreadCounterCache.delete_many(user_ids)
+        except Exception as e:
+            logger.error(f"Failed to reset unread counters: {e}")
+
+    @staticmethod
+    def push(user_id: int, count: int):
+        """Send the new total to the user's conversation list sockets"""
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        async_to_sync(channel_layer.group_send)(
+            f'conversations_user_{user_id}',
+            {
+                'type': 'unread_count_update',
+                'unread_count': count
+            }
+        )
@@ -0,0 +1,113 @@
+# backend/messaging/signals.py
+from functools import partial
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .cache import ConversationContextCache, MessageCache, TemplateCache
+from .models import (
+    Conversation, ConversationParticipantState, Message, MessageArchiveSegment, MessageTemplate
+)
+from .services.change_log import ChangeLogService
+from .services.conversation_state import ConversationStateService
+from .services.unread_counter import UnreadCounterService
+
+
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def sync_participant_states(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep one ConversationParticipantState per participant"""
+    if action == 'pre_clear':
+        # pk_set is not available after a clear
+        lookup = {'user': instance} if reverse else {'conversation': instance}
+        states = ConversationParticipantState.objects.filter(**lookup)
+        user_ids = list(states.values_list('user_id', flat=True).distinct())
+        states.delete()
+        transaction.on_commit(partial(UnreadCounterService.reset, user_ids))
+        return
+    
+    if action not in ('post_add', 'post_remove'):
+        return
+    
+    if reverse:
+        # user.conversations.add(...): instance is the user
+        pairs = [(conversation_id, [instance.pk]) for conversation_id in pk_set]
+    else:
+        pairs = [(instance.pk, list(pk_set))]
+    
+    for conversation_id, user_ids in pairs:
+        if action == 'post_add':
+            ConversationStateService.ensure_states(conversation_id, user_ids)
+            ChangeLogService.record(conversation_id, 'conversation_updated', user_ids=user_ids)
+        else:
+            ConversationParticipantState.objects.filter(
+                conversation_id=conversation_id,
+                user_id__in=user_ids
+            ).delete()
+            ChangeLogService.record(
+                conversation_id, 'conversation_updated', data={'removed': True}, user_ids=user_ids
+            )
+        
+        # Removed users no longer have a state row to be found through
+        transaction.on_commit(partial(MessageCache.bump_conversation, conversation_id, user_ids))
+        transaction.on_commit(partial(UnreadCounterService.reset, user_ids))
+        ConversationStateService.invalidate_caches(conversation_id)
+
+
+@receiver(post_save, sender=Conversation)
+def invalidate_conversation_caches(sender, instance, created, update_fields=None, **kwargs):
+    """Status and other conversation changes invalidate cached lists"""
+    # Message.save bumps the latest_message pointer; record_message already invalidates
+    if update_fields and set(update_fields) <= {'updated_at', 'latest_message'}:
+        return
+    if not created:
+        ConversationStateService.invalidate_caches(instance.pk)
+        ChangeLogService.record(instance.pk, 'conversation_updated', data={'status': instance.status})
+
+
+@receiver(post_save, sender=Message)
+def invalidate_message_caches(sender, instance, created, update_fields=None, **kwargs):
+    """Edits and deletions change previews and stats"""
+    # New messages are handled by ConversationStateService.record_message;
+    # retry bookkeeping is not shown in cached payloads
+    delivery_fields = {
+        'delivery_status', 'delivery_attempts', 'last_delivery_attempt',
+        # Read and delivered flags travel as messages_read and receipts
+        'read', 'read_at', 'delivered', 'delivered_at',
+    }
+    if created or (update_fields and set(update_fields) <= delivery_fields):
+        return
+    ConversationStateService.invalidate_caches(instance.conversation_id)
+    transaction.on_commit(partial(ConversationContextCache.invalidate, instance.conversation_id))
+    ChangeLogService.record(
+        instance.conversation_id,
+        'message_deleted' if instance.is_deleted else 'message_updated',
+        message_id=instance.pk
+    )
+
+
+@receiver(post_delete, sender=Message)
+def message_removed(sender, instance, origin=None, **kwargs):
+    """Hard deletes bypass Message.save; recount inboxes and drop caches"""
+    ConversationStateService.refresh_on_commit(instance.conversation_id)
+    
+    # Deleting a conversation or user takes its log entries with it
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is Message:
+        ChangeLogService.message_deleted(instance.conversation_id, instance.pk)
+
+
+@receiver(post_save, sender=MessageTemplate)
+@receiver(post_delete, sender=MessageTemplate)
+def invalidate_template_cache(sender, instance, update_fields=None, **kwargs):
+    """Template edits invalidate cached payloads; usage tracking does not"""
+    if update_fields and set(update_fields) <= {'usage_count', 'last_used'}:
+        return
+    transaction.on_commit(TemplateCache.invalidate)
+
+
+@receiver(post_delete, sender=MessageArchiveSegment)
+def delete_archive_segment_file(sender, instance, **kwargs):
+    """Remove a segment's file once its index entry is gone"""
+    from .archive import MessageArchiveService
+    storage = MessageArchiveService.storage()
+    transaction.on_commit(partial(storage.delete, instance.path))
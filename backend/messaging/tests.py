@@ -1,13 +1,24 @@
 # backend/messaging/tests.py
-from django.test import TestCase
+import json
+import asyncio
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+from channels.layers import InMemoryChannelLayer
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import Conversation, Message, MessageTemplate
+from .models import Conversation, ConversationParticipantState, Message, MessageTemplate
 from properties.models import Property
 
 User = get_user_model()
 
+# Redis is not required to run these tests
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+LOCAL_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
 
 class ContentFilterTestCase(TestCase):
     """Test content filtering functionality"""
@@ -74,3 +85,2179 @@ class ConversationAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Conversation.objects.count(), 1)
         self.assertEqual(Message.objects.count(), 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class DeliverySchedulerTestCase(TestCase):
+    """Test retrying delivery of undelivered messages"""
+    
+    def setUp(self):
+        cache.clear()
+        self.sender = User.objects.create_user(
+            username='sender1',
+            email='sender@test.com',
+            user_type='student'
+        )
+        self.recipient = User.objects.create_user(
+            username='recipient1',
+            email='recipient@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.sender, self.recipient)
+        self.message = Message.objects.create(
+            conversation=self.conversation,
+            sender=self.sender,
+            content='Are you still there?'
+        )
+        Message.objects.filter(id=self.message.id).update(
+            created_at=timezone.now() - timedelta(minutes=5)
+        )
+        self.layer = InMemoryChannelLayer()
+    
+    def _scheduler(self):
+        from .delivery import DeliveryScheduler
+        return DeliveryScheduler(channel_layer=self.layer)
+    
+    def test_pushes_to_online_recipient(self):
+        """Undelivered messages are re-pushed to online recipients"""
+        cache.set(f'presence:conversation:{self.conversation.id}', {self.recipient.id})
+        channel = async_to_sync(self.layer.new_channel)()
+        async_to_sync(self.layer.group_add)(f'user_{self.recipient.id}', channel)
+        
+        stats = self._scheduler().run_once()
+        
+        self.assertEqual(stats['pushed'], 1)
+        event = async_to_sync(self.layer.receive)(channel)
+        self.assertEqual(event['type'], 'redeliver_message')
+        self.assertEqual(event['message']['id'], self.message.id)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.delivery_attempts, 1)
+        
+        # Backoff prevents an immediate second attempt
+        self.assertEqual(self._scheduler().run_once()['pushed'], 0)
+    
+    def test_skips_offline_recipient(self):
+        """Offline recipients are not pushed and no attempt is recorded"""
+        stats = self._scheduler().run_once()
+        
+        self.assertEqual(stats['pushed'], 0)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.delivery_attempts, 0)
+    
+    def test_marks_exhausted_messages_failed(self):
+        """Messages past the attempt limit are marked as failed"""
+        Message.objects.filter(id=self.message.id).update(
+            delivery_attempts=Message.MAX_DELIVERY_ATTEMPTS
+        )
+        
+        stats = self._scheduler().run_once()
+        
+        self.assertEqual(stats['failed'], 1)
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.delivery_status, 'failed')
+    
+    def test_backlog_counts_all_pending_messages(self):
+        """Messages still in their grace period count towards the backlog"""
+        from .delivery import DeliveryScheduler
+        Message.objects.create(
+            conversation=self.conversation,
+            sender=self.sender,
+            content='Just sent'
+        )
+        
+        self._scheduler().run_once()
+        
+        self.assertEqual(DeliveryScheduler.get_backlog_size(), 2)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class MonitoredChannelLayerTestCase(TestCase):
+    """Test channel layer backpressure measurement"""
+    
+    def _layer(self, **kwargs):
+        from .channel_layer import MonitoredChannelLayer
+        return MonitoredChannelLayer(config={'capacity': 2}, **kwargs)
+    
+    def test_counts_channel_full(self):
+        """Overflowing a channel is counted and flags the consumer"""
+        layer = self._layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)('chat_1', channel)
+        
+        for i in range(3):
+            async_to_sync(layer.group_send)('chat_1', {'type': 'chat.message', 'n': i})
+        
+        self.assertEqual(layer.get_metrics()['channel_full'], 1)
+        self.assertTrue(layer.is_slow_consumer(channel))
+        
+        layer.forget(channel)
+        self.assertFalse(layer.is_slow_consumer(channel))
+    
+    def test_shared_counters_are_flushed_off_the_loop(self):
+        """Counters are batched in memory and added to the daily metrics on flush"""
+        from .monitoring import WebSocketMonitor
+        layer = self._layer()
+        
+        async def overflow_twice():
+            layer.record_channel_full()
+            layer.record_channel_full(2)
+            self.assertEqual(layer.unflushed['channel_full'], 3)
+            layer._flush_task.cancel()
+            await layer.flush_metrics()
+        
+        async_to_sync(overflow_twice)()
+        self.assertEqual(WebSocketMonitor.get_metrics()['channel_full'], 3)
+        self.assertFalse(layer.unflushed)
+    
+    def test_detects_growing_lag(self):
+        """A consumer that lags while its queue grows is flagged as slow"""
+        layer = self._layer(slow_consumer_lag=0, slow_consumer_strikes=2, slow_consumer_depth=10)
+        layer.inner.capacity = 10
+        channel = async_to_sync(layer.new_channel)()
+        
+        async def fall_behind():
+            for _ in range(2):
+                await layer.send(channel, {'type': 'chat.message'})
+                await layer.send(channel, {'type': 'chat.message'})
+                message = await layer.receive(channel)
+                # The send timestamp never reaches consumers
+                self.assertEqual(message, {'type': 'chat.message'})
+        
+        async_to_sync(fall_behind)()
+        self.assertTrue(layer.is_slow_consumer(channel))
+    
+    def test_draining_consumer_is_not_slow(self):
+        """Lag alone does not flag a consumer that is catching up"""
+        layer = self._layer(slow_consumer_lag=0, slow_consumer_strikes=2)
+        channel = async_to_sync(layer.new_channel)()
+        
+        async def catch_up():
+            await layer.send(channel, {'type': 'chat.message'})
+            await layer.send(channel, {'type': 'chat.message'})
+            await layer.receive(channel)
+            await layer.receive(channel)
+        
+        async_to_sync(catch_up)()
+        self.assertFalse(layer.is_slow_consumer(channel))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class IdempotentSendTestCase(TestCase):
+    """Test deduplication of retried sends"""
+    
+    def setUp(self):
+        from .consumers import ChatConsumer
+        self.sender = User.objects.create_user(
+            username='sender2',
+            email='sender2@test.com',
+            user_type='student'
+        )
+        self.recipient = User.objects.create_user(
+            username='recipient2',
+            email='recipient2@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.sender, self.recipient)
+        
+        self.consumer = ChatConsumer()
+        self.consumer.user = self.sender
+        self.consumer.conversation_id = self.conversation.id
+    
+    def _create(self, content, temp_id):
+        from .consumers import ChatConsumer
+        # Call the sync implementation so the test transaction is reused
+        return ChatConsumer.create_message.__wrapped__(
+            self.consumer, content, {}, {'action': 'allow', 'violations': []}, temp_id
+        )
+    
+    def test_retried_send_returns_original(self):
+        """Sending twice with the same temp_id stores a single message"""
+        first, created = self._create('Hello', 'temp-1')
+        self.assertTrue(created)
+        
+        retry, created = self._create('Hello', 'temp-1')
+        self.assertFalse(created)
+        self.assertEqual(retry.id, first.id)
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 1)
+    
+    def test_messages_without_temp_id_are_not_deduplicated(self):
+        """Sends without a temp_id are always stored"""
+        self._create('Hello', '')
+        self._create('Hello', '')
+        
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 2)
+    
+    def test_sent_message_cache_round_trip(self):
+        """Remembered sends are found again by temp_id"""
+        async_to_sync(self.consumer.remember_sent_message)('temp-2', {'id': 7})
+        
+        self.assertEqual(async_to_sync(self.consumer.get_sent_message)('temp-2'), {'id': 7})
+        self.assertIsNone(async_to_sync(self.consumer.get_sent_message)('temp-3'))
+
+
+class ConnectionDrainerTestCase(TestCase):
+    """Test graceful connection draining"""
+    
+    class FakeConsumer:
+        def __init__(self):
+            self.frames = []
+            self.closed_at = None
+            self.close_code = None
+        
+        async def send(self, text_data):
+            self.frames.append(json.loads(text_data))
+        
+        async def close(self, code=None):
+            self.closed_at = asyncio.get_running_loop().time()
+            self.close_code = code
+    
+    def test_reconnects_are_spread_over_waves(self):
+        """Clients are told to reconnect at staggered times and closed in waves"""
+        from .draining import ConnectionDrainer, DRAIN_CLOSE_CODE
+        drainer = ConnectionDrainer(period=0.4, waves=4, jitter=0.05)
+        consumers = [self.FakeConsumer() for _ in range(100)]
+        for consumer in consumers:
+            drainer.consumers.add(consumer)
+        
+        async def run_drain():
+            started = asyncio.get_running_loop().time()
+            await drainer.drain()
+            return started
+        
+        started = async_to_sync(run_drain)()
+        
+        self.assertTrue(drainer.draining)
+        self.assertEqual(drainer.consumers, set())
+        
+        # Reconnect curve: no more than one wave's share in any 100ms bucket
+        buckets = {}
+        for consumer in consumers:
+            frame = consumer.frames[0]
+            self.assertEqual(frame['type'], 'reconnect')
+            self.assertEqual(consumer.close_code, DRAIN_CLOSE_CODE)
+            # Nobody is told to come back before their socket is closed
+            close_offset_ms = (consumer.closed_at - started) * 1000
+            self.assertGreaterEqual(frame['reconnect_after_ms'] + 20, close_offset_ms)
+            bucket = frame['reconnect_after_ms'] // 100
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+        
+        self.assertGreaterEqual(len(buckets), 4)
+        self.assertLessEqual(max(buckets.values()), 25)
+
+
+class LoadTestClientTestCase(TestCase):
+    """Test the load test WebSocket client and statistics"""
+    
+    class FakeWriter:
+        def __init__(self):
+            self.data = b''
+            self.closed = False
+        
+        def write(self, data):
+            self.data += data
+        
+        async def drain(self):
+            pass
+        
+        def close(self):
+            self.closed = True
+    
+    @staticmethod
+    def server_frame(opcode, payload, fin=True):
+        """Unmasked frame as a server sends it"""
+        import struct
+        first = (0x80 if fin else 0) | opcode
+        if len(payload) < 126:
+            header = struct.pack('!BB', first, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack('!BBH', first, 126, len(payload))
+        else:
+            header = struct.pack('!BBQ', first, 127, len(payload))
+        return header + payload
+    
+    @staticmethod
+    def read_client_frames(data):
+        """(opcode, payload) of masked client frames, checking the mask bit"""
+        import struct
+        frames = []
+        while data:
+            opcode, length = data[0] & 0x0F, data[1]
+            assert length & 0x80, 'client frames must be masked'
+            length &= 0x7F
+            offset = 2
+            if length == 126:
+                length = struct.unpack('!H', data[2:4])[0]
+                offset = 4
+            elif length == 127:
+                length = struct.unpack('!Q', data[2:10])[0]
+                offset = 10
+            mask, payload = data[offset:offset + 4], data[offset + 4:offset + 4 + length]
+            frames.append((opcode, bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))))
+            data = data[offset + 4 + length:]
+        return frames
+    
+    def receive(self, *frames, eof=True):
+        """Feed server frames to a connection; returns it with every text received"""
+        from .loadtest import WebSocketConnection
+        
+        async def run():
+            reader = asyncio.StreamReader()
+            for frame in frames:
+                reader.feed_data(frame)
+            if eof:
+                reader.feed_eof()
+            connection = WebSocketConnection(reader, self.FakeWriter())
+            texts = []
+            while True:
+                text = await connection.recv()
+                if text is None:
+                    return connection, texts
+                texts.append(text)
+        
+        return async_to_sync(run)()
+    
+    def test_client_frames_are_masked(self):
+        """Each length form round-trips through the mask"""
+        from .loadtest import WebSocketConnection
+        for size in (0, 125, 126, 65535, 65536):
+            payload = bytes(index % 251 for index in range(size))
+            frame = WebSocketConnection._frame(0x1, payload)
+            self.assertEqual(frame[0], 0x81)
+            self.assertEqual(self.read_client_frames(frame), [(0x1, payload)])
+    
+    def test_recv_length_forms(self):
+        """Short, 16-bit and 64-bit lengths and fragments are reassembled"""
+        texts = ['a' * 125, 'b' * 126, 'c' * 70000]
+        connection, received = self.receive(
+            *[self.server_frame(0x1, text.encode()) for text in texts],
+            self.server_frame(0x1, 'hola '.encode(), fin=False),
+            self.server_frame(0x0, 'ñandú'.encode())
+        )
+        self.assertEqual(received, texts + ['hola ñandú'])
+        self.assertEqual(connection.close_code, 1006)
+    
+    def test_ping_is_answered(self):
+        """Pings are answered with a masked pong carrying the same payload"""
+        connection, received = self.receive(
+            self.server_frame(0x9, b'beat'),
+            self.server_frame(0x1, b'{}')
+        )
+        self.assertEqual(received, ['{}'])
+        self.assertEqual(self.read_client_frames(connection.writer.data), [(0xA, b'beat')])
+    
+    def test_close_codes(self):
+        """Close frames are echoed; missing codes and dropped sockets are told apart"""
+        import struct
+        connection, _ = self.receive(self.server_frame(0x8, struct.pack('!H', 4000) + b'draining'))
+        self.assertEqual(connection.close_code, 4000)
+        self.assertTrue(connection.writer.closed)
+        self.assertEqual(self.read_client_frames(connection.writer.data), [(0x8, struct.pack('!H', 4000))])
+        
+        connection, _ = self.receive(self.server_frame(0x8, b''))
+        self.assertEqual(connection.close_code, 1005)
+        
+        # Truncated mid-frame
+        connection, _ = self.receive(self.server_frame(0x1, b'partial')[:4])
+        self.assertEqual(connection.close_code, 1006)
+    
+    def test_percentile(self):
+        """Nearest-rank percentiles, with nothing to report for no samples"""
+        from .loadtest import percentile
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([0.2], 1), 0.2)
+        self.assertEqual(percentile([0.2], 99), 0.2)
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+    
+    def test_histogram(self):
+        """Offsets are counted per bucket in order"""
+        from .loadtest import LoadTestStats
+        self.assertEqual(LoadTestStats.histogram([]), {})
+        self.assertEqual(LoadTestStats.histogram([0.4]), {0: 1})
+        self.assertEqual(LoadTestStats.histogram([2.5, 0.1, 0.9, 1.0], 1.0), {0: 2, 1: 1, 2: 1})
+        self.assertEqual(LoadTestStats.histogram([0.05, 0.15, 0.25], 0.1), {0: 1, 1: 1, 2: 1})
+        
+        summary = LoadTestStats().summary()
+        self.assertEqual(summary['connections'], 0)
+        self.assertIsNone(summary['rtt_p99_ms'])
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ConversationStateTestCase(APITestCase):
+    """Test denormalized per-participant conversation state"""
+    
+    def setUp(self):
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+    
+    def _state(self, user):
+        return ConversationParticipantState.objects.get(
+            conversation=self.conversation, user=user
+        )
+    
+    def _send(self, sender, content='Hello'):
+        return Message.objects.create(
+            conversation=self.conversation, sender=sender, content=content
+        )
+    
+    def test_new_messages_update_states(self):
+        """Creating messages updates counters for every participant"""
+        self._send(self.alice)
+        last = self._send(self.alice)
+        
+        bob_state = self._state(self.bob)
+        self.assertEqual(bob_state.unread_count, 2)
+        self.assertEqual(bob_state.message_count, 2)
+        self.assertEqual(bob_state.last_message_id, last.id)
+        self.assertEqual(bob_state.last_activity, last.created_at)
+        
+        alice_state = self._state(self.alice)
+        self.assertEqual(alice_state.unread_count, 0)
+        self.assertEqual(alice_state.last_read_message_id, last.id)
+    
+    def test_mark_read_updates_state(self):
+        """Reading messages resets the unread counter and read pointer"""
+        from .services.conversation_state import ConversationStateService
+        first = self._send(self.alice)
+        last = self._send(self.alice)
+        
+        ConversationStateService.mark_read(self.conversation.id, self.bob, up_to=first)
+        state = self._state(self.bob)
+        self.assertEqual(state.unread_count, 1)
+        self.assertEqual(state.last_read_message_id, first.id)
+        
+        self.assertEqual(self.conversation.mark_messages_as_read(self.bob), 1)
+        state = self._state(self.bob)
+        self.assertEqual(state.unread_count, 0)
+        self.assertEqual(state.last_read_message_id, last.id)
+    
+    def test_inbox_uses_state(self):
+        """The inbox is ordered by activity and reports state counters"""
+        quiet = Conversation.objects.create()
+        quiet.participants.add(self.alice, self.bob)
+        self._send(self.alice)
+        
+        self.client.force_authenticate(user=self.bob)
+        response = self.client.get('/api/messages/conversations/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data.get('results', response.data)
+        self.assertEqual([row['id'] for row in results], [self.conversation.id, quiet.id])
+        self.assertEqual(results[0]['unread_count'], 1)
+        self.assertEqual(results[0]['message_count'], 1)
+    
+    def test_refresh_repairs_drift(self):
+        """Refreshing recomputes counters from the messages table"""
+        from .services.conversation_state import ConversationStateService
+        self._send(self.alice)
+        ConversationParticipantState.objects.update(unread_count=0, message_count=0)
+        
+        ConversationStateService.refresh([self.conversation.id])
+        
+        state = self._state(self.bob)
+        self.assertEqual(state.unread_count, 1)
+        self.assertEqual(state.message_count, 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ConversationListQueryTestCase(APITestCase):
+    """Test the conversation list loads in a fixed number of queries"""
+    
+    def setUp(self):
+        self.student = User.objects.create_user(
+            username='student2',
+            email='student2@test.com',
+            user_type='student'
+        )
+    
+    def _create_conversations(self, count):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._create_conversations_in_transaction(count)
+    
+    def _create_conversations_in_transaction(self, count):
+        for index in range(count):
+            owner = User.objects.create_user(
+                username=f'owner_{self._offset + index}',
+                email=f'owner_{self._offset + index}@test.com',
+                user_type='property_owner'
+            )
+            property_obj = Property.objects.create(
+                title=f'Property {index}',
+                owner=owner,
+                rent_amount=5000,
+                deposit_amount=5000,
+                available_from=timezone.now().date(),
+                bedrooms=2,
+                bathrooms=1,
+                total_area=80,
+                is_active=True
+            )
+            conversation = Conversation.objects.create(property=property_obj)
+            conversation.participants.add(self.student, owner)
+            Message.objects.create(conversation=conversation, sender=owner, content='Hi there')
+        self._offset += count
+    
+    def _count_list_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        self.client.force_authenticate(user=self.student)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/messages/conversations/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context), response.data['results']
+    
+    def test_query_count_is_independent_of_page_size(self):
+        """Listing more conversations does not add queries"""
+        self._offset = 0
+        self._create_conversations(2)
+        small_count, small_page = self._count_list_queries()
+        
+        self._create_conversations(6)
+        large_count, large_page = self._count_list_queries()
+        
+        self.assertEqual(len(small_page), 2)
+        self.assertEqual(len(large_page), 8)
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(large_page[0]['latest_message']['content'], 'Hi there')
+        self.assertEqual(large_page[0]['other_participant']['user_type'], 'property_owner')
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ConversationListCacheTestCase(APITestCase):
+    """Test conversation lists are cached behind version counters"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation = Conversation.objects.create()
+            self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(user=self.bob)
+    
+    def _list(self):
+        response = self.client.get('/api/messages/conversations/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+    
+    def test_list_is_served_from_cache(self):
+        """A repeated request does not touch the database"""
+        self._list()
+        with self.assertNumQueries(0):
+            self._list()
+    
+    def test_new_message_invalidates_participants(self):
+        """Sending a message bumps the participants' versions"""
+        self.assertEqual(self._list()[0]['unread_count'], 0)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content='Hi')
+        
+        results = self._list()
+        self.assertEqual(results[0]['unread_count'], 1)
+        self.assertEqual(results[0]['latest_message']['content'], 'Hi')
+    
+    def test_reading_invalidates_reader(self):
+        """Marking messages read refreshes the reader's list"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content='Hi')
+        self.assertEqual(self._list()[0]['unread_count'], 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation.mark_messages_as_read(self.bob)
+        
+        self.assertEqual(self._list()[0]['unread_count'], 0)
+    
+    def test_bump_during_query_is_not_cached_as_fresh(self):
+        """A list computed before a bump is stored under the old version"""
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .cache import MessageCache
+        store = MessageCache.set_user_conversations
+        
+        def bump_then_store(cache_key, conversations):
+            MessageCache.bump_version('user', self.bob.id)
+            store(cache_key, conversations)
+        
+        with mock.patch.object(MessageCache, 'set_user_conversations', side_effect=bump_then_store):
+            self._list()
+        
+        with CaptureQueriesContext(connection) as context:
+            self._list()
+        self.assertGreater(len(context), 0)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ConversationStatsTestCase(APITestCase):
+    """Test conversation stats are aggregated in the database"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(user=self.bob)
+    
+    def _send(self, sender, count):
+        for index in range(count):
+            Message.objects.create(conversation=self.conversation, sender=sender, content=f'Message {index}')
+    
+    def _stats(self):
+        from django.core.cache import cache
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/messages/conversations/{self.conversation.id}/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context), response.data
+    
+    def test_stats_values(self):
+        """Totals and per-sender activity match the messages"""
+        self._send(self.alice, 3)
+        self._send(self.bob, 2)
+        
+        _, stats = self._stats()
+        
+        self.assertEqual(stats['total_messages'], 5)
+        self.assertEqual(stats['unread_count'], 3)
+        self.assertEqual(stats['participant_count'], 2)
+        self.assertEqual(stats['participant_activity'][str(self.alice.id)]['message_count'], 3)
+        self.assertEqual(stats['participant_activity'][str(self.bob.id)]['message_count'], 2)
+        self.assertEqual(
+            stats['participant_activity'][str(self.bob.id)]['last_message'],
+            Message.objects.filter(sender=self.bob).latest('created_at').created_at
+        )
+    
+    def test_query_count_is_independent_of_message_count(self):
+        """Longer conversations do not add queries"""
+        self._send(self.alice, 2)
+        small_count, _ = self._stats()
+        
+        self._send(self.alice, 20)
+        large_count, stats = self._stats()
+        
+        self.assertEqual(stats['total_messages'], 22)
+        self.assertEqual(small_count, large_count)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class MessageSearchTestCase(APITestCase):
+    """Test full-text message search"""
+    
+    def setUp(self):
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.eve = User.objects.create_user(
+            username='eve',
+            email='eve@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.private = Conversation.objects.create()
+        self.private.participants.add(self.alice, self.eve)
+    
+    def _send(self, conversation, content, sender=None):
+        return Message.objects.create(
+            conversation=conversation, sender=sender or self.alice, content=content
+        )
+    
+    def _search(self, user, **params):
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/messages/conversations/search/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+    
+    def test_matches_english_and_spanish_stems(self):
+        """Both configurations stem the query and the content"""
+        english = self._send(self.conversation, 'Is the apartment still available?')
+        spanish = self._send(self.conversation, 'Me interesan los departamentos cerca de la universidad')
+        
+        results = self._search(self.bob, q='apartments')['results']
+        self.assertEqual([row['id'] for row in results], [english.id])
+        self.assertIn('<mark>', results[0]['snippet'])
+        
+        results = self._search(self.bob, q='departamento')['results']
+        self.assertEqual([row['id'] for row in results], [spanish.id])
+    
+    def test_respects_participant_access(self):
+        """Users only find messages in their own conversations"""
+        self._send(self.private, 'The deposit is negotiable')
+        
+        self.assertEqual(self._search(self.bob, q='deposit')['results'], [])
+        self.assertEqual(len(self._search(self.eve, q='deposit')['results']), 1)
+        
+        self.client.force_authenticate(user=self.bob)
+        response = self.client.get(
+            f'/api/messages/conversations/{self.private.id}/messages/search/', {'q': 'deposit'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+    
+    def test_keyset_pagination(self):
+        """Pages follow (rank, id) without gaps or repeats"""
+        sent = {self._send(self.conversation, f'Rent question number {index}').id for index in range(5)}
+        
+        seen, cursor = [], None
+        while True:
+            params = {'q': 'rent', 'page_size': 2}
+            if cursor:
+                params['cursor'] = cursor
+            page = self._search(self.bob, **params)
+            seen.extend(row['id'] for row in page['results'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), sent)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ConversationContextCacheTestCase(TestCase):
+    """Test the rolling context buffer used by content filtering"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+    
+    def _send(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content=content)
+    
+    def test_buffer_is_appended_and_trimmed(self):
+        """Sends append to a warm buffer without touching the database"""
+        from .cache import ConversationContextCache
+        for index in range(3):
+            self._send(f'Old message {index}')
+        
+        self.assertEqual(
+            ConversationContextCache.get_context(self.conversation.id),
+            ['old message 0', 'old message 1', 'old message 2']
+        )
+        
+        for index in range(4):
+            self._send(f'New   Message {index}')
+        
+        with self.assertNumQueries(0):
+            context = ConversationContextCache.get_context(self.conversation.id)
+        self.assertEqual(context, [
+            'old message 2', 'new message 0', 'new message 1', 'new message 2', 'new message 3'
+        ])
+    
+    def test_appends_claim_their_own_slots(self):
+        """Appends never overwrite each other and refills keep later slots"""
+        from django.core.cache import cache
+        from .cache import ConversationContextCache
+        self._send('First')
+        ConversationContextCache.get_context(self.conversation.id)
+        self._send('Second')
+        self._send('Third')
+        
+        # An evicted slot is refilled from the database
+        cache.delete(ConversationContextCache._slot_key(self.conversation.id, 1))
+        self.assertEqual(
+            ConversationContextCache.get_context(self.conversation.id), ['first', 'second', 'third']
+        )
+        
+        self._send('Fourth')
+        with self.assertNumQueries(0):
+            context = ConversationContextCache.get_context(self.conversation.id)
+        self.assertEqual(context, ['first', 'second', 'third', 'fourth'])
+    
+    def test_websocket_filter_uses_shared_context(self):
+        """Contact setup in an earlier message makes digit groups suspicious"""
+        from .consumers import ChatConsumer
+        self._send('Call me later tonight')
+        
+        consumer = ChatConsumer()
+        consumer.conversation_id = self.conversation.id
+        result = consumer._analyze_with_context('it is 555 1234')
+        
+        self.assertIn('suspicious_pattern', [v['type'] for v in result['violations']])
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class UnreadCounterTestCase(APITestCase):
+    """Test the global unread badge counter"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversations = []
+        for _ in range(2):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.alice, self.bob)
+            self.conversations.append(conversation)
+    
+    def _send(self, conversation, sender):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=conversation, sender=sender, content='Hi')
+    
+    def test_counter_follows_sends_and_reads(self):
+        """Sends increment and reads decrement without recounting"""
+        from .services.unread_counter import UnreadCounterService
+        self.assertEqual(UnreadCounterService.get_total(self.bob.id), 0)
+        
+        self._send(self.conversations[0], self.alice)
+        self._send(self.conversations[1], self.alice)
+        self._send(self.conversations[1], self.bob)
+        
+        with self.assertNumQueries(0):
+            self.assertEqual(UnreadCounterService.get_total(self.bob.id), 2)
+        self.assertEqual(UnreadCounterService.get_total(self.alice.id), 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversations[1].mark_messages_as_read(self.bob)
+        self.assertEqual(UnreadCounterService.get_total(self.bob.id), 1)
+        
+        self.client.force_authenticate(user=self.bob)
+        response = self.client.get('/api/messages/conversations/unread-total/')
+        self.assertEqual(response.data['unread_count'], 1)
+    
+    def test_reads_follow_participant_state(self):
+        """Reads subtract the change in the reader's own unread count"""
+        from .services.unread_counter import UnreadCounterService
+        self._send(self.conversations[0], self.alice)
+        self._send(self.conversations[1], self.alice)
+        self._send(self.conversations[1], self.alice)
+        ConversationParticipantState.objects.filter(
+            conversation=self.conversations[1], user=self.bob
+        ).update(unread_count=1)
+        UnreadCounterService.reconcile(self.bob.id)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversations[1].mark_messages_as_read(self.bob)
+        self.assertEqual(UnreadCounterService.get_total(self.bob.id), 1)
+    
+    def test_missing_counter_is_reconciled(self):
+        """An expired counter is rebuilt from participant state"""
+        from .cache import UnreadCounterCache
+        from .services.unread_counter import UnreadCounterService
+        self._send(self.conversations[0], self.alice)
+        UnreadCounterCache.set(self.bob.id, -3)
+        
+        self.assertEqual(UnreadCounterService.get_total(self.bob.id), 1)
+        
+        UnreadCounterCache.delete_many([self.bob.id])
+        self._send(self.conversations[1], self.alice)
+        self.assertEqual(UnreadCounterCache.get(self.bob.id), 2)
+    
+    def test_changes_are_pushed_to_list_sockets(self):
+        """The user's conversation list group receives the new total"""
+        from channels.layers import get_channel_layer
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'conversations_user_{self.bob.id}', channel)
+        
+        self._send(self.conversations[0], self.alice)
+        
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['type'], 'unread_count_update')
+        self.assertEqual(event['unread_count'], 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class AttachmentUploadTestCase(APITestCase):
+    """Test chunked attachment uploads"""
+    
+    def setUp(self):
+        import shutil
+        import tempfile
+        from unittest import mock
+        from .attachments import AttachmentUploadService
+        
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        
+        chunk_size = mock.patch.object(AttachmentUploadService, 'CHUNK_SIZE', 256)
+        chunk_size.start()
+        self.addCleanup(chunk_size.stop)
+        
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(user=self.alice)
+        self.base_url = f'/api/messages/conversations/{self.conversation.id}/uploads/'
+    
+    def _png(self):
+        import io
+        import random
+        from PIL import Image
+        image = Image.new('RGB', (64, 48))
+        image.putdata([tuple(random.randrange(256) for _ in range(3)) for _ in range(64 * 48)])
+        output = io.BytesIO()
+        image.save(output, format='PNG')
+        return output.getvalue()
+    
+    def _upload(self, data, chunk_order=None):
+        response = self.client.post(self.base_url, {'filename': 'photo.png', 'size': len(data)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        session = response.data
+        
+        size = session['chunk_size']
+        for index in chunk_order or range(session['chunk_count']):
+            response = self.client.put(
+                f"{self.base_url}{session['id']}/chunks/{index}/",
+                data[index * size:(index + 1) * size],
+                content_type='application/octet-stream'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return session
+    
+    def test_chunked_upload_is_processed_and_attached(self):
+        """Chunks in any order are assembled, thumbnailed and attachable"""
+        from .attachments import AttachmentProcessor
+        from .models import AttachmentUpload
+        data = self._png()
+        session = self._upload(data)
+        chunk_count = session['chunk_count']
+        self.assertGreater(chunk_count, 2)
+        
+        response = self.client.post(f"{self.base_url}{session['id']}/complete/")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], 'processing')
+        self.assertEqual(response.data['content_type'], 'image/png')
+        
+        self.assertEqual(AttachmentProcessor().run_once()['processed'], 1)
+        upload = AttachmentUpload.objects.get(pk=session['id'])
+        self.assertEqual(upload.status, 'ready')
+        with upload.file.open('rb') as assembled:
+            self.assertEqual(assembled.read(), data)
+        self.assertTrue(upload.thumbnail)
+        
+        response = self.client.post(
+            f'/api/messages/conversations/{self.conversation.id}/messages/',
+            {'content': 'Here is the photo', 'upload_id': session['id']},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['attachment_type'], 'image/png')
+        self.assertIsNotNone(response.data['attachment_thumbnail'])
+        
+        # An upload belongs to one message
+        response = self.client.post(
+            f'/api/messages/conversations/{self.conversation.id}/messages/',
+            {'content': 'Again', 'upload_id': session['id']},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_resume_and_wrong_sizes(self):
+        """Missing chunks block completion and chunk sizes are enforced"""
+        data = self._png()
+        session = self._upload(data, chunk_order=[0])
+        
+        response = self.client.post(f"{self.base_url}{session['id']}/complete/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        response = self.client.put(
+            f"{self.base_url}{session['id']}/chunks/1/",
+            b'short',
+            content_type='application/octet-stream'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        response = self.client.get(f"{self.base_url}{session['id']}/")
+        self.assertEqual(response.data['received_chunks'], [0])
+    
+    def test_magic_bytes_are_verified(self):
+        """Declared names and headers do not decide the content type"""
+        from .attachments import AttachmentProcessor
+        from .models import AttachmentUpload
+        
+        session = self._upload(b'MZ' + b'\x00' * 300)
+        response = self.client.post(f"{self.base_url}{session['id']}/complete/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(AttachmentUpload.objects.get(pk=session['id']).status, 'failed')
+        
+        # PNG signature but not an image
+        session = self._upload(b'\x89PNG\r\n\x1a\n' + b'\x00' * 300)
+        self.client.post(f"{self.base_url}{session['id']}/complete/")
+        self.assertEqual(AttachmentProcessor().run_once()['failed'], 1)
+        self.assertEqual(AttachmentUpload.objects.get(pk=session['id']).status, 'failed')
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class MessagePaginationTestCase(APITestCase):
+    """Test keyset pagination over (created_at, id)"""
+    
+    def setUp(self):
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.url = f'/api/messages/conversations/{self.conversation.id}/messages/'
+        
+        # Identical timestamps, as produced by bulk inserts
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content=f'Message {index}')
+            for index in range(7)
+        ]
+        Message.objects.filter(id__in=[m.id for m in self.messages[1:6]]).update(
+            created_at=self.messages[1].created_at
+        )
+        self.newest_first = list(
+            Message.objects.filter(conversation=self.conversation)
+            .order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.client.force_authenticate(user=self.bob)
+    
+    def _get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+    
+    def test_pages_do_not_skip_or_repeat_ties(self):
+        """Walking forward and back visits each message exactly once"""
+        pages, data = [], self._get(self.url, {'page_size': 3})
+        while True:
+            pages.append([row['id'] for row in data['results']])
+            if not data['next']:
+                break
+            data = self._get(data['next'])
+        
+        self.assertEqual([i for page in pages for i in page], self.newest_first)
+        
+        # Back from the last page
+        data = self._get(data['previous'])
+        self.assertEqual([row['id'] for row in data['results']], pages[-2])
+    
+    def test_around_message(self):
+        """around= centers the page on a message"""
+        target = self.newest_first[3]
+        data = self._get(self.url, {'around': target, 'page_size': 2})
+        
+        self.assertEqual([row['id'] for row in data['results']], self.newest_first[1:6])
+        self.assertTrue(data['has_next'])
+        self.assertTrue(data['has_previous'])
+        
+        older = self._get(data['next'])
+        self.assertEqual([row['id'] for row in older['results']], self.newest_first[6:])
+        newer = self._get(data['previous'])
+        self.assertEqual([row['id'] for row in newer['results']], self.newest_first[:1])
+        
+        response = self.client.get(self.url, {'around': 999999})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ConditionalGetTestCase(APITestCase):
+    """Test ETag/304 responses for polled lists"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation = Conversation.objects.create()
+            self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(user=self.bob)
+    
+    def _send(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content='Hi')
+    
+    def _assert_revalidates(self, url, max_queries):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        
+        with self.assertNumQueries(max_queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        
+        self._send()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_conversation_list(self):
+        """Unchanged conversation lists cost no queries"""
+        self._assert_revalidates('/api/messages/conversations/', 0)
+    
+    def test_message_list(self):
+        """Unchanged message lists cost only the access check"""
+        self._send()
+        self._assert_revalidates(f'/api/messages/conversations/{self.conversation.id}/messages/', 1)
+    
+    def test_hard_delete_changes_etag(self):
+        """Deleting a message invalidates polls and recounts the inbox"""
+        self._send()
+        url = f'/api/messages/conversations/{self.conversation.id}/messages/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        message = Message.objects.get()
+        
+        self.client.force_authenticate(user=self.alice)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete(f'{url}{message.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        
+        self.client.force_authenticate(user=self.bob)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+        state = ConversationParticipantState.objects.get(conversation=self.conversation, user=self.bob)
+        self.assertEqual((state.message_count, state.unread_count, state.last_message_id), (0, 0, None))
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class MessageTemplateCacheTestCase(APITestCase):
+    """Test cached template payloads and buffered usage counts"""
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from .cache import TemplateCache
+        cache.clear()
+        TemplateCache.invalidate()
+        self.user = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template = MessageTemplate.objects.create(
+                template_type='ask_amenities',
+                title='Amenities',
+                title_es='Amenidades',
+                content='Which amenities are included?',
+                content_es='¿Qué amenidades incluye?'
+            )
+        self.client.force_authenticate(user=self.user)
+    
+    def _list(self, **params):
+        response = self.client.get('/api/messages/templates/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+    
+    def test_payload_is_cached_per_language(self):
+        """Repeated listings are served without queries"""
+        self.assertEqual(self._list(lang='es')[0]['localized_content']['title'], 'Amenidades')
+        self.assertEqual(self._list(lang='en')[0]['localized_content']['title'], 'Amenities')
+        
+        with self.assertNumQueries(0):
+            self._list(lang='es')
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.template.title_es = 'Servicios'
+            self.template.save()
+        self.assertEqual(self._list(lang='es')[0]['localized_content']['title'], 'Servicios')
+    
+    def test_usage_is_buffered(self):
+        """Tracking usage keeps the cache and flushes counts in bulk"""
+        from .cache import TemplateUsageBuffer
+        self._list()
+        
+        for _ in range(3):
+            response = self.client.post(f'/api/messages/templates/{self.template.id}/track-usage/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        with self.assertNumQueries(0):
+            self._list()
+        
+        # Nothing is written until the flush runs
+        self.template.refresh_from_db()
+        self.assertEqual(self.template.usage_count, 0)
+        with self.assertNumQueries(2):
+            self.assertEqual(TemplateUsageBuffer.flush(), 3)
+        self.template.refresh_from_db()
+        self.assertEqual(self.template.usage_count, 3)
+        self.assertIsNotNone(self.template.last_used)
+        self.assertEqual(TemplateUsageBuffer.flush(), 0)
+    
+    def test_flush_keeps_last_used_without_timestamp(self):
+        """An evicted timestamp does not clear last_used"""
+        from .cache import TemplateUsageBuffer
+        last_used = timezone.now() - timedelta(days=1)
+        MessageTemplate.objects.filter(pk=self.template.pk).update(last_used=last_used)
+        TemplateUsageBuffer.record(self.template.id)
+        TemplateUsageBuffer.record(self.template.id)
+        
+        cache.delete(TemplateUsageBuffer._last_used_key(self.template.id))
+        self.assertEqual(TemplateUsageBuffer.flush(), 2)
+        self.template.refresh_from_db()
+        self.assertEqual(self.template.usage_count, 2)
+        self.assertEqual(self.template.last_used, last_used)
+    
+    def test_flush_survives_evicted_count(self):
+        """A count evicted mid-flush is not an error"""
+        from unittest import mock
+        from .cache import TemplateUsageBuffer
+        TemplateUsageBuffer.record(self.template.id)
+        
+        with mock.patch.object(cache, 'decr', side_effect=ValueError):
+            self.assertEqual(TemplateUsageBuffer.flush(), 1)
+        self.template.refresh_from_db()
+        self.assertEqual(self.template.usage_count, 1)
+    
+    def test_unknown_filters_are_rejected(self):
+        """Only filter values from the model choices reach the cache"""
+        from .cache import TemplateCache
+        for params in ({'type': 'nope'}, {'property_type': 'castle'}):
+            response = self.client.get('/api/messages/templates/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(TemplateCache._local), 0)
+        
+        self.assertEqual(len(self._list(type='ask_amenities')), 1)
+    
+    def test_local_tier_is_bounded(self):
+        """The in-process tier drops its least recently used entries"""
+        from unittest import mock
+        from .cache import TemplateCache
+        with mock.patch.object(TemplateCache, 'LOCAL_MAX_ENTRIES', 2):
+            TemplateCache.set('a', '', 'en', [1])
+            TemplateCache.set('b', '', 'en', [2])
+            TemplateCache.get('a', '', 'en')
+            TemplateCache.set('c', '', 'en', [3])
+        
+        self.assertEqual(list(TemplateCache._local), ['a::en', 'c::en'])
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class DeltaSyncTestCase(APITestCase):
+    """Test the change log behind conversation delta sync"""
+    
+    def setUp(self):
+        from unittest import mock
+        from .services.change_log import ChangeLogService
+        cache.clear()
+        # Entries are normally withheld for a couple of seconds
+        patcher = mock.patch.object(ChangeLogService, 'SETTLE_SECONDS', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        self.client.force_authenticate(user=self.bob)
+        self.url = '/api/messages/conversations/sync/'
+        self.cursor = self.client.get(self.url).data['cursor']
+    
+    def _sync(self, **params):
+        response = self.client.get(self.url, {'cursor': self.cursor, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.cursor = response.data['cursor']
+        return response.data
+    
+    def test_reset_without_cursor(self):
+        """First syncs and unusable cursors ask for a full reload"""
+        self.assertTrue(self.client.get(self.url).data['reset'])
+        self.assertTrue(self.client.get(self.url, {'cursor': 'garbage'}).data['reset'])
+        
+        expired = f'0.{int((timezone.now() - timedelta(days=60)).timestamp())}'
+        self.assertTrue(self.client.get(self.url, {'cursor': expired}).data['reset'])
+    
+    def test_changes_since_cursor(self):
+        """New, edited and deleted messages come back as current state"""
+        kept = Message.objects.create(conversation=self.conversation, sender=self.alice, content='Hi')
+        removed = Message.objects.create(conversation=self.conversation, sender=self.alice, content='Oops')
+        kept.content = 'Hi Bob'
+        kept.save()
+        removed.is_deleted = True
+        removed.save()
+        
+        data = self._sync()
+        self.assertFalse(data['reset'])
+        self.assertFalse(data['has_more'])
+        self.assertEqual([m['content'] for m in data['messages']], ['Hi Bob'])
+        self.assertEqual(data['deleted_messages'], [removed.id])
+        self.assertEqual([c['id'] for c in data['conversations']], [self.conversation.id])
+        
+        # Nothing new since the returned cursor
+        data = self._sync()
+        self.assertEqual(data['messages'], [])
+        self.assertEqual(data['conversations'], [])
+    
+    def test_hard_deletes_are_logged(self):
+        """Destroyed and bulk-deleted messages come back as deleted"""
+        from .models import ConversationChange
+        first, second, third = [
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content=f'M{i}')
+            for i in range(3)
+        ]
+        self.cursor = self._sync()['cursor']
+        
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.delete(
+            f'/api/messages/conversations/{self.conversation.id}/messages/{first.id}/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.client.force_authenticate(user=self.bob)
+        
+        from .services.change_log import ChangeLogService
+        with ChangeLogService.collect_deletions():
+            Message.objects.filter(id__in=[second.id, third.id]).delete()
+        
+        data = self._sync()
+        self.assertEqual(data['deleted_messages'], sorted([first.id, second.id, third.id]))
+        self.assertEqual(
+            ConversationChange.objects.filter(kind='message_deleted', message_id=first.id).count(), 2
+        )
+    
+    def test_reads_do_not_log_message_updates(self):
+        """Marking a message read logs messages_read only"""
+        from .models import ConversationChange
+        message = Message.objects.create(conversation=self.conversation, sender=self.alice, content='Hi')
+        ConversationChange.objects.all().delete()
+        
+        response = self.client.patch(
+            f'/api/messages/conversations/{self.conversation.id}/messages/{message.id}/mark-read/'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(ConversationChange.objects.values_list('kind', flat=True)), {'messages_read'})
+    
+    def test_removed_history_resets(self):
+        """Dropped partitions make the next sync a reset"""
+        from .services.change_log import ChangeLogService
+        Message.objects.create(conversation=self.conversation, sender=self.alice, content='Hi')
+        ChangeLogService.record_many([self.conversation.id], 'history_removed')
+        
+        data = self._sync()
+        self.assertTrue(data['reset'])
+        self.assertFalse(self._sync()['reset'])
+    
+    def test_read_receipts_and_paging(self):
+        """Reads by other participants sync, and limit pages through the log"""
+        from .services.conversation_state import ConversationStateService
+        self.client.force_authenticate(user=self.alice)
+        self.cursor = self.client.get(self.url).data['cursor']
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content=f'M{i}')
+        ConversationStateService.mark_read(self.conversation.id, self.bob)
+        
+        data = self._sync(limit=2)
+        self.assertTrue(data['has_more'])
+        self.assertEqual(len(data['messages']), 2)
+        
+        data = self._sync(limit=2)
+        self.assertFalse(data['has_more'])
+        self.assertEqual(len(data['messages']), 1)
+        bob_state = next(s for s in data['read_states'] if s['user_id'] == self.bob.id)
+        self.assertEqual(bob_state['last_read_message_id'], data['messages'][0]['id'])
+    
+    def test_removed_participant(self):
+        """Users removed from a conversation are told to drop it"""
+        self.conversation.participants.remove(self.bob)
+        data = self._sync()
+        self.assertEqual(data['removed_conversations'], [self.conversation.id])
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class MessagePartitionTestCase(TestCase):
+    """Test monthly partitioning of the messages table"""
+    
+    def setUp(self):
+        from .partitions import MessagePartitionManager
+        self.manager = MessagePartitionManager()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        
+        self.old = Message.objects.create(conversation=self.conversation, sender=self.alice, content='Old')
+        self.old_month = self.manager.month_start(timezone.now() - timedelta(days=800))
+        Message.objects.filter(id=self.old.id).update(created_at=self.manager.bound(self.old_month))
+        self.recent = Message.objects.create(conversation=self.conversation, sender=self.bob, content='New')
+        
+        self.manager.convert(months_ahead=2, drop_foreign_keys=True)
+    
+    def test_convert(self):
+        """Rows are copied into monthly partitions and inserts keep working"""
+        self.assertTrue(self.manager.is_partitioned())
+        partitions = self.manager.partitions()
+        self.assertIn(self.old_month, partitions)
+        self.assertIn(self.manager.month_start(timezone.now()), partitions)
+        
+        message = Message.objects.create(conversation=self.conversation, sender=self.alice, content='Hola')
+        self.assertGreater(message.id, self.recent.id)
+        self.assertEqual(Message.objects.filter(search_vector='hola').get(), message)
+        self.assertEqual(self.manager.ensure_partitions(months_ahead=2), [])
+    
+    def test_convert_keeps_unique_constraints(self):
+        """Sequence numbers stay unique and retried sends deduplicated"""
+        from django.db import IntegrityError, transaction
+        from .consumers import ChatConsumer
+        copy = Message.objects.create(conversation=self.conversation, sender=self.alice, content='Copy')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Message.objects.filter(pk=copy.pk).update(
+                sequence=self.recent.sequence,
+                created_at=self.recent.created_at
+            )
+        
+        consumer = ChatConsumer()
+        consumer.user = self.alice
+        consumer.conversation_id = self.conversation.id
+        create = ChatConsumer.create_message.__wrapped__
+        allow = {'action': 'allow', 'violations': []}
+        first, _ = create(consumer, 'Hola', {}, allow, 'temp-1')
+        retry, created = create(consumer, 'Hola', {}, allow, 'temp-1')
+        self.assertFalse(created)
+        self.assertEqual(retry, first)
+    
+    def test_convert_refuses_to_lose_integrity(self):
+        """Foreign keys are only dropped on request, unique indexes never"""
+        from django.db import connection
+        from .partitions import MessagePartitionError
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {self.manager.TABLE} RENAME TO messaging_message_old")
+            cursor.execute(
+                f"CREATE TABLE {self.manager.TABLE} (LIKE messaging_message_old INCLUDING DEFAULTS)"
+            )
+            cursor.execute(f"ALTER TABLE {self.manager.TABLE} ADD PRIMARY KEY (id)")
+            cursor.execute(
+                f"ALTER TABLE messaging_conversationflag ADD CONSTRAINT flag_message_fk "
+                f"FOREIGN KEY (message_id) REFERENCES {self.manager.TABLE} (id)"
+            )
+        
+        with self.assertRaisesMessage(MessagePartitionError, 'flag_message_fk'):
+            self.manager.convert()
+        
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE UNIQUE INDEX message_temp_id_idx ON {self.manager.TABLE} (sender_id, client_temp_id)"
+            )
+        with self.assertRaisesMessage(MessagePartitionError, 'message_temp_id_idx'):
+            self.manager.convert(drop_foreign_keys=True)
+    
+    def test_remove_expired_partition(self):
+        """Dropping a month clears pointers and recounts inboxes"""
+        ConversationParticipantState.objects.filter(user=self.bob).update(
+            last_read_message=self.old, unread_count=5
+        )
+        cutoff = timezone.now() - timedelta(days=730)
+        expired = self.manager.expired_partitions(cutoff)
+        self.assertIn(self.old_month, expired)
+        self.assertNotIn(self.manager.month_start(timezone.now()), expired)
+        
+        self.manager.remove_partition(expired[self.old_month])
+        
+        self.assertEqual(list(Message.objects.all()), [self.recent])
+        self.assertNotIn(self.old_month, self.manager.partitions())
+        state = ConversationParticipantState.objects.get(conversation=self.conversation, user=self.bob)
+        self.assertEqual(state.message_count, 1)
+        self.assertEqual(state.last_message_id, self.recent.id)
+        self.assertNotEqual(state.last_read_message_id, self.old.id)
+
+
+ARCHIVE_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'message_archive': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS, STORAGES=ARCHIVE_STORAGES)
+class MessageArchiveTestCase(APITestCase):
+    """Test moving archived conversations to cold storage"""
+    
+    def setUp(self):
+        from unittest import mock
+        from .archive import MessageArchiveService
+        cache.clear()
+        patcher = mock.patch.object(MessageArchiveService, 'SEGMENT_SIZE', 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create(status='archived')
+        self.conversation.participants.add(self.alice, self.bob)
+        self.url = f'/api/messages/conversations/{self.conversation.id}/messages/'
+        
+        start = timezone.now() - timedelta(days=400)
+        for index in range(8):
+            message = Message.objects.create(
+                conversation=self.conversation, sender=self.alice, content=f'Message {index}'
+            )
+            Message.objects.filter(id=message.id).update(created_at=start + timedelta(hours=index))
+        self.newest_first = list(
+            Message.objects.filter(conversation=self.conversation)
+            .order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        
+        self.archived = MessageArchiveService.archive_conversation(self.conversation.id)
+        self.client.force_authenticate(user=self.bob)
+    
+    def test_archive_conversation(self):
+        """All but the newest message move into indexed segments"""
+        from .models import MessageArchiveSegment
+        self.assertEqual(self.archived, 7)
+        self.assertEqual(
+            list(Message.objects.filter(conversation=self.conversation).values_list('id', flat=True)),
+            self.newest_first[:1]
+        )
+        segments = MessageArchiveSegment.objects.filter(conversation=self.conversation)
+        self.assertEqual(sorted(s.message_count for s in segments), [1, 3, 3])
+    
+    def test_history_pages_through_archive(self):
+        """Message pages continue seamlessly into archived messages"""
+        pages, data = [], self.client.get(self.url, {'page_size': 3}).data
+        while True:
+            pages.append([row['id'] for row in data['results']])
+            if not data['next']:
+                break
+            data = self.client.get(data['next']).data
+        
+        self.assertEqual([i for page in pages for i in page], self.newest_first)
+        self.assertEqual(data['results'][-1]['content'], 'Message 0')
+        
+        # Back towards the hot table
+        data = self.client.get(data['previous']).data
+        self.assertEqual([row['id'] for row in data['results']], pages[-2])
+    
+    def test_around_archived_message(self):
+        """around= finds messages that only exist in the archive"""
+        target = self.newest_first[4]
+        data = self.client.get(self.url, {'around': target, 'page_size': 1}).data
+        self.assertEqual([row['id'] for row in data['results']], self.newest_first[3:6])
+    
+    def test_get_with_ids_out_of_time_order(self):
+        """Archived messages are found by id even when ids do not follow created_at"""
+        from .archive import ArchivedHistory, MessageArchiveService
+        conversation = Conversation.objects.create(status='archived')
+        conversation.participants.add(self.alice, self.bob)
+        start = timezone.now() - timedelta(days=400)
+        ids = []
+        # Ids ascend while created_at alternates between early and late
+        for index in range(7):
+            message = Message.objects.create(
+                conversation=conversation, sender=self.alice, content=f'Backfill {index}'
+            )
+            offset = index if index % 2 else 100 - index
+            Message.objects.filter(id=message.id).update(created_at=start + timedelta(hours=offset))
+            ids.append(message.id)
+        Message.objects.create(conversation=conversation, sender=self.alice, content='Newest')
+        
+        self.assertEqual(MessageArchiveService.archive_conversation(conversation.id), 7)
+        history = ArchivedHistory(conversation.id)
+        for message_id in ids:
+            self.assertEqual(history.get(message_id).id, message_id)
+    
+    def test_deleting_segments_removes_files(self):
+        """Segment files go with their index entries"""
+        from .archive import MessageArchiveService
+        storage = MessageArchiveService.storage()
+        segment = self.conversation.archive_segments.first()
+        self.assertTrue(storage.exists(segment.path))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            segment.delete()
+        self.assertFalse(storage.exists(segment.path))
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ParticipantKeyTestCase(APITestCase):
+    """Test finding two-party conversations by participant_key"""
+    
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.url = '/api/messages/conversations/start/'
+    
+    def _start(self, user, other, message='Hi'):
+        self.client.force_authenticate(user=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'user_id': other.id, 'message': message})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+    
+    def test_key_is_order_independent(self):
+        """Either participant starting reuses the same conversation"""
+        first = self._start(self.alice, self.bob)
+        second = self._start(self.bob, self.alice, 'Hello back')
+        
+        self.assertEqual(first, second)
+        conversation = Conversation.objects.get()
+        self.assertEqual(
+            conversation.participant_key,
+            Conversation.build_participant_key([self.bob.id, self.alice.id])
+        )
+        self.assertEqual(set(conversation.participants.values_list('id', flat=True)), {self.alice.id, self.bob.id})
+        self.assertEqual(Message.objects.filter(conversation=conversation).count(), 2)
+    
+    def test_conflicting_insert_reuses_existing(self):
+        """An insert that loses the race picks up the winner's conversation"""
+        key = Conversation.build_participant_key([self.alice.id, self.bob.id])
+        existing = Conversation.objects.create(participant_key=key)
+        existing.participants.add(self.alice, self.bob)
+        
+        from unittest import mock
+        # Simulate the lookup missing a conversation committed concurrently
+        missed = mock.Mock()
+        missed.first.return_value = None
+        winner = Conversation.objects.filter(participant_key=key)
+        with mock.patch.object(Conversation.objects, 'filter', side_effect=[missed, winner]):
+            self.assertEqual(self._start(self.alice, self.bob), existing.id)
+        self.assertEqual(Conversation.objects.count(), 1)
+    
+    def test_serializer_create_is_keyed(self):
+        """Creating through the API reuses the two-party conversation"""
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.post('/api/messages/conversations/', {'participants': [self.bob.id]})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        
+        conversation = Conversation.objects.get()
+        self.assertEqual(
+            conversation.participant_key,
+            Conversation.build_participant_key([self.alice.id, self.bob.id])
+        )
+        self.assertEqual(self._start(self.bob, self.alice), conversation.id)
+    
+    def test_other_conflicts_are_not_swallowed(self):
+        """A clash on another unique constraint is an error, not a 500"""
+        owner = User.objects.create_user(
+            username='owner',
+            email='owner@test.com',
+            user_type='property_owner'
+        )
+        property_obj = Property.objects.create(
+            title='Test Property',
+            owner=owner,
+            rent_amount=5000,
+            deposit_amount=5000,
+            available_from=timezone.now().date(),
+            bedrooms=2,
+            bathrooms=1,
+            total_area=80,
+            is_active=True
+        )
+        Conversation.objects.get_or_create_for_participants(
+            [self.bob, owner], property=property_obj, status='active'
+        )
+        
+        from django.db import IntegrityError
+        with self.assertRaises(IntegrityError):
+            Conversation.objects.get_or_create_for_participants(
+                [self.alice, owner], property=property_obj, status='active'
+            )
+        
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.post('/api/messages/conversations/', {
+            'participants': [owner.id],
+            'property': property_obj.id,
+            'status': 'active'
+        })
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Conversation.objects.count(), 1)
+
+
+@override_settings(
+    CACHES=LOCAL_CACHES,
+    CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'
+)
+class UnreadDigestTestCase(TestCase):
+    """Test the unread-message email digest pipeline"""
+    
+    def setUp(self):
+        from .digest import UnreadDigestPipeline
+        self.pipeline = UnreadDigestPipeline(delay_minutes=15, window_minutes=60)
+        self.alice = User.objects.create_user(
+            username='alice',
+            email='alice@test.com',
+            user_type='student'
+        )
+        self.bob = User.objects.create_user(
+            username='bob',
+            email='bob@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+    
+    def _send(self, content, sender=None, minutes_ago=30):
+        message = Message.objects.create(
+            conversation=self.conversation, sender=sender or self.alice, content=content
+        )
+        Message.objects.filter(id=message.id).update(
+            created_at=timezone.now() - timedelta(minutes=minutes_ago)
+        )
+        return message
+    
+    def test_one_digest_per_recipient(self):
+        """Unread messages are grouped into one email and not sent twice"""
+        from django.core import mail
+        self._send('First')
+        self._send('Second')
+        self._send('Too recent', minutes_ago=1)
+        
+        stats = self.pipeline.run_once()
+        self.assertEqual(stats['emails'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        self.assertEqual(email.to, ['bob@test.com'])
+        self.assertIn('2 unread messages', email.subject)
+        self.assertIn('Second', email.body)
+        self.assertNotIn('Too recent', email.body)
+        
+        # Rescans start at the watermark
+        self.assertEqual(self.pipeline.run_once()['scanned'], 0)
+        self.assertEqual(len(mail.outbox), 1)
+    
+    def test_read_messages_are_skipped(self):
+        """Messages read before the pass are not emailed"""
+        from django.core import mail
+        self._send('Already seen')
+        self.conversation.mark_messages_as_read(self.bob)
+        
+        self.pipeline.run_once()
+        self.assertEqual(len(mail.outbox), 0)
+    
+    def test_window_defers_and_resumes(self):
+        """Users emailed recently wait for the next window, then get only new messages"""
+        from django.core import mail
+        from .models import UnreadDigestState
+        self._send('First')
+        self.pipeline.run_once()
+        
+        self._send('Later', minutes_ago=20)
+        self._send('Reply', sender=self.bob, minutes_ago=20)
+        stats = self.pipeline.run_once()
+        self.assertEqual(stats['deferred'], 1)
+        self.assertEqual([email.to for email in mail.outbox], [['bob@test.com'], ['alice@test.com']])
+        
+        UnreadDigestState.objects.filter(user=self.bob).update(
+            last_sent_at=timezone.now() - timedelta(hours=2)
+        )
+        self.pipeline.run_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn('Later', mail.outbox[2].body)
+        self.assertNotIn('First', mail.outbox[2].body)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ConversationDeltaTestCase(TestCase):
+    """Test the compact conversation list deltas"""
+    
+    def setUp(self):
+        from .consumers import ChatConsumer
+        self.sender = User.objects.create_user(
+            username='delta_sender',
+            email='delta_sender@test.com',
+            user_type='student'
+        )
+        self.recipient = User.objects.create_user(
+            username='delta_recipient',
+            email='delta_recipient@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.sender, self.recipient)
+        
+        self.consumer = ChatConsumer()
+        self.consumer.user = self.sender
+        self.consumer.conversation_id = self.conversation.id
+    
+    def test_frames_carry_preview_and_unread_count(self):
+        """Each participant gets a small frame with their own unread count"""
+        from .consumers import ChatConsumer, LIST_PREVIEW_LENGTH
+        Message.objects.create(conversation=self.conversation, sender=self.sender, content='Hi')
+        message = Message.objects.create(
+            conversation=self.conversation, sender=self.sender, content='x' * 500
+        )
+        
+        frames = ChatConsumer.build_list_delta_frames.__wrapped__(self.consumer, message)
+        
+        self.assertEqual(set(frames), {self.sender.id, self.recipient.id})
+        delta = json.loads(frames[self.recipient.id])
+        self.assertEqual(delta['type'], 'conversation_delta')
+        self.assertEqual(delta['conversation_id'], self.conversation.id)
+        self.assertEqual(delta['message_id'], message.id)
+        self.assertEqual(delta['sender_id'], self.sender.id)
+        self.assertEqual(len(delta['preview']), LIST_PREVIEW_LENGTH)
+        self.assertEqual(delta['unread_count'], 2)
+        self.assertEqual(json.loads(frames[self.sender.id])['unread_count'], 0)
+    
+    def test_list_consumer_forwards_frame(self):
+        """The list consumer sends the pre-encoded frame unchanged"""
+        from .consumers import ConversationListConsumer
+        consumer = ConversationListConsumer()
+        sent = []
+        
+        async def send(text_data=None, bytes_data=None, close=False):
+            sent.append(text_data)
+        consumer.send = send
+        
+        async_to_sync(consumer.conversation_delta)({'type': 'conversation_delta', 'frame': '{"a": 1}'})
+        
+        self.assertEqual(sent, ['{"a": 1}'])
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ResumeTestCase(TestCase):
+    """Test sequence numbers and resuming a chat stream"""
+    
+    def setUp(self):
+        from .consumers import ChatConsumer
+        cache.clear()
+        self.sender = User.objects.create_user(
+            username='resume_sender',
+            email='resume_sender@test.com',
+            user_type='student'
+        )
+        self.recipient = User.objects.create_user(
+            username='resume_recipient',
+            email='resume_recipient@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.sender, self.recipient)
+        
+        self.consumer = ChatConsumer()
+        self.consumer.user = self.recipient
+        self.consumer.conversation_id = self.conversation.id
+    
+    def _send(self, content):
+        return Message.objects.create(
+            conversation=self.conversation, sender=self.sender, content=content
+        )
+    
+    def _missed(self, last_sequence):
+        from .consumers import ChatConsumer
+        return ChatConsumer.get_missed_messages.__wrapped__(self.consumer, last_sequence)
+    
+    def test_sequences_are_per_conversation(self):
+        """Each conversation numbers its messages from 1"""
+        other = Conversation.objects.create()
+        first = self._send('One')
+        Message.objects.create(conversation=other, sender=self.sender, content='Elsewhere')
+        second = self._send('Two')
+        
+        self.assertEqual((first.sequence, second.sequence), (1, 2))
+        self.assertEqual(other.messages.get().sequence, 1)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_sequence, 2)
+    
+    def test_sequences_are_unique(self):
+        """A sequence number is taken once per conversation, whatever the time"""
+        from django.db import IntegrityError, transaction
+        first = self._send('One')
+        second = self._send('Two')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Message.objects.filter(pk=second.pk).update(
+                sequence=first.sequence,
+                created_at=first.created_at + timedelta(seconds=1)
+            )
+    
+    def test_resume_from_buffer(self):
+        """Buffered messages are replayed without touching the messages table"""
+        from .consumers import ChatConsumer
+        for content in ('One', 'Two', 'Three'):
+            message = self._send(content)
+            ChatConsumer.buffer_for_replay.__wrapped__(
+                self.consumer, message.sequence, {'id': message.id, 'buffered': True}
+            )
+        
+        latest, messages = self._missed(1)
+        
+        self.assertEqual(latest, 3)
+        self.assertEqual([m['buffered'] for m in messages], [True, True])
+        self.assertEqual(self._missed(3), (3, []))
+    
+    def test_resume_falls_back_to_database(self):
+        """Messages missing from the buffer are read by sequence"""
+        self._send('One')
+        second = self._send('Two')
+        
+        latest, messages = self._missed(1)
+        
+        self.assertEqual(latest, 2)
+        self.assertEqual([(m['id'], m['sequence']) for m in messages], [(second.id, 2)])
+    
+    def test_resync_when_too_far_behind(self):
+        """Clients beyond MAX_REPLAY are told to reload"""
+        from unittest import mock
+        from .consumers import ChatConsumer
+        with mock.patch.object(ChatConsumer, 'MAX_REPLAY', 1):
+            self._send('One')
+            self._send('Two')
+            self.assertEqual(self._missed(0), (2, None))
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ReadReceiptTestCase(APITestCase):
+    """Test read_by computed from per-participant read pointers"""
+    
+    def setUp(self):
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(
+                username=f'receipt_{name}',
+                email=f'receipt_{name}@test.com',
+                user_type='student'
+            )
+            for name in ('alice', 'bob', 'carol')
+        ]
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob, self.carol)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, sender=self.alice, content=f'Message {index}')
+            for index in range(3)
+        ]
+        self.url = f'/api/messages/conversations/{self.conversation.id}/messages/'
+    
+    def _read_by(self, user):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {message['id']: message['read_by'] for message in response.data['results']}
+    
+    def test_group_receipts(self):
+        """Each participant appears on the messages up to their pointer"""
+        from .services.conversation_state import ConversationStateService
+        ConversationStateService.mark_read(self.conversation.id, self.bob, up_to=self.messages[1])
+        ConversationStateService.mark_read(self.conversation.id, self.carol)
+        
+        read_by = self._read_by(self.alice)
+        
+        first, second, third = (message.id for message in self.messages)
+        self.assertEqual(read_by[first], sorted([self.bob.id, self.carol.id]))
+        self.assertEqual(read_by[second], sorted([self.bob.id, self.carol.id]))
+        self.assertEqual(read_by[third], [self.carol.id])
+    
+    def test_group_receipts_by_message_ids(self):
+        """A second reader's pointer moves although the messages are already read"""
+        from .services.conversation_state import ConversationStateService
+        message_ids = [message.id for message in self.messages]
+        self.assertEqual(ConversationStateService.mark_read(self.conversation.id, self.bob, message_ids), 3)
+        self.assertEqual(ConversationStateService.mark_read(self.conversation.id, self.carol, message_ids), 0)
+        
+        read_by = self._read_by(self.alice)
+        
+        for message_id in message_ids:
+            self.assertEqual(read_by[message_id], sorted([self.bob.id, self.carol.id]))
+    
+    def test_pointers_loaded_once_per_page(self):
+        """Serializing a page reads the pointers in a single query"""
+        from .serializers import MessageSerializer
+        messages = list(
+            Message.objects.filter(conversation=self.conversation).select_related('sender__university')
+        )
+        serializer = MessageSerializer(messages, many=True)
+        
+        with self.assertNumQueries(1):
+            data = serializer.data
+        
+        self.assertEqual([message['read_by'] for message in data], [[], [], []])
+
+
+@override_settings(CACHES=LOCAL_CACHES, CHANNEL_LAYERS=LOCAL_CHANNEL_LAYERS)
+class ModerationQueueTestCase(APITestCase):
+    """Test the moderation queue API"""
+    
+    def setUp(self):
+        from .models import ConversationFlag
+        self.moderator, self.other_moderator = [
+            User.objects.create_user(
+                username=name,
+                email=f'{name}@test.com',
+                user_type='student',
+                is_staff=True
+            )
+            for name in ('moderator', 'other_moderator')
+        ]
+        self.reporter = User.objects.create_user(
+            username='reporter',
+            email='reporter@test.com',
+            user_type='student'
+        )
+        self.conversation = Conversation.objects.create(has_flagged_content=True, flagged_at=timezone.now())
+        self.conversation.participants.add(self.reporter)
+        Message.objects.create(conversation=self.conversation, sender=self.reporter, content='Hello')
+        
+        # Created oldest first: spam, scam, spam
+        self.flags = [
+            ConversationFlag.objects.create(
+                conversation=self.conversation, flagged_by=self.reporter, reason=reason
+            )
+            for reason in ('spam', 'scam', 'spam')
+        ]
+        self.url = '/api/messages/moderation/flags/'
+        self.client.force_authenticate(user=self.moderator)
+    
+    def test_queue_order_and_pages(self):
+        """Most urgent first, then oldest first, across keyset pages"""
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first_page = [flag['id'] for flag in response.data['results']]
+        self.assertTrue(response.data['has_next'])
+        self.assertEqual(
+            response.data['results'][0]['conversation_details']['latest_message']['content'], 'Hello'
+        )
+        
+        response = self.client.get(response.data['next'])
+        second_page = [flag['id'] for flag in response.data['results']]
+        
+        self.assertEqual(first_page + second_page, [self.flags[1].id, self.flags[0].id, self.flags[2].id])
+        self.assertFalse(response.data['has_next'])
+    
+    def test_claims_do_not_overlap(self):
+        """Leased flags are not handed to another moderator until the lease expires"""
+        from .models import ConversationFlag
+        from .moderation import ModerationQueue
+        first = ModerationQueue.claim(self.moderator, 2)
+        second = ModerationQueue.claim(self.other_moderator, 2)
+        
+        self.assertEqual([flag.id for flag in first], [self.flags[1].id, self.flags[0].id])
+        self.assertEqual([flag.id for flag in second], [self.flags[2].id])
+        
+        ConversationFlag.objects.filter(id=self.flags[1].id).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        third = ModerationQueue.claim(self.other_moderator, 2)
+        self.assertEqual([flag.id for flag in third], [self.flags[1].id])
+    
+    def test_bulk_resolve(self):
+        """Resolving skips other moderators' leases and clears the conversation flag"""
+        from .moderation import ModerationQueue
+        ModerationQueue.claim(self.other_moderator, 1)
+        ids = [flag.id for flag in self.flags]
+        
+        response = self.client.post(self.url + 'resolve/', {'ids': ids, 'status': 'dismissed'}, format='json')
+        self.assertEqual(response.data, {'updated': 2, 'skipped': 1})
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.has_flagged_content)
+        self.assertIsNotNone(self.conversation.flagged_at)
+        
+        self.client.force_authenticate(user=self.other_moderator)
+        response = self.client.post(self.url + 'resolve/', {'ids': ids, 'status': 'resolved'}, format='json')
+        self.assertEqual(response.data, {'updated': 1, 'skipped': 2})
+        self.conversation.refresh_from_db()
+        self.assertFalse(self.conversation.has_flagged_content)
+        self.assertIsNone(self.conversation.flagged_at)
+    
+    def test_staff_only(self):
+        """Participants cannot browse the queue"""
+        self.client.force_authenticate(user=self.reporter)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
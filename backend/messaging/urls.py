@@ -6,12 +6,16 @@ from rest_framework_nested import routers
 app_name = 'messaging'
 
 def get_urlpatterns():
-    from .views import ConversationViewSet, MessageViewSet, MessageTemplateViewSet
+    from .views import (
+        AttachmentUploadViewSet, ConversationViewSet, MessageViewSet, MessageTemplateViewSet,
+        ModerationQueueViewSet
+    )
     
     # Main router
     router = routers.DefaultRouter()
     router.register(r'conversations', ConversationViewSet, basename='conversation')
     router.register(r'templates', MessageTemplateViewSet, basename='template')
+    router.register(r'moderation/flags', ModerationQueueViewSet, basename='moderation-flag')
     
     # Nested router for messages within conversations
     conversations_router = routers.NestedDefaultRouter(
@@ -24,6 +28,11 @@ def get_urlpatterns():
         MessageViewSet, 
         basename='conversation-messages'
     )
+    conversations_router.register(
+        r'uploads', 
+        AttachmentUploadViewSet, 
+        basename='conversation-uploads'
+    )
     
     return [
         path('', include(router.urls)),
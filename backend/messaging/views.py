@@ -4,22 +4,37 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Count, Max, F, Prefetch
+from django.db import IntegrityError, transaction
+from django.db.models import Q, Count, Max, Min, F, Prefetch
 from django.utils import timezone
-from django.core.cache import cache
-from .models import Conversation, Message, MessageTemplate, ConversationFlag
+from django.utils.http import parse_etags
+from .models import (
+    AttachmentUpload, Conversation, ConversationParticipantState, Message, MessageTemplate,
+    ConversationFlag
+)
 from .serializers import (
     ConversationSerializer, 
     ConversationDetailSerializer,
     MessageSerializer, 
     MessageTemplateSerializer,
-    ConversationFlagSerializer
+    ConversationFlagSerializer,
+    MessageSearchResultSerializer,
+    AttachmentUploadSerializer,
+    ModerationFlagSerializer
 )
 from properties.models import Property
 from accounts.models import User
 from .services.content_filter import MessageContentFilter
+from .services.change_log import ChangeLogService
+from .services.conversation_state import ConversationStateService
+from .services.search import MessageSearchService
+from .services.unread_counter import UnreadCounterService
+from .archive import ArchivedHistory
+from .attachments import AttachmentUploadError, AttachmentUploadService
+from .cache import ConversationContextCache, MessageCache, TemplateCache, TemplateUsageBuffer
 import logging
-from .pagination import MessageCursorPagination
+from .moderation import ModerationQueue
+from .pagination import MessageCursorPagination, ModerationQueuePagination
 from .permissions import IsConversationParticipant
 
 
@@ -41,31 +56,24 @@ class ConversationViewSet(viewsets.ModelViewSet):
         """Get conversations for authenticated user with optimized queries."""
         user = self.request.user
         
-        # Base queryset with select_related for optimization
+        # The user's participant state row carries the inbox counters,
+        # so no messages are scanned (see ConversationParticipantState)
         queryset = Conversation.objects.filter(
-            participants=user
-        ).select_related(
-            'property',
-            'property__owner'
-        ).prefetch_related(
-            'participants'
-        )
+            participant_states__user=user
+        ).with_details()
         
-        # Add annotations for better performance
         queryset = queryset.annotate(
-            message_count=Count('messages'),
-            last_message_time=Max('messages__created_at'),
-            unread_count=Count(
-                'messages',
-                filter=Q(messages__read=False) & ~Q(messages__sender=user)
-            )
+            message_count=F('participant_states__message_count'),
+            last_message_time=F('participant_states__last_message__created_at'),
+            unread_count=F('participant_states__unread_count'),
+            last_activity=F('participant_states__last_activity')
         )
         
         # Apply filters from query params
         queryset = self._apply_filters(queryset)
         
-        # Order by last activity
-        return queryset.order_by('-updated_at')
+        # Order by last activity (participant_inbox_idx)
+        return queryset.order_by('-last_activity', '-id')
     
     def _apply_filters(self, queryset):
         """Apply query parameter filters to queryset."""
@@ -94,6 +102,23 @@ class ConversationViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        """List conversations, served from the versioned per-user cache."""
+        filters = dict(request.query_params.items())
+        
+        etag = MessageCache.get_etag('user', request.user.id, filters)
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        
+        cache_key = MessageCache.user_conversations_key(request.user.id, filters)
+        cached = MessageCache.get_user_conversations(cache_key)
+        if cached is not None:
+            return _with_etag(Response(cached), etag)
+        
+        response = super().list(request, *args, **kwargs)
+        MessageCache.set_user_conversations(cache_key, response.data)
+        return _with_etag(response, etag)
+    
     def get_serializer_class(self):
         """Use detailed serializer for retrieve action."""
         if self.action == 'retrieve':
@@ -182,13 +207,19 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 )
         
         # Get or create conversation
-        conversation = self._get_or_create_conversation(
-            request.user, 
-            other_user, 
-            property_obj, 
-            conversation_type,
-            template_type
-        )
+        try:
+            conversation = self._get_or_create_conversation(
+                request.user, 
+                other_user, 
+                property_obj, 
+                conversation_type,
+                template_type
+            )
+        except IntegrityError:
+            return Response(
+                {'error': 'This conversation conflicts with an existing one'},
+                status=status.HTTP_409_CONFLICT
+            )
         
         # Filter message content
         filter_result = self.content_filter.analyze_message(message_text)
@@ -240,31 +271,18 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     def _get_or_create_conversation(self, user1, user2, property_obj, conv_type, template_type):
         """Get existing conversation or create new one."""
-        from django.db import transaction
+        conversation, created = Conversation.objects.get_or_create_for_participants(
+            [user1, user2],
+            property=property_obj,
+            conversation_type=conv_type,
+            initial_message_template=template_type or '',
+            status='pending_response' if conv_type == 'property_inquiry' else 'active'
+        )
         
-        with transaction.atomic():
-            # Build query for existing conversation
-            query = Q(participants=user1) & Q(participants=user2)
-            if property_obj:
-                query &= Q(property=property_obj)
-            
-            # Try to find existing conversation with select_for_update
-            conversation = Conversation.objects.select_for_update().filter(query).first()
-            
-            if conversation:
-                # Reactivate if archived
-                if conversation.status == 'archived':
-                    conversation.status = 'active'
-                    conversation.save(update_fields=['status'])
-            else:
-                # Create new conversation
-                conversation = Conversation.objects.create(
-                    conversation_type=conv_type,
-                    initial_message_template=template_type or '',
-                    status='pending_response' if conv_type == 'property_inquiry' else 'active',
-                    property=property_obj
-                )
-                conversation.participants.add(user1, user2)
+        if not created and conversation.status == 'archived':
+            # Reactivate if archived
+            conversation.status = 'active'
+            conversation.save(update_fields=['status'])
         
         return conversation
     
@@ -290,14 +308,14 @@ class ConversationViewSet(viewsets.ModelViewSet):
     
     def _track_template_usage(self, template_type):
         """Track usage of message template."""
-        try:
-            template = MessageTemplate.objects.get(
-                template_type=template_type,
-                is_active=True
-            )
-            template.increment_usage()
-        except MessageTemplate.DoesNotExist:
+        template_id = MessageTemplate.objects.filter(
+            template_type=template_type,
+            is_active=True
+        ).values_list('id', flat=True).first()
+        if template_id is None:
             logger.warning(f"Template type '{template_type}' not found")
+            return
+        TemplateUsageBuffer.record(template_id)
     
     @action(detail=True, methods=['post'], url_path='flag')
     def flag_conversation(self, request, pk=None):
@@ -359,71 +377,198 @@ class ConversationViewSet(viewsets.ModelViewSet):
             'messages_marked': updated_count
         })
     
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search across the user's conversations.
+        
+        Query params:
+        - q: search text (web search syntax: "phrase", -exclude, or)
+        - conversation: limit to one conversation
+        - cursor: next_cursor from the previous page
+        - page_size: results per page (max 50)
+        - all: staff only, search every conversation
+        """
+        conversation_id = request.query_params.get('conversation')
+        try:
+            conversation_id = int(conversation_id) if conversation_id else None
+        except (ValueError, TypeError):
+            conversation_id = None
+        
+        return _search_response(
+            request,
+            conversation_id=conversation_id,
+            all_conversations=request.query_params.get('all', '').lower() == 'true'
+        )
+    
+    @action(detail=False, methods=['get'], url_path='unread-total')
+    def unread_total(self, request):
+        """Unread messages across all conversations (badge count)."""
+        return Response({
+            'unread_count': UnreadCounterService.get_total(request.user.id)
+        })
+    
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Everything that changed in the user's conversations since a cursor.
+        
+        Query params:
+        - cursor: cursor from the previous sync (omit on first sync)
+        - limit: change log entries to consume (max 1000)
+        
+        Without a usable cursor, or after whole months of history were
+        dropped, the response is {"reset": true, "cursor"}: the client
+        reloads the conversation list and syncs from there.
+        Otherwise it gets the current state of every touched message and
+        conversation; keep calling while has_more is true.
+        """
+        user = request.user
+        cursor = request.query_params.get('cursor')
+        position = ChangeLogService.decode_cursor(cursor) if cursor else None
+        if position is None:
+            return Response({
+                'reset': True,
+                'cursor': ChangeLogService.encode_cursor(ChangeLogService.latest_position(user.id))
+            })
+        
+        try:
+            limit = int(request.query_params.get('limit', 500))
+        except (TypeError, ValueError):
+            limit = 500
+        
+        changes, has_more = ChangeLogService.changes_since(user.id, position, limit)
+        if any(change.kind == 'history_removed' for change in changes):
+            # Whole months of messages were dropped without per-row entries
+            return Response({
+                'reset': True,
+                'cursor': ChangeLogService.encode_cursor(ChangeLogService.latest_position(user.id))
+            })
+        if changes:
+            position = changes[-1].id
+        
+        message_ids = {change.message_id for change in changes if change.message_id}
+        conversation_ids = {change.conversation_id for change in changes}
+        read_conversation_ids = {
+            change.conversation_id for change in changes if change.kind == 'messages_read'
+        }
+        
+        # Current rows, not the logged events: several edits collapse into one
+        messages = list(
+            Message.objects.filter(
+                id__in=message_ids,
+                conversation__participants=user
+            ).select_related('sender', 'upload').order_by('created_at', 'id')
+        ) if message_ids else []
+        conversations = list(
+            self.get_queryset().filter(id__in=conversation_ids)
+        ) if conversation_ids else []
+        visible_ids = {conversation.id for conversation in conversations}
+        
+        read_states = ConversationParticipantState.objects.filter(
+            conversation_id__in=read_conversation_ids & visible_ids
+        ).values('conversation_id', 'user_id', 'last_read_message_id', 'last_read_sequence')
+        
+        # Hard-deleted rows are gone; their log entries remain
+        live_ids = {message.id for message in messages}
+        deleted_ids = {message.id for message in messages if message.is_deleted} | {
+            change.message_id for change in changes
+            if change.kind == 'message_deleted' and change.message_id not in live_ids
+            and change.conversation_id in visible_ids
+        }
+        
+        context = self.get_serializer_context()
+        # Read receipts of every message in the response, in one query
+        context['read_pointers'] = ConversationStateService.read_pointers(
+            {message.conversation_id for message in messages}
+        )
+        return Response({
+            'reset': False,
+            'cursor': ChangeLogService.encode_cursor(position),
+            'has_more': has_more,
+            'messages': MessageSerializer(
+                [message for message in messages if not message.is_deleted],
+                many=True,
+                context=context
+            ).data,
+            'deleted_messages': sorted(deleted_ids),
+            'read_states': list(read_states),
+            'conversations': ConversationSerializer(conversations, many=True, context=context).data,
+            'removed_conversations': sorted(conversation_ids - visible_ids),
+        })
+    
     @action(detail=True, methods=['get'])
     def stats(self, request, pk=None):
         """Get detailed conversation statistics."""
         conversation = self.get_object()
         
         # Use cached stats if available
-        cache_key = f'conv_stats_{conversation.id}_{request.user.id}'
-        cached_stats = cache.get(cache_key)
+        stats_key = MessageCache.conversation_stats_key(conversation.id, request.user.id)
+        cached_stats = MessageCache.get_conversation_stats(stats_key)
         if cached_stats:
             return Response(cached_stats)
         
-        # Calculate stats
-        messages = conversation.messages.select_related('sender')
+        # One grouped aggregate per sender covers every message-derived stat
+        activity = list(
+            conversation.messages.order_by().values('sender_id').annotate(
+                message_count=Count('id'),
+                first_message=Min('created_at'),
+                last_message=Max('created_at')
+            )
+        )
+        states = list(conversation.participant_states.values_list('user_id', 'unread_count'))
+        unread_count = dict(states).get(request.user.id)
+        if unread_count is None:
+            unread_count = conversation.get_unread_count(request.user)
+        
         stats = {
-            'total_messages': messages.count(),
-            'unread_count': conversation.get_unread_count(request.user),
-            'participant_count': conversation.participants.count(),
+            'total_messages': sum(row['message_count'] for row in activity),
+            'unread_count': unread_count,
+            'participant_count': len(states),
             'created_at': conversation.created_at,
             'last_activity': conversation.updated_at,
-            'has_property': bool(conversation.property),
+            'has_property': conversation.property_id is not None,
             'conversation_type': conversation.conversation_type,
             'status': conversation.status,
-            'message_frequency': self._calculate_message_frequency(messages),
-            'participant_activity': self._calculate_participant_activity(messages)
+            'message_frequency': self._calculate_message_frequency(activity),
+            'participant_activity': self._calculate_participant_activity(activity)
         }
         
         # Add response time if applicable
         if conversation.owner_response_time:
             stats['owner_response_time'] = conversation.owner_response_time.total_seconds()
         
-        # Cache for 5 minutes
-        cache.set(cache_key, stats, 300)
+        # Cached until the conversation's version changes (or 5 minutes)
+        MessageCache.set_conversation_stats(stats_key, stats)
         
         return Response(stats)
     
-    def _calculate_message_frequency(self, messages):
-        """Calculate message frequency stats."""
-        if messages.count() < 2:
+    def _calculate_message_frequency(self, activity):
+        """Calculate message frequency stats from per-sender aggregates."""
+        total = sum(row['message_count'] for row in activity)
+        if total < 2:
             return None
         
-        first_msg = messages.first()
-        last_msg = messages.last()
-        duration = (last_msg.created_at - first_msg.created_at).total_seconds()
+        first_at = min(row['first_message'] for row in activity)
+        last_at = max(row['last_message'] for row in activity)
+        duration = (last_at - first_at).total_seconds()
         
         if duration > 0:
             return {
-                'messages_per_hour': messages.count() / (duration / 3600),
-                'average_gap_minutes': (duration / 60) / (messages.count() - 1)
+                'messages_per_hour': total / (duration / 3600),
+                'average_gap_minutes': (duration / 60) / (total - 1)
             }
         return None
     
-    def _calculate_participant_activity(self, messages):
+    def _calculate_participant_activity(self, activity):
         """Calculate activity breakdown by participant."""
-        activity = {}
-        for msg in messages:
-            sender_id = str(msg.sender_id)
-            if sender_id not in activity:
-                activity[sender_id] = {
-                    'message_count': 0,
-                    'last_message': None
-                }
-            activity[sender_id]['message_count'] += 1
-            activity[sender_id]['last_message'] = msg.created_at
-        
-        return activity
+        return {
+            str(row['sender_id']): {
+                'message_count': row['message_count'],
+                'last_message': row['last_message']
+            }
+            for row in activity
+        }
 
 class MessageViewSet(viewsets.ModelViewSet):
     """
@@ -451,10 +596,9 @@ class MessageViewSet(viewsets.ModelViewSet):
             conversation_id=conversation_id
         ).select_related(
             'sender',
-            'sender__university'
-        ).prefetch_related(
-            'sender__profile_picture'
-        ).order_by('created_at')
+            'sender__university',
+            'upload'
+        ).order_by('created_at', 'id')
         
         # Mark undelivered messages as delivered
         undelivered = queryset.filter(
@@ -463,10 +607,13 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         # Bulk update for performance
         if undelivered.exists():
-            undelivered.update(
+            delivered = undelivered.update(
                 delivered=True,
                 delivered_at=timezone.now()
             )
+            if delivered:
+                # Senders polling the list must see the new delivery state
+                ConversationStateService.invalidate_caches(conversation.id)
         
         # Apply filters
         message_type = self.request.query_params.get('type')
@@ -489,6 +636,25 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def get_archived_history(self):
+        """Archived messages to merge into unfiltered history pages."""
+        filters = ('type', 'unread_only', 'since')
+        if any(self.request.query_params.get(name) for name in filters):
+            return None
+        return ArchivedHistory(int(self.kwargs.get('conversation_pk')))
+    
+    def list(self, request, *args, **kwargs):
+        """List messages; unchanged polls get 304 before any message query."""
+        # Access was checked by IsConversationParticipant
+        etag = MessageCache.get_etag(
+            'conv', int(self.kwargs.get('conversation_pk')),
+            request.user.id, dict(request.query_params.items())
+        )
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        
+        return _with_etag(super().list(request, *args, **kwargs), etag)
+    
     def create(self, request, *args, **kwargs):
         """Send a message to the conversation with content filtering."""
         conversation_id = self.kwargs.get('conversation_pk')
@@ -530,10 +696,9 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get conversation history for context-aware filtering
-        recent_messages = list(
-            conversation.messages.order_by('-created_at')
-            .values_list('content', flat=True)[:10]
+        # Recent conversation text for context-aware filtering (cached, oldest first)
+        recent_messages = ConversationContextCache.get_context(
+            conversation.id, self.content_filter.context_window
         )
         
         # Filter content with context
@@ -553,7 +718,8 @@ class MessageViewSet(viewsets.ModelViewSet):
                     conversation=conversation,
                     flagged_by=request.user,
                     reason=self._get_flag_reason(filter_result['violations']),
-                    description=f"Auto-flagged: {filter_result['violations']}"
+                    description=f"Auto-flagged: {filter_result['violations']}",
+                    priority=ConversationFlag.PRIORITY_CRITICAL
                 )
                 
                 # Update conversation status
@@ -587,9 +753,22 @@ class MessageViewSet(viewsets.ModelViewSet):
                 'filter_warnings': filter_result['violations']
             })
         
+        # Attach a finished chunked upload
+        upload_id = request.data.get('upload_id')
+        if upload_id:
+            try:
+                upload = AttachmentUploadService.get_ready_upload(upload_id, conversation, request.user)
+            except AttachmentUploadError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            message_data.update({
+                'attachment': upload.file.name,
+                'attachment_type': upload.content_type,
+                'upload': upload
+            })
+        
         # Handle attachments if provided
         attachment = request.FILES.get('attachment')
-        if attachment:
+        if attachment and not upload_id:
             # Validate file size and type
             if attachment.size > 10 * 1024 * 1024:  # 10MB limit
                 return Response(
@@ -608,7 +787,13 @@ class MessageViewSet(viewsets.ModelViewSet):
             message_data['attachment_type'] = attachment.content_type
         
         # Create message
-        message = Message.objects.create(**message_data)
+        try:
+            with transaction.atomic():
+                if upload_id:
+                    AttachmentUploadService.claim(message_data['upload'])
+                message = Message.objects.create(**message_data)
+        except AttachmentUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         # Update conversation status if needed
         self._update_conversation_status(conversation, request.user)
@@ -676,13 +861,8 @@ class MessageViewSet(viewsets.ModelViewSet):
             message.mark_as_read()
             
             # Also mark all previous messages as read
-            Message.objects.filter(
-                conversation_id=conversation_pk,
-                created_at__lte=message.created_at,
-                read=False
-            ).exclude(sender=request.user).update(
-                read=True,
-                read_at=timezone.now()
+            ConversationStateService.mark_read(
+                conversation_pk, request.user, up_to=message
             )
             
             return Response({'status': 'success', 'marked_count': 1})
@@ -695,13 +875,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post'], url_path='mark-all-read')
     def mark_all_read(self, request, conversation_pk=None):
         """Mark all messages in conversation as read."""
-        updated = Message.objects.filter(
-            conversation_id=conversation_pk,
-            read=False
-        ).exclude(sender=request.user).update(
-            read=True,
-            read_at=timezone.now()
-        )
+        updated = ConversationStateService.mark_read(conversation_pk, request.user)
         
         return Response({
             'status': 'success',
@@ -711,12 +885,219 @@ class MessageViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='unread-count')
     def unread_count(self, request, conversation_pk=None):
         """Get count of unread messages."""
-        count = Message.objects.filter(
-            conversation_id=conversation_pk,
-            read=False
-        ).exclude(sender=request.user).count()
+        count = ConversationStateService.get_unread_count(conversation_pk, request.user)
         
         return Response({'unread_count': count})
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request, conversation_pk=None):
+        """Full-text search within this conversation (see ConversationViewSet.search)."""
+        return _search_response(request, conversation_id=int(conversation_pk))
+
+
+def _etag_matches(request, etag):
+    """Whether If-None-Match names etag (weak comparison)."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    target = etag.removeprefix('W/')
+    return any(tag.removeprefix('W/') == target for tag in parse_etags(header))
+
+
+def _not_modified(etag):
+    return _with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+
+def _with_etag(response, etag):
+    response['ETag'] = etag
+    # Clients must revalidate, and shared caches must not store per-user lists
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _search_response(request, conversation_id=None, all_conversations=False):
+    """Run a message search from request params and serialize the page."""
+    text = request.query_params.get('q', '').strip()
+    if not text:
+        return Response(
+            {'error': 'Search query (q) is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        page_size = int(request.query_params.get('page_size', 0)) or None
+    except (ValueError, TypeError):
+        page_size = None
+    
+    page = MessageSearchService.search(
+        request.user,
+        text,
+        conversation_id=conversation_id,
+        cursor=request.query_params.get('cursor'),
+        page_size=page_size,
+        all_conversations=all_conversations
+    )
+    
+    return Response({
+        'results': MessageSearchResultSerializer(
+            page['results'], many=True, context={'request': request}
+        ).data,
+        'next_cursor': page['next_cursor'],
+        'has_next': page['next_cursor'] is not None,
+    })
+
+
+class AttachmentUploadViewSet(viewsets.GenericViewSet):
+    """
+    Chunked, resumable attachment uploads within a conversation.
+    
+    POST   uploads/                      start a session (filename, size)
+    GET    uploads/<id>/                 session state and received chunks
+    PUT    uploads/<id>/chunks/<index>/  raw chunk body
+    POST   uploads/<id>/complete/        queue for processing
+    
+    Once the upload is ready, send a message with its upload_id.
+    """
+    serializer_class = AttachmentUploadSerializer
+    permission_classes = [permissions.IsAuthenticated, IsConversationParticipant]
+    
+    def get_queryset(self):
+        return AttachmentUpload.objects.filter(
+            conversation_id=self.kwargs.get('conversation_pk'),
+            uploader=self.request.user
+        )
+    
+    def create(self, request, conversation_pk=None):
+        """Start an upload session."""
+        conversation = get_object_or_404(Conversation, id=conversation_pk, participants=request.user)
+        try:
+            upload = AttachmentUploadService.initiate(
+                conversation,
+                request.user,
+                request.data.get('filename'),
+                request.data.get('size')
+            )
+        except AttachmentUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(self.get_serializer(upload).data, status=status.HTTP_201_CREATED)
+    
+    def retrieve(self, request, pk=None, conversation_pk=None):
+        """Session state, used to resume or to wait for processing."""
+        return Response(self.get_serializer(self.get_object()).data)
+    
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, index=None, pk=None, conversation_pk=None):
+        """Receive one chunk as the raw request body."""
+        upload = self.get_object()
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        
+        try:
+            # The body is streamed to storage, never parsed into request.data
+            upload = AttachmentUploadService.store_chunk(upload, int(index), request.stream, length)
+        except AttachmentUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'received_chunks': upload.received_chunks,
+            'chunk_count': upload.chunk_count
+        })
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None, conversation_pk=None):
+        """Finish uploading; processing continues in the background."""
+        try:
+            upload = AttachmentUploadService.complete(self.get_object())
+        except AttachmentUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(self.get_serializer(upload).data, status=status.HTTP_202_ACCEPTED)
+
+
+class ModerationQueueViewSet(viewsets.GenericViewSet):
+    """
+    Moderation queue over conversation flags, for staff.
+    
+    GET    moderation/flags/?status=pending  flags in review order (keyset pages)
+    POST   moderation/flags/claim/           lease the next flags (limit)
+    POST   moderation/flags/release/         return leased flags (ids)
+    POST   moderation/flags/resolve/         close flags (ids, status, review_notes, action_taken)
+    """
+    serializer_class = ModerationFlagSerializer
+    permission_classes = [permissions.IsAdminUser]
+    pagination_class = ModerationQueuePagination
+    
+    def get_queryset(self):
+        flag_status = self.request.query_params.get('status', 'pending')
+        if flag_status not in dict(ConversationFlag.STATUS_CHOICES):
+            flag_status = 'pending'
+        return ModerationQueue.queue(flag_status)
+    
+    def list(self, request):
+        """Flags of one status, most urgent first."""
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+    
+    @action(detail=False, methods=['post'])
+    def claim(self, request):
+        """Lease the next flags in the queue to the requesting moderator."""
+        try:
+            limit = int(request.data.get('limit', 10))
+        except (TypeError, ValueError):
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        flags = ModerationQueue.claim(request.user, limit)
+        return Response({
+            'lease_seconds': ModerationQueue.LEASE_SECONDS,
+            'results': self.get_serializer(flags, many=True).data
+        })
+    
+    @action(detail=False, methods=['post'])
+    def release(self, request):
+        """Hand leased flags back to the queue."""
+        flag_ids = self._flag_ids(request)
+        if flag_ids is None:
+            return Response({'error': 'ids must be a list of flag ids'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({'released': ModerationQueue.release(request.user, flag_ids)})
+    
+    @action(detail=False, methods=['post'])
+    def resolve(self, request):
+        """Resolve or dismiss flags in bulk."""
+        flag_ids = self._flag_ids(request)
+        if flag_ids is None:
+            return Response({'error': 'ids must be a list of flag ids'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        flag_status = request.data.get('status', 'resolved')
+        if flag_status not in ModerationQueue.CLOSED_STATUSES:
+            return Response(
+                {'error': f"status must be one of {', '.join(ModerationQueue.CLOSED_STATUSES)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        updated = ModerationQueue.resolve(
+            request.user,
+            flag_ids,
+            flag_status,
+            review_notes=request.data.get('review_notes', ''),
+            action_taken=request.data.get('action_taken', '')
+        )
+        return Response({'updated': updated, 'skipped': len(flag_ids) - updated})
+    
+    @staticmethod
+    def _flag_ids(request):
+        flag_ids = request.data.get('ids')
+        if not isinstance(flag_ids, list):
+            return None
+        try:
+            return list({int(flag_id) for flag_id in flag_ids})
+        except (TypeError, ValueError):
+            return None
 
 
 class MessageTemplateViewSet(viewsets.ReadOnlyModelViewSet):
@@ -731,18 +1112,7 @@ class MessageTemplateViewSet(viewsets.ReadOnlyModelViewSet):
     
     def get_queryset(self):
         """Get active templates with filtering."""
-        # Use cached templates if available
-        cache_key = 'active_message_templates'
-        cached_templates = cache.get(cache_key)
-        
-        if cached_templates is not None:
-            queryset = MessageTemplate.objects.filter(
-                id__in=[t.id for t in cached_templates]
-            )
-        else:
-            queryset = MessageTemplate.objects.filter(is_active=True)
-            # Cache for 1 hour
-            cache.set(cache_key, list(queryset), 3600)
+        queryset = MessageTemplate.objects.filter(is_active=True)
         
         # Apply filters
         template_type = self.request.query_params.get('type')
@@ -757,20 +1127,56 @@ class MessageTemplateViewSet(viewsets.ReadOnlyModelViewSet):
             )
         
         # Language preference
-        language = self.request.query_params.get('lang', 'en')
-        if language == 'es':
+        if self._get_language() == 'es':
             # Prioritize templates with Spanish translations
             queryset = queryset.exclude(content_es='')
         
         return queryset.order_by('order', 'title')
     
+    def list(self, request, *args, **kwargs):
+        """List templates from the serialized payload cache."""
+        template_type = request.query_params.get('type', '')
+        property_type = request.query_params.get('property_type', '')
+        
+        # Only known filters get cached; anything else would grow the cache
+        if template_type and template_type not in dict(MessageTemplate.TEMPLATE_TYPES):
+            return Response(
+                {'error': 'Invalid template type'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if property_type and property_type not in Property.PropertyType.values:
+            return Response(
+                {'error': 'Invalid property type'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        cache_args = (template_type, property_type, self._get_language())
+        payload = TemplateCache.get(*cache_args)
+        if payload is None:
+            payload = list(self.get_serializer(self.get_queryset(), many=True).data)
+            TemplateCache.set(*cache_args, payload)
+        
+        page = self.paginate_queryset(payload)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(payload)
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['language'] = self._get_language()
+        return context
+    
+    def _get_language(self):
+        """Language from ?lang=, falling back to the request locale."""
+        language = self.request.query_params.get('lang') or getattr(self.request, 'LANGUAGE_CODE', 'en')
+        return 'es' if language.startswith('es') else 'en'
+    
     @action(detail=True, methods=['post'], url_path='track-usage')
     def track_usage(self, request, pk=None):
         """Track template usage."""
         template = self.get_object()
-        template.increment_usage()
         
-        # Clear template cache
-        cache.delete('active_message_templates')
+        # Buffered; never invalidates the template cache
+        TemplateUsageBuffer.record(template.id)
         
         return Response({'status': 'Usage tracked'})
@@ -65,14 +65,22 @@ ASGI_APPLICATION = 'micalli_backend.asgi.application'
 
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        # Wraps the Redis layer to measure backpressure and detect slow consumers
+        'BACKEND': 'messaging.channel_layer.MonitoredChannelLayer',
         'CONFIG': {
-            "hosts": [(os.environ.get('REDIS_HOST', 'redis'), 6379)],
-            "capacity": 1500,
-            "expiry": 10,
-            # Note: removed connection_pool_kwargs as it's not supported
-            # Note: removed symmetric_encryption_keys as it may not be needed
-            # Note: removed group_expiry as it may not be supported in your version
+            'backend': 'channels_redis.core.RedisChannelLayer',
+            'config': {
+                "hosts": [(os.environ.get('REDIS_HOST', 'redis'), 6379)],
+                "capacity": 1500,
+                "expiry": 10,
+                # Note: removed connection_pool_kwargs as it's not supported
+                # Note: removed symmetric_encryption_keys as it may not be needed
+                # Note: removed group_expiry as it may not be supported in your version
+            },
+            # Events older than this (seconds) while the queue keeps growing
+            # count against a consumer; after 5 strikes it is asked to resync
+            'slow_consumer_lag': 2.0,
+            'slow_consumer_strikes': 5,
         },
     },
 }
@@ -212,6 +220,33 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cold storage for archived conversation messages: an S3-compatible
+# bucket when MESSAGE_ARCHIVE_BUCKET is set, local files otherwise
+if os.environ.get('MESSAGE_ARCHIVE_BUCKET'):
+    MESSAGE_ARCHIVE_STORAGE = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': os.environ.get('MESSAGE_ARCHIVE_BUCKET'),
+            'endpoint_url': os.environ.get('MESSAGE_ARCHIVE_ENDPOINT_URL'),
+            'location': os.environ.get('MESSAGE_ARCHIVE_PREFIX', 'message-archive'),
+            'default_acl': 'private',
+            'querystring_auth': True,
+        },
+    }
+else:
+    MESSAGE_ARCHIVE_STORAGE = {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': os.environ.get('MESSAGE_ARCHIVE_ROOT', BASE_DIR / 'message_archive'),
+        },
+    }
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'message_archive': MESSAGE_ARCHIVE_STORAGE,
+}
+
 # Maximum upload size (in bytes) - 10MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 
@@ -388,3 +423,11 @@ WEBSOCKET_RECEIVE_TIMEOUT = 60  # seconds
 WEBSOCKET_SEND_TIMEOUT = 10  # seconds
 WEBSOCKET_AUTH_TIMEOUT = 300  # 5 minutes
 
+# Graceful draining on SIGTERM: close sockets in WAVES spread over PERIOD
+# seconds, clients reconnect up to JITTER seconds after their wave
+WEBSOCKET_DRAIN = {
+    'PERIOD': int(os.environ.get('WEBSOCKET_DRAIN_PERIOD', 30)),
+    'WAVES': 10,
+    'JITTER': 2.0,
+}
+
@@ -16,6 +16,7 @@ from .serializers import (
 from .permissions import IsOwnerOrReadOnly
 from rest_framework.parsers import MultiPartParser, FormParser
 from messaging.models import Conversation, Message
+from messaging.services.unread_counter import UnreadCounterService
 
 class PropertyViewSet(viewsets.ModelViewSet):
     # Remove the filtering from get_queryset for retrieve operations
@@ -320,11 +321,8 @@ class PropertyViewSet(viewsets.ModelViewSet):
         # Get count of owner's properties
         property_count = Property.objects.filter(owner=request.user).count()
         
-        # Get unread messages count
-        unread_messages = Message.objects.filter(
-            conversation__participants=request.user,
-            read=False
-        ).exclude(sender=request.user).count()
+        # Get unread messages count (cached badge counter)
+        unread_messages = UnreadCounterService.get_total(request.user.id)
         
         # Get recent activity
         recent_messages = Message.objects.filter(
@@ -42,6 +42,16 @@ export function useConversation(
   const hasFetchedRef = useRef(false);
   const onUnauthorizedRef = useRef(onUnauthorized);
   
+  // Highest message sequence seen, sent in a resume frame on reconnect
+  const lastSequenceRef = useRef(0);
+  const trackSequence = (messages: Message[]) => {
+    for (const m of messages) {
+      if (m.sequence && m.sequence > lastSequenceRef.current) {
+        lastSequenceRef.current = m.sequence;
+      }
+    }
+  };
+  
   // Update ref when onUnauthorized changes
   useEffect(() => {
     onUnauthorizedRef.current = onUnauthorized;
@@ -57,6 +67,10 @@ export function useConversation(
       onMessage: handleWebSocketMessage,
       onConnect: () => {
         console.log('Connected to conversation WebSocket');
+        // Catch up on anything missed while disconnected
+        if (lastSequenceRef.current > 0) {
+          sendWebSocketMessage({ type: 'resume', last_sequence: lastSequenceRef.current });
+        }
       },
       onDisconnect: () => {
         console.log('Disconnected from conversation WebSocket');
@@ -90,6 +104,15 @@ export function useConversation(
         handleMessageSent(message.temp_id, message.message_id);
         break;
         
+      case 'resume_result':
+        message.messages.forEach((m: Message) => handleNewMessage(m));
+        break;
+        
+      case 'resync_required':
+        hasFetchedRef.current = false;
+        fetchConversation();
+        break;
+        
       default:
         console.log('Unknown WebSocket message type:', message.type);
     }
@@ -97,6 +120,7 @@ export function useConversation(
 
   // WebSocket message handlers
   const handleNewMessage = useCallback((messageData: Message) => {
+    trackSequence([messageData]);
     setConversation(prev => {
       if (!prev) return prev;
       
@@ -206,6 +230,7 @@ export function useConversation(
       
       const response = await apiService.messaging.getConversation(conversationId);
       setConversation(response.data);
+      trackSequence(response.data.messages);
       
       // Track response time for pending conversations
       if (response.data.status === 'pending_response' && !conversationStartTimeRef.current) {
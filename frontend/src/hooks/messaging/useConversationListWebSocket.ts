@@ -2,19 +2,24 @@
 import { useEffect, useRef } from 'react';
 import { getWebSocketUrl, WebSocketError, wsManager } from '@/utils/websocket';
 import type { Conversation, Message } from '@/types/api';
+import type { ConversationDeltaEvent } from '@/types/websocket';
 
 interface UseConversationListWebSocketOptions {
   conversations: Conversation[];
   setConversations: React.Dispatch<React.SetStateAction<Conversation[]>>;
   userId: number;
+  onUnreadCountChange?: (unreadCount: number) => void;
 }
 
 export function useConversationListWebSocket({
   conversations,
   setConversations,
   userId,
+  onUnreadCountChange,
 }: UseConversationListWebSocketOptions) {
   const connectionKeyRef = useRef<string>('');
+  const onUnreadCountChangeRef = useRef(onUnreadCountChange);
+  onUnreadCountChangeRef.current = onUnreadCountChange;
   
   useEffect(() => {
     if (!userId) {
@@ -26,6 +31,7 @@ export function useConversationListWebSocket({
     let isIntentionalClose = false;
     let reconnectTimeout: NodeJS.Timeout;
     let reconnectAttempts = 0;
+    let drainReconnectAt: number | null = null;
     const maxReconnectAttempts = 5;
     
     const connect = () => {
@@ -47,9 +53,18 @@ export function useConversationListWebSocket({
               const data = JSON.parse(event.data);
               console.log('📨 Received WebSocket message:', data.type);
               
+              // Server is restarting: remember when to come back
+              if (data.type === 'reconnect') {
+                drainReconnectAt = Date.now() + data.reconnect_after_ms;
+                return;
+              }
+              
               // Handle connection_established separately
               if (data.type === 'connection_established') {
                 console.log('Connection established for user:', data.user_id);
+                if (typeof data.unread_count === 'number') {
+                  onUnreadCountChangeRef.current?.(data.unread_count);
+                }
                 return;
               }
               
@@ -72,6 +87,15 @@ export function useConversationListWebSocket({
               return;
             }
             
+            // Server drained this connection; reconnect at the time it asked for
+            if (!isIntentionalClose && drainReconnectAt !== null) {
+              const delay = Math.max(0, drainReconnectAt - Date.now());
+              drainReconnectAt = null;
+              console.log(`⏱️ Server restarting, reconnecting in ${delay}ms`);
+              reconnectTimeout = setTimeout(connect, delay);
+              return;
+            }
+            
             // Only reconnect if not intentionally closed and under max attempts
             if (!isIntentionalClose && event.code !== 1000 && reconnectAttempts < maxReconnectAttempts) {
               reconnectAttempts++;
@@ -105,9 +129,17 @@ export function useConversationListWebSocket({
           handleNewMessage(data.conversation_id, data.message);
           break;
           
+        case 'conversation_delta':
+          handleConversationDelta(data);
+          break;
+          
         case 'conversation_status_changed':
           updateConversationStatus(data.conversation_id, data.status);
           break;
+          
+        case 'unread_count':
+          onUnreadCountChangeRef.current?.(data.unread_count);
+          break;
       }
     };
     
@@ -157,6 +189,41 @@ export function useConversationListWebSocket({
       }
     };
     
+    const handleConversationDelta = (delta: ConversationDeltaEvent) => {
+      setConversations(prev => {
+        const newConversations = prev.map(conv => {
+          if (conv.id === delta.conversation_id) {
+            return {
+              ...conv,
+              latestMessage: {
+                ...conv.latestMessage,
+                id: delta.message_id,
+                sender: delta.sender_id,
+                content: delta.preview,
+                hasFilteredContent: false,
+                createdAt: delta.created_at,
+              } as Message,
+              updatedAt: delta.created_at,
+              unreadCount: delta.unread_count,
+            };
+          }
+          return conv;
+        });
+        
+        // Sort by latest message
+        return newConversations.sort((a, b) => 
+          new Date(b.updatedAt).getTime() - new Date(a.updatedAt).getTime()
+        );
+      });
+      
+      // Show notification for new messages
+      if (delta.sender_id !== userId && document.hidden) {
+        const audio = new Audio('/sounds/notification.mp3');
+        audio.volume = 0.5;
+        audio.play().catch(() => {});
+      }
+    };
+    
     const updateConversationStatus = (conversationId: number, status: string) => {
       setConversations(prev => 
         prev.map(conv => 
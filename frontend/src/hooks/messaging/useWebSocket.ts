@@ -42,6 +42,7 @@ export function useWebSocket(
   const socketRef = useRef<WebSocket | null>(null);
   const reconnectTimeoutRef = useRef<NodeJS.Timeout | null>(null);
   const reconnectCountRef = useRef(0);
+  const drainReconnectAtRef = useRef<number | null>(null);
   const heartbeatIntervalRef = useRef<NodeJS.Timeout | null>(null);
   const isIntentionalClose = useRef(false);
   const connectionKey = useRef<string>('');
@@ -126,6 +127,12 @@ export function useWebSocket(
             return;
           }
           
+          // Server is restarting: remember when to come back
+          if (message.type === 'reconnect') {
+            drainReconnectAtRef.current = Date.now() + message.reconnect_after_ms;
+            return;
+          }
+          
           // Handle connection_established message
           if (message.type === 'connection_established') {
             console.log('Connection established:', message);
@@ -174,6 +181,17 @@ export function useWebSocket(
           return;
         }
 
+        // Server drained this connection; reconnect at the time it asked for
+        if (drainReconnectAtRef.current !== null) {
+          const delay = Math.max(0, drainReconnectAtRef.current - Date.now());
+          drainReconnectAtRef.current = null;
+          console.log(`Server restarting, reconnecting in ${delay}ms`);
+          reconnectTimeoutRef.current = setTimeout(() => {
+            connect();
+          }, delay);
+          return;
+        }
+
         // Attempt reconnection with exponential backoff
         if (reconnectCountRef.current < reconnectAttempts) {
           reconnectCountRef.current++;
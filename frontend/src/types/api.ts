@@ -384,6 +384,7 @@ export interface Message {
   isEdited: boolean; // Computed (always false currently)
   canEdit: boolean; // Computed based on time
   readBy: number[]; // Array of user IDs who read the message
+  sequence?: number; // Position in the conversation, used to resume the chat stream
   conversation?: number; // Only in write operations
 }
 
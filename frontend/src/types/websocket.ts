@@ -18,6 +18,17 @@ export interface NewMessageEvent extends BaseWebSocketMessage {
   message: Message;
 }
 
+// Compact conversation list update for a new message
+export interface ConversationDeltaEvent extends BaseWebSocketMessage {
+  type: 'conversation_delta';
+  conversation_id: number;
+  message_id: number;
+  sender_id: number;
+  preview: string;
+  created_at: string;
+  unread_count: number;
+}
+
 export interface TypingEvent extends BaseWebSocketMessage {
   type: 'user_typing';
   user_id: number;
@@ -48,14 +59,41 @@ export interface ErrorEvent extends BaseWebSocketMessage {
   code?: string;
 }
 
+export interface ReconnectEvent extends BaseWebSocketMessage {
+  type: 'reconnect';
+  reason: string;
+  reconnect_after_ms: number;
+}
+
+export interface UnreadCountEvent extends BaseWebSocketMessage {
+  type: 'unread_count';
+  unread_count: number;
+}
+
+export interface ResumeResultEvent extends BaseWebSocketMessage {
+  type: 'resume_result';
+  messages: Message[];
+  last_sequence: number;
+}
+
+export interface ResyncRequiredEvent extends BaseWebSocketMessage {
+  type: 'resync_required';
+  last_sequence: number;
+}
+
 export type WebSocketMessage =
   | MessageSentEvent
   | NewMessageEvent
+  | ConversationDeltaEvent
   | TypingEvent
   | ReadReceiptEvent
   | OnlineStatusEvent
   | ConversationUpdateEvent
-  | ErrorEvent;
+  | ErrorEvent
+  | ReconnectEvent
+  | UnreadCountEvent
+  | ResumeResultEvent
+  | ResyncRequiredEvent;
 
 // Client to server messages
 export interface SendMessageCommand {
@@ -74,10 +112,16 @@ export interface MarkReadCommand {
   message_ids: number[];
 }
 
+export interface ResumeCommand {
+  type: 'resume';
+  last_sequence: number;
+}
+
 export type WebSocketCommand =
   | SendMessageCommand
   | TypingCommand
-  | MarkReadCommand;
+  | MarkReadCommand
+  | ResumeCommand;
 
 
 